@@ -1,3 +1,7 @@
+-- A full rebuild invalidates the state kept by
+-- roadflood_update_dynamic_tables_incremental.sql
+DROP TABLE IF EXISTS t_incremental_state;
+
 DROP TABLE IF EXISTS t_flow_per_nextgen;
 
 CREATE TABLE t_flow_per_nextgen AS
@@ -11,35 +15,31 @@ crosswalked AS (
     JOIN t_nextgen_to_nwm x ON u.nextgen_id = x.nextgen_id
 ),
 flows_with_array AS (
+    -- revised 2025.07.20: t_flow_forecast holds the whole horizon of the
+    -- NWM product as flow_array (18 hourly values for short_range, 80
+    -- three-hourly for medium_range); step_hours converts index to hours
     SELECT
         c.nextgen_id,
         f.feature_id,
         f.model_run_time,
-        ARRAY[
-            flow_t00, flow_t01, flow_t02, flow_t03, flow_t04, flow_t05,
-            flow_t06, flow_t07, flow_t08, flow_t09, flow_t10, flow_t11,
-            flow_t12, flow_t13, flow_t14, flow_t15, flow_t16, flow_t17
-        ] AS flow_array
+        f.flow_array,
+        f.step_hours
     FROM crosswalked c
     JOIN t_flow_forecast f ON c.feature_id = f.feature_id
 )
 SELECT
-    nextgen_id,
-    feature_id,
-    model_run_time,
-    flow_array,
-    (
-        SELECT MAX(val) FROM unnest(flow_array) AS val
-    ) AS max_flow,
-    (
-        SELECT i - 1
-        FROM generate_subscripts(flow_array, 1) AS i
-        WHERE flow_array[i] = (
-            SELECT MAX(val) FROM unnest(flow_array) AS val
-        )
-        LIMIT 1
-    ) AS max_hour
-FROM flows_with_array;
+    w.nextgen_id,
+    w.feature_id,
+    w.model_run_time,
+    w.flow_array,
+    w.step_hours,
+    p.max_flow,
+    -- one pass for the peak, first time step that reaches it
+    (array_position(w.flow_array, p.max_flow) - 1) * w.step_hours AS max_hour
+FROM flows_with_array w
+CROSS JOIN LATERAL (
+    SELECT MAX(val) AS max_flow FROM unnest(w.flow_array) AS val
+) p;
 
 CREATE INDEX idx_t_flow_per_nextgen_nextgen_id ON t_flow_per_nextgen(nextgen_id);
 
@@ -105,12 +105,29 @@ WITH below_trigger_roads AS (
     SELECT 
         ft.*, 
         mf.max_flow, 
-        mf.model_run_time
+        mf.model_run_time,
+        tm.onset_hour,
+        tm.flood_hours,
+        tm.recede_hour
     FROM 
         t_road_flood_trigger ft
     LEFT JOIN 
         t_flow_per_nextgen mf 
         ON ft.nextgen_id = mf.nextgen_id
+    -- revised 2025.07.24: when the road floods, from the whole flow_array --
+    -- one set-based pass over the trigger x time step pairs (unnest WITH
+    -- ORDINALITY).  Hours count from the first forecast step like max_hour;
+    -- recede_hour is the step after the last flooded one, NULL if the road is
+    -- still flooded at the end of the forecast
+    CROSS JOIN LATERAL (
+        SELECT
+            (MIN(h.n) - 1) * mf.step_hours AS onset_hour,
+            COUNT(*) * mf.step_hours AS flood_hours,
+            CASE WHEN MAX(h.n) < cardinality(mf.flow_array)
+                 THEN MAX(h.n) * mf.step_hours END AS recede_hour
+        FROM unnest(mf.flow_array) WITH ORDINALITY AS h(flow, n)
+        WHERE h.flow > ft.min_flood_flow
+    ) tm
     WHERE 
         ft.min_flood_flow < mf.max_flow
 ),
@@ -125,7 +142,10 @@ joined_roads AS (
         btr.nextgen_id, 
         btr.min_flood_flow, 
         btr.max_flow, 
-        btr.model_run_time
+        btr.model_run_time,
+        btr.onset_hour,
+        btr.flood_hours,
+        btr.recede_hour
     FROM 
         below_trigger_roads btr
     JOIN 
@@ -182,6 +202,9 @@ SELECT
     r.min_flood_flow,
     r.max_flow,
     r.model_run_time,
+    r.onset_hour,
+    r.flood_hours,
+    r.recede_hour,
     ST_Intersection(r.geometry, f.geometry) AS geometry,
 	ROUND(ST_Length(ST_Transform(ST_Intersection(r.geometry, f.geometry), 3857)) * 3.28084) AS length_ft
 FROM
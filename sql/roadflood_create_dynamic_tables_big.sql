@@ -3,7 +3,13 @@
 SET statement_timeout TO '3min';
 
 -- Acquire an advisory lock to prevent concurrent executions
-SELECT pg_advisory_lock(20250628);
+-- revised 2025.07.21: the key is fast.lock_key when the session sets it
+-- (one per cycle schema in backfill_historical.py), else the shared key
+SELECT pg_advisory_lock(COALESCE(NULLIF(current_setting('fast.lock_key', true), '')::bigint, 20250628));
+
+-- A full rebuild invalidates the state kept by
+-- roadflood_update_dynamic_tables_incremental.sql
+DROP TABLE IF EXISTS t_incremental_state;
 
 -- ITEM #0
 -- Establish flows per stream
@@ -12,8 +18,8 @@ DROP TABLE IF EXISTS t_flow_per_nextgen;
 
 CREATE TABLE t_flow_per_nextgen AS
 WITH unique_ids AS (
-    SELECT DISTINCT nextgen_id::text AS nextgen_id
-    FROM s_flood_inundation_ar
+    SELECT nextgen_id
+    FROM t_flood_flow_step
 ),
 crosswalked AS (
     SELECT u.nextgen_id, x.feature_id
@@ -21,35 +27,31 @@ crosswalked AS (
     JOIN t_nextgen_to_nwm x ON u.nextgen_id = x.nextgen_id
 ),
 flows_with_array AS (
+    -- revised 2025.07.20: t_flow_forecast holds the whole horizon of the
+    -- NWM product as flow_array (18 hourly values for short_range, 80
+    -- three-hourly for medium_range); step_hours converts index to hours
     SELECT
         c.nextgen_id,
         f.feature_id,
         f.model_run_time,
-        ARRAY[
-            flow_t00, flow_t01, flow_t02, flow_t03, flow_t04, flow_t05,
-            flow_t06, flow_t07, flow_t08, flow_t09, flow_t10, flow_t11,
-            flow_t12, flow_t13, flow_t14, flow_t15, flow_t16, flow_t17
-        ] AS flow_array
+        f.flow_array,
+        f.step_hours
     FROM crosswalked c
     JOIN t_flow_forecast f ON c.feature_id = f.feature_id
 )
 SELECT
-    nextgen_id,
-    feature_id,
-    model_run_time,
-    flow_array,
-    (
-        SELECT MAX(val) FROM unnest(flow_array) AS val
-    ) AS max_flow,
-    (
-        SELECT i - 1
-        FROM generate_subscripts(flow_array, 1) AS i
-        WHERE flow_array[i] = (
-            SELECT MAX(val) FROM unnest(flow_array) AS val
-        )
-        LIMIT 1
-    ) AS max_hour
-FROM flows_with_array;
+    w.nextgen_id,
+    w.feature_id,
+    w.model_run_time,
+    w.flow_array,
+    w.step_hours,
+    p.max_flow,
+    -- one pass for the peak, first time step that reaches it
+    (array_position(w.flow_array, p.max_flow) - 1) * w.step_hours AS max_hour
+FROM flows_with_array w
+CROSS JOIN LATERAL (
+    SELECT MAX(val) AS max_flow FROM unnest(w.flow_array) AS val
+) p;
 
 CREATE INDEX idx_t_flow_per_nextgen_nextgen_id ON t_flow_per_nextgen(nextgen_id);
 
@@ -85,26 +87,31 @@ SET
 */
 
 -- ITEM #1
--- select the appropriate flood area polygons -- 29 seconds (11528 polys from 397k)
+-- select the appropriate flood area polygons
+-- keyed lookup on the static t_flood_flow_step (roadflood_create_static_tables.sql):
+-- width_bucket() is a binary search of max_flow on the sorted flow steps
 DROP TABLE IF EXISTS s_selected_flood_ar;
 
--- Composite index on nextgen_id and flow DESC helps with both filtering and ordering
-CREATE INDEX IF NOT EXISTS idx_flood_inundation_ar_nextgen_flow
-ON s_flood_inundation_ar(nextgen_id, flow DESC);
-
 CREATE TABLE s_selected_flood_ar AS
-SELECT DISTINCT ON (t.nextgen_id)
+SELECT
     t.nextgen_id,
     t.max_flow,
     t.model_run_time,
     t.max_hour,
     s.flow,
+    s.flood_ar_id,
     s.geometry
 FROM t_flow_per_nextgen t
+JOIN t_flood_flow_step k
+  ON k.nextgen_id = t.nextgen_id
+CROSS JOIN LATERAL (
+    SELECT width_bucket(t.max_flow::double precision, k.flow_steps) AS step
+) b
 JOIN s_flood_inundation_ar s
-  ON s.nextgen_id::text = t.nextgen_id
- WHERE s.flow <= t.max_flow
-ORDER BY t.nextgen_id, s.flow DESC;
+  ON s.flood_ar_id = k.flood_ar_ids[b.step]
+WHERE b.step > 0;
+
+CREATE INDEX idx_s_selected_flood_ar_flood_ar_id ON s_selected_flood_ar(flood_ar_id);
 
 -- ITEM #2
 -- select the appropriate flooded road lines
@@ -117,12 +124,29 @@ WITH below_trigger_roads AS (
         ft.nextgen_id, 
         ft.min_flood_flow, 
         mf.max_flow, 
-        mf.model_run_time
+        mf.model_run_time,
+        tm.onset_hour,
+        tm.flood_hours,
+        tm.recede_hour
     FROM 
         t_road_flood_trigger ft
     INNER JOIN 
         t_flow_per_nextgen mf 
         ON ft.nextgen_id = mf.nextgen_id
+    -- revised 2025.07.24: when the road floods, from the whole flow_array --
+    -- one set-based pass over the trigger x time step pairs (unnest WITH
+    -- ORDINALITY).  Hours count from the first forecast step like max_hour;
+    -- recede_hour is the step after the last flooded one, NULL if the road is
+    -- still flooded at the end of the forecast
+    CROSS JOIN LATERAL (
+        SELECT
+            (MIN(h.n) - 1) * mf.step_hours AS onset_hour,
+            COUNT(*) * mf.step_hours AS flood_hours,
+            CASE WHEN MAX(h.n) < cardinality(mf.flow_array)
+                 THEN MAX(h.n) * mf.step_hours END AS recede_hour
+        FROM unnest(mf.flow_array) WITH ORDINALITY AS h(flow, n)
+        WHERE h.flow > ft.min_flood_flow
+    ) tm
     WHERE 
         ft.min_flood_flow < mf.max_flow
 ),
@@ -137,7 +161,10 @@ joined_roads AS (
         btr.nextgen_id, 
         btr.min_flood_flow, 
         btr.max_flow, 
-        btr.model_run_time
+        btr.model_run_time,
+        btr.onset_hour,
+        btr.flood_hours,
+        btr.recede_hour
     FROM 
         below_trigger_roads btr
     JOIN 
@@ -158,7 +185,10 @@ deduped_by_attributes AS (
     nextgen_id, 
     min_flood_flow, 
     max_flow, 
-    model_run_time
+    model_run_time,
+    onset_hour,
+    flood_hours,
+    recede_hour
     FROM joined_roads
     ORDER BY 
         osm_id, fclass, name, ref, road_id, nextgen_id, 
@@ -175,7 +205,10 @@ deduped_by_geometry AS (
         nextgen_id, 
         min_flood_flow, 
         max_flow, 
-        model_run_time
+        model_run_time,
+        onset_hour,
+        flood_hours,
+        recede_hour
     FROM deduped_by_attributes
     ORDER BY geometry
 )
@@ -209,30 +242,9 @@ ALTER TABLE s_flood_grid_ar ADD PRIMARY KEY (id);
 CREATE INDEX idx_s_flood_grid_ar_geom ON s_flood_grid_ar USING GIST (geom);
 */
 
--- ITEM #3 - revised 2025.06.09
--- Create a grid of tiles over the s_selected_flood_ar
-DROP TABLE IF EXISTS s_flood_grid_ar;
-
-CREATE TABLE s_flood_grid_ar AS
-WITH ext AS (
-    SELECT ST_SetSRID(ST_Extent(geometry)::box2d, 4326) AS geom_extent
-    FROM s_selected_flood_ar
-),
-grid AS (
-    SELECT ST_Collect(sg.geom) AS geom_collection
-    FROM ext, ST_SquareGrid(0.25, ext.geom_extent) AS sg(geom)
-),
-dumped AS (
-    SELECT (ST_Dump(geom_collection)).geom
-    FROM grid
-)
-SELECT 
-    row_number() OVER () AS id,
-    dumped.geom
-FROM dumped;
-
-ALTER TABLE s_flood_grid_ar ADD PRIMARY KEY (id);
-CREATE INDEX idx_s_flood_grid_ar_geom ON s_flood_grid_ar USING GIST (geom);
+-- ITEM #3 - revised 2025.07.05
+-- The tile grid is static: s_tile_grid_ar (roadflood_create_static_tables.sql)
+-- Tile ids are stable across cycles
 
 
 -- ITEM #4
@@ -240,29 +252,53 @@ CREATE INDEX idx_s_flood_grid_ar_geom ON s_flood_grid_ar USING GIST (geom);
 -- heavy calculation
 DROP TABLE IF EXISTS s_flood_merge_by_tile_ar;
 
+CREATE TABLE s_flood_merge_by_tile_ar (
+    tile_id BIGINT,
+    model_run_time TEXT,
+    geometry GEOMETRY,
+    is_real INTEGER
+);
+
+-- Tiles to be merged (every tile holding a selected polygon)
+DROP TABLE IF EXISTS t_tile_union_queue;
+
+CREATE TABLE t_tile_union_queue AS
+SELECT DISTINCT
+    ti.tile_id
+FROM s_selected_flood_ar sfa
+JOIN t_tile_flood_inundation ti ON ti.flood_ar_id = sfa.flood_ar_id;
+
 -- Create merged flood polygons by tile (47 seconds -- 117 tiles (0.25 degree))
-CREATE TABLE s_flood_merge_by_tile_ar AS
+-- With [sql] parallel_connections > 1, step 02 runs the block between the
+-- markers once per batch of tiles, each on its own connection.  Everything
+-- above is committed first: if a batch fails or times out, the tail never
+-- runs and the tables are left half-updated (new selection and roads, partly
+-- merged tiles, the previous s_flood_merge_ar and t_current_forecast).  Step
+-- 02 reports the failure and the next cycle rebuilds everything.
+-- @@ TILE_UNION_BEGIN
+INSERT INTO s_flood_merge_by_tile_ar (tile_id, model_run_time, geometry, is_real)
 SELECT
-    g.id AS tile_id,
+    q.tile_id,
     MIN(sfa.model_run_time) AS model_run_time,
     ST_Multi(ST_Union(sfa.geometry)) AS geometry,
     1::integer AS is_real
 FROM 
-    s_flood_grid_ar g
+    t_tile_union_queue q
 JOIN 
-    s_selected_flood_ar sfa
-ON 
-    ST_Intersects(g.geom, sfa.geometry)
+    t_tile_flood_inundation ti ON ti.tile_id = q.tile_id
+JOIN 
+    s_selected_flood_ar sfa ON sfa.flood_ar_id = ti.flood_ar_id
 GROUP BY 
-    g.id;
+    q.tile_id;
+-- @@ TILE_UNION_END
 	
 -- ITEM #5
--- Intersect and index s_flood_road_ln by tile_id from s_flood_grid_ar
+-- Index s_flood_road_ln by tile_id from the precomputed tile-clipped road segments
 DROP TABLE IF EXISTS s_flood_road_ln_tile;
 
 CREATE TABLE s_flood_road_ln_tile AS
 SELECT
-    g.id AS tile_id,
+    c.tile_id,
     r.osm_id,
     r.fclass,
     r.name,
@@ -272,13 +308,16 @@ SELECT
     r.min_flood_flow,
     r.max_flow,
     r.model_run_time,
-    ST_Intersection(r.geometry, g.geom) AS geometry
+    r.onset_hour,
+    r.flood_hours,
+    r.recede_hour,
+    c.geometry
 FROM 
-    s_flood_grid_ar g
-JOIN 
     s_flood_road_ln r
+JOIN 
+    s_tile_road_segment_ln c
 ON 
-    ST_Intersects(r.geometry, g.geom);
+    c.road_id = r.road_id;
 	
 CREATE INDEX idx_s_flood_road_ln_tile_geom ON s_flood_road_ln_tile USING GIST (geometry);
 CREATE INDEX idx_s_flood_road_ln_tile_tile_id ON s_flood_road_ln_tile (tile_id);
@@ -299,6 +338,9 @@ SELECT
     r.min_flood_flow,
     r.max_flow,
     r.model_run_time,
+    r.onset_hour,
+    r.flood_hours,
+    r.recede_hour,
     ST_Intersection(r.geometry, f.geometry) AS geometry,
     ROUND(
         ST_Length(
@@ -329,7 +371,7 @@ SELECT
 FROM 
     s_flood_merge_by_tile_ar f
 JOIN 
-    s_flood_grid_ar g ON f.tile_id = g.id
+    s_tile_grid_ar g ON f.tile_id = g.id
 WHERE 
     ST_Intersects(f.geometry, g.geom);
 	
@@ -337,6 +379,9 @@ WHERE
 UPDATE s_flood_road_ln SET geometry = ST_SetSRID(geometry, 4326) WHERE ST_SRID(geometry) = 0;
 UPDATE s_flood_merge_ar SET geometry = ST_SetSRID(geometry, 4326) WHERE ST_SRID(geometry) = 0;
 
+-- Spatial index for the vector tiles of step 04 (tile envelope joins)
+CREATE INDEX idx_s_flood_merge_ar_geom ON s_flood_merge_ar USING GIST (geometry);
+
 -- Create the new table with a single row containing the first model_run_time value from t_flow_forecast
 DROP TABLE IF EXISTS t_current_forecast;
 
@@ -356,4 +401,4 @@ UPDATE s_flood_merge_ar
 SET model_run_time = (SELECT model_run_time FROM t_current_forecast LIMIT 1);
 
 -- Release the advisory lock manually (optional, as it auto-releases at session end)
-SELECT pg_advisory_unlock(20250628);
\ No newline at end of file
+SELECT pg_advisory_unlock(COALESCE(NULLIF(current_setting('fast.lock_key', true), '')::bigint, 20250628));
\ No newline at end of file
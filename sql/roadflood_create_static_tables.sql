@@ -0,0 +1,157 @@
+-- STATIC LOOKUP TABLES FOR THE FAST DYNAMIC UPDATE
+-- Run once per static-data release, after s_flood_inundation_ar and
+-- s_road_segment_ln are loaded.
+-- (src/run_sql_create_static_tables.py -- step 02 also runs this file
+-- when the lookup tables are missing)
+-- created 2025.07.04
+
+-- No timeout, this is a one-time build
+SET statement_timeout TO 0;
+
+-- Acquire an advisory lock to prevent running alongside a dynamic update
+-- revised 2025.07.23: the district's key (fast.lock_key) when the session sets it
+SELECT pg_advisory_lock(COALESCE(NULLIF(current_setting('fast.lock_key', true), '')::bigint, 20250628));
+
+-- ITEM S1
+-- Surrogate primary key on the inundation polygons
+ALTER TABLE s_flood_inundation_ar
+ADD COLUMN IF NOT EXISTS flood_ar_id BIGSERIAL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_s_flood_inundation_ar_flood_ar_id
+ON s_flood_inundation_ar (flood_ar_id);
+
+-- ITEM S2
+-- Flow-step lookup: for each nextgen_id, the sorted flow breakpoints and the
+-- polygon at each step.  ITEM #1 finds the step with width_bucket() (a binary
+-- search on the sorted array) and fetches the geometry by flood_ar_id.
+DROP TABLE IF EXISTS t_flood_flow_step;
+
+CREATE TABLE t_flood_flow_step AS
+WITH steps AS (
+    SELECT DISTINCT ON (nextgen_id::text, flow)
+        nextgen_id::text AS nextgen_id,
+        flow::double precision AS flow,
+        flood_ar_id
+    FROM s_flood_inundation_ar
+    WHERE flow IS NOT NULL
+    ORDER BY nextgen_id::text, flow, flood_ar_id
+)
+SELECT
+    nextgen_id,
+    array_agg(flow ORDER BY flow) AS flow_steps,
+    array_agg(flood_ar_id ORDER BY flow) AS flood_ar_ids
+FROM steps
+GROUP BY nextgen_id;
+
+ALTER TABLE t_flood_flow_step ADD PRIMARY KEY (nextgen_id);
+
+-- ITEM S3
+-- Fixed 0.25 degree tile grid.  ST_SquareGrid is aligned to the origin, so the
+-- tile id built from the cell indices (i, j) is the same in every district
+-- and every static release.
+DROP TABLE IF EXISTS s_tile_grid_ar;
+
+CREATE TABLE s_tile_grid_ar AS
+WITH ext AS (
+    SELECT ST_SetSRID(ST_Extent(a.geometry)::box2d, 4326) AS geom_extent
+    FROM (
+        SELECT geometry FROM s_flood_inundation_ar
+        UNION ALL
+        SELECT geometry FROM s_road_segment_ln
+    ) a
+)
+SELECT
+    ((sg.i + 2000) * 10000 + (sg.j + 2000))::bigint AS id,
+    sg.i,
+    sg.j,
+    sg.geom
+FROM ext, ST_SquareGrid(0.25, ext.geom_extent) AS sg;
+
+ALTER TABLE s_tile_grid_ar ADD PRIMARY KEY (id);
+CREATE INDEX idx_s_tile_grid_ar_geom ON s_tile_grid_ar USING GIST (geom);
+
+-- ITEM S4
+-- Tile assignment of every inundation polygon
+DROP TABLE IF EXISTS t_tile_flood_inundation;
+
+CREATE TABLE t_tile_flood_inundation AS
+SELECT
+    s.flood_ar_id,
+    g.id AS tile_id
+FROM
+    s_flood_inundation_ar s
+JOIN
+    s_tile_grid_ar g
+ON
+    ST_Intersects(g.geom, s.geometry);
+
+CREATE INDEX idx_t_tile_flood_inundation_flood_ar_id ON t_tile_flood_inundation (flood_ar_id);
+CREATE INDEX idx_t_tile_flood_inundation_tile_id ON t_tile_flood_inundation (tile_id, flood_ar_id);
+
+-- ITEM S5
+-- Road segments clipped to each tile
+DROP TABLE IF EXISTS s_tile_road_segment_ln;
+
+CREATE TABLE s_tile_road_segment_ln AS
+SELECT
+    g.id AS tile_id,
+    r.road_id,
+    ST_Intersection(r.geometry, g.geom) AS geometry
+FROM
+    s_road_segment_ln r
+JOIN
+    s_tile_grid_ar g
+ON
+    ST_Intersects(r.geometry, g.geom);
+
+CREATE INDEX idx_s_tile_road_segment_ln_road_id ON s_tile_road_segment_ln (road_id);
+
+-- ITEM S6 - created 2025.07.22
+-- Flow thresholds per NWM reach: the polygon flow steps, road triggers and
+-- bridge rating-curve minimums of its nextgen reaches, sorted.  A cycle whose
+-- peaks cross none of them ([sql] skip_unchanged_cycles) only needs
+-- roadflood_refresh_unchanged_cycle.sql.  Only reaches with flow steps
+-- count -- t_flow_per_nextgen (ITEM #0) holds no others.
+DROP TABLE IF EXISTS t_reach_flow_threshold;
+
+CREATE TABLE t_reach_flow_threshold AS
+WITH thresholds AS (
+    SELECT k.nextgen_id, unnest(k.flow_steps) AS flow
+    FROM t_flood_flow_step k
+    UNION
+    SELECT ft.nextgen_id::text, ft.min_flood_flow::double precision
+    FROM t_road_flood_trigger ft
+    JOIN t_flood_flow_step k ON k.nextgen_id = ft.nextgen_id::text
+    WHERE ft.min_flood_flow IS NOT NULL
+    UNION
+    SELECT rc.nextgen_id::text, rc.min_flow::double precision
+    FROM t_bridge_rating_curve rc
+    JOIN t_flood_flow_step k ON k.nextgen_id = rc.nextgen_id::text
+    WHERE rc.min_flow IS NOT NULL
+)
+SELECT
+    x.feature_id::bigint AS feature_id,
+    array_agg(DISTINCT t.flow ORDER BY t.flow) AS thresholds
+FROM thresholds t
+JOIN t_nextgen_to_nwm x ON x.nextgen_id = t.nextgen_id
+GROUP BY x.feature_id;
+
+ALTER TABLE t_reach_flow_threshold ADD PRIMARY KEY (feature_id);
+
+-- Polygon ids and tile ids may have changed -- the next incremental
+-- update (roadflood_update_dynamic_tables_incremental.sql) starts over
+DROP TABLE IF EXISTS t_incremental_state;
+DROP TABLE IF EXISTS s_flood_grid_fixed_ar;
+-- ... and the next cycle is never a threshold-only refresh
+DROP TABLE IF EXISTS t_flow_per_nextgen;
+DROP TABLE IF EXISTS t_flow_change;
+
+ANALYZE s_flood_inundation_ar;
+ANALYZE t_flood_flow_step;
+ANALYZE s_tile_grid_ar;
+ANALYZE t_tile_flood_inundation;
+ANALYZE s_tile_road_segment_ln;
+ANALYZE t_reach_flow_threshold;
+
+-- Release the advisory lock manually (optional, as it auto-releases at session end)
+SELECT pg_advisory_unlock(COALESCE(NULLIF(current_setting('fast.lock_key', true), '')::bigint, 20250628));
@@ -0,0 +1,194 @@
+-- PER-HOUR FLOOD LAYERS
+-- Run by step 02 after the dynamic update when [sql] hourly_layers = True.
+-- Flood areas and flooded roads for every forecast hour of flow_array, for
+-- animating the flood, next to the 'max over the forecast' envelope.
+--
+-- Each hour is derived from the previous one: a reach is looked at again only
+-- at the hours its flow step changes, and a tile is re-merged only at the
+-- hours one of its reaches changed.  A merged tile is stored once with the
+-- range of hours it holds for (hour_from - hour_to), so an unchanged tile
+-- costs nothing at the next hour.  Hour h of a layer is every row with
+-- h BETWEEN hour_from AND hour_to.
+--
+-- Hours count from the first forecast step, like max_hour and onset_hour.
+-- created 2025.07.25
+
+SET statement_timeout TO '3min';
+
+-- Same advisory lock as the dynamic update
+SELECT pg_advisory_lock(COALESCE(NULLIF(current_setting('fast.lock_key', true), '')::bigint, 20250628));
+
+-- ITEM H0
+-- Forecast hours of this cycle (n is the flow_array index)
+DROP TABLE IF EXISTS t_flood_hour;
+
+CREATE TABLE t_flood_hour AS
+SELECT
+    s.n::integer AS n,
+    ((s.n - 1) * c.step_hours)::integer AS forecast_hour
+FROM (
+    SELECT MAX(cardinality(flow_array)) AS int_steps, MAX(step_hours) AS step_hours
+    FROM t_flow_per_nextgen
+) c
+CROSS JOIN generate_series(1, c.int_steps) AS s(n);
+
+ALTER TABLE t_flood_hour ADD PRIMARY KEY (n);
+
+-- ITEM H1
+-- Flow step of each reach at each hour -- same width_bucket() lookup as
+-- ITEM #1 -- with the step of the hour before.  Hours where the reach is
+-- dry at both are left out.
+DROP TABLE IF EXISTS t_hour_flow_step;
+
+CREATE TABLE t_hour_flow_step AS
+SELECT nextgen_id, n, flood_ar_id, prev_flood_ar_id
+FROM (
+    SELECT
+        s.nextgen_id,
+        s.n,
+        s.flood_ar_id,
+        LAG(s.flood_ar_id) OVER (PARTITION BY s.nextgen_id ORDER BY s.n) AS prev_flood_ar_id
+    FROM (
+        SELECT
+            t.nextgen_id,
+            h.n,
+            CASE WHEN b.step > 0 THEN k.flood_ar_ids[b.step] END AS flood_ar_id
+        FROM t_flow_per_nextgen t
+        JOIN t_flood_flow_step k
+          ON k.nextgen_id = t.nextgen_id
+        CROSS JOIN LATERAL unnest(t.flow_array) WITH ORDINALITY AS h(flow, n)
+        CROSS JOIN LATERAL (
+            SELECT width_bucket(h.flow::double precision, k.flow_steps) AS step
+        ) b
+    ) s
+) l
+WHERE flood_ar_id IS NOT NULL OR prev_flood_ar_id IS NOT NULL;
+
+CREATE INDEX idx_t_hour_flow_step_flood_ar_id ON t_hour_flow_step (flood_ar_id, n);
+
+-- ITEM H2
+-- Dirty tiles of each hour: touched by the old or the new polygon of a reach
+-- that changed step (every flooded tile at the first hour)
+DROP TABLE IF EXISTS t_hour_dirty_tile;
+
+CREATE TABLE t_hour_dirty_tile AS
+SELECT ti.tile_id, c.n
+FROM t_hour_flow_step c
+JOIN t_tile_flood_inundation ti ON ti.flood_ar_id = c.flood_ar_id
+WHERE c.flood_ar_id IS DISTINCT FROM c.prev_flood_ar_id
+UNION
+SELECT ti.tile_id, c.n
+FROM t_hour_flow_step c
+JOIN t_tile_flood_inundation ti ON ti.flood_ar_id = c.prev_flood_ar_id
+WHERE c.flood_ar_id IS DISTINCT FROM c.prev_flood_ar_id;
+
+-- ITEM H3
+-- Merged flood polygons per tile and range of hours, clipped to the tile
+-- (ITEMs #4 and #7 in one step)
+DROP TABLE IF EXISTS s_flood_hour_merge_ar;
+
+CREATE TABLE s_flood_hour_merge_ar (
+    tile_id BIGINT,
+    hour_from INTEGER,
+    hour_to INTEGER,
+    model_run_time TEXT,
+    geometry GEOMETRY
+);
+
+-- A tile keeps its geometry from a dirty hour up to the hour before its next one
+DROP TABLE IF EXISTS t_tile_union_queue;
+
+CREATE TABLE t_tile_union_queue AS
+SELECT
+    d.tile_id,
+    d.n AS n_from,
+    COALESCE(LEAD(d.n) OVER (PARTITION BY d.tile_id ORDER BY d.n) - 1,
+             (SELECT MAX(n) FROM t_flood_hour)) AS n_to
+FROM t_hour_dirty_tile d;
+
+-- With [sql] parallel_connections > 1, step 02 runs the block between the
+-- markers once per batch of tiles, each on its own connection
+-- @@ TILE_UNION_BEGIN
+INSERT INTO s_flood_hour_merge_ar (tile_id, hour_from, hour_to, model_run_time, geometry)
+SELECT
+    m.tile_id,
+    hf.forecast_hour AS hour_from,
+    ht.forecast_hour AS hour_to,
+    (SELECT model_run_time FROM t_current_forecast LIMIT 1) AS model_run_time,
+    ST_Intersection(m.geometry, g.geom) AS geometry
+FROM (
+    SELECT
+        q.tile_id,
+        q.n_from,
+        q.n_to,
+        ST_Multi(ST_Union(s.geometry)) AS geometry
+    FROM
+        t_tile_union_queue q
+    JOIN
+        t_tile_flood_inundation ti ON ti.tile_id = q.tile_id
+    JOIN
+        t_hour_flow_step c ON c.flood_ar_id = ti.flood_ar_id AND c.n = q.n_from
+    JOIN
+        s_flood_inundation_ar s ON s.flood_ar_id = c.flood_ar_id
+    GROUP BY
+        q.tile_id, q.n_from, q.n_to
+) m
+JOIN s_tile_grid_ar g ON g.id = m.tile_id
+JOIN t_flood_hour hf ON hf.n = m.n_from
+JOIN t_flood_hour ht ON ht.n = m.n_to;
+-- @@ TILE_UNION_END
+
+UPDATE s_flood_hour_merge_ar SET geometry = ST_SetSRID(geometry, 4326) WHERE ST_SRID(geometry) = 0;
+
+CREATE INDEX idx_s_flood_hour_merge_ar_hours ON s_flood_hour_merge_ar (hour_from, hour_to);
+
+-- ITEM H4
+-- Flooded road lines per range of hours: the consecutive hours each road of
+-- s_flood_road_ln (ITEM #2) is above its trigger flow
+DROP TABLE IF EXISTS s_flood_road_hour_ln;
+
+CREATE TABLE s_flood_road_hour_ln AS
+WITH roads AS (
+    SELECT row_number() OVER () AS road_row, r.*
+    FROM s_flood_road_ln r
+),
+flooded_hours AS (
+    SELECT
+        rd.road_row,
+        h.n,
+        h.n - row_number() OVER (PARTITION BY rd.road_row ORDER BY h.n) AS island
+    FROM roads rd
+    JOIN t_flow_per_nextgen f ON f.nextgen_id = rd.nextgen_id
+    CROSS JOIN LATERAL unnest(f.flow_array) WITH ORDINALITY AS h(flow, n)
+    WHERE h.flow > rd.min_flood_flow
+),
+islands AS (
+    SELECT road_row, MIN(n) AS n_from, MAX(n) AS n_to
+    FROM flooded_hours
+    GROUP BY road_row, island
+)
+SELECT
+    rd.geometry,
+    rd.osm_id,
+    rd.fclass,
+    rd.name,
+    rd.ref,
+    rd.road_id,
+    rd.nextgen_id,
+    rd.min_flood_flow,
+    rd.max_flow,
+    rd.model_run_time,
+    rd.onset_hour,
+    rd.flood_hours,
+    rd.recede_hour,
+    hf.forecast_hour AS hour_from,
+    ht.forecast_hour AS hour_to
+FROM islands i
+JOIN roads rd ON rd.road_row = i.road_row
+JOIN t_flood_hour hf ON hf.n = i.n_from
+JOIN t_flood_hour ht ON ht.n = i.n_to;
+
+CREATE INDEX idx_s_flood_road_hour_ln_hours ON s_flood_road_hour_ln (hour_from, hour_to);
+
+-- Release the advisory lock manually (optional, as it auto-releases at session end)
+SELECT pg_advisory_unlock(COALESCE(NULLIF(current_setting('fast.lock_key', true), '')::bigint, 20250628));
@@ -0,0 +1,132 @@
+-- REFRESH OF A CYCLE THAT CROSSED NO THRESHOLD
+-- Run by step 02 in place of [sql] sql_file_path when [sql] skip_unchanged_cycles
+-- is on and step 01 found that no reach's peak flow crossed a flood polygon
+-- step, a road trigger or a bridge rating-curve minimum (t_reach_flow_threshold,
+-- roadflood_create_static_tables.sql).  The selected polygons, flooded roads and
+-- merged tiles of the previous cycle still hold; only the flows, the peaks, the
+-- flood timing of the roads and model_run_time are brought up to date.
+-- created 2025.07.22
+
+SET statement_timeout TO '3min';
+
+-- Same advisory lock as the dynamic update
+SELECT pg_advisory_lock(COALESCE(NULLIF(current_setting('fast.lock_key', true), '')::bigint, 20250628));
+
+-- ITEM #0
+-- Establish flows per stream
+
+DROP TABLE IF EXISTS t_flow_per_nextgen;
+
+CREATE TABLE t_flow_per_nextgen AS
+WITH unique_ids AS (
+    SELECT nextgen_id
+    FROM t_flood_flow_step
+),
+crosswalked AS (
+    SELECT u.nextgen_id, x.feature_id
+    FROM unique_ids u
+    JOIN t_nextgen_to_nwm x ON u.nextgen_id = x.nextgen_id
+),
+flows_with_array AS (
+    -- revised 2025.07.20: t_flow_forecast holds the whole horizon of the
+    -- NWM product as flow_array (18 hourly values for short_range, 80
+    -- three-hourly for medium_range); step_hours converts index to hours
+    SELECT
+        c.nextgen_id,
+        f.feature_id,
+        f.model_run_time,
+        f.flow_array,
+        f.step_hours
+    FROM crosswalked c
+    JOIN t_flow_forecast f ON c.feature_id = f.feature_id
+)
+SELECT
+    w.nextgen_id,
+    w.feature_id,
+    w.model_run_time,
+    w.flow_array,
+    w.step_hours,
+    p.max_flow,
+    -- one pass for the peak, first time step that reaches it
+    (array_position(w.flow_array, p.max_flow) - 1) * w.step_hours AS max_hour
+FROM flows_with_array w
+CROSS JOIN LATERAL (
+    SELECT MAX(val) AS max_flow FROM unnest(w.flow_array) AS val
+) p;
+
+CREATE INDEX idx_t_flow_per_nextgen_nextgen_id ON t_flow_per_nextgen(nextgen_id);
+
+-- Peaks, flood timing and model_run_time of the flooded roads (same rows as
+-- before).  revised 2025.07.24: the timing moves with the hydrograph even when
+-- no threshold is crossed -- same computation as ITEM #2, once per trigger
+CREATE TEMP TABLE t_road_flood_timing AS
+SELECT
+    r.nextgen_id,
+    r.min_flood_flow,
+    f.max_flow,
+    f.model_run_time,
+    tm.onset_hour,
+    tm.flood_hours,
+    tm.recede_hour
+FROM (SELECT DISTINCT nextgen_id, min_flood_flow FROM s_flood_road_ln) r
+JOIN t_flow_per_nextgen f ON f.nextgen_id = r.nextgen_id
+CROSS JOIN LATERAL (
+    SELECT
+        (MIN(h.n) - 1) * f.step_hours AS onset_hour,
+        COUNT(*) * f.step_hours AS flood_hours,
+        CASE WHEN MAX(h.n) < cardinality(f.flow_array)
+             THEN MAX(h.n) * f.step_hours END AS recede_hour
+    FROM unnest(f.flow_array) WITH ORDINALITY AS h(flow, n)
+    WHERE h.flow > r.min_flood_flow
+) tm;
+
+UPDATE s_flood_road_ln r
+SET max_flow = t.max_flow, model_run_time = t.model_run_time,
+    onset_hour = t.onset_hour, flood_hours = t.flood_hours, recede_hour = t.recede_hour
+FROM t_road_flood_timing t
+WHERE t.nextgen_id = r.nextgen_id AND t.min_flood_flow = r.min_flood_flow;
+
+UPDATE s_flood_road_ln_tile r
+SET max_flow = t.max_flow, model_run_time = t.model_run_time,
+    onset_hour = t.onset_hour, flood_hours = t.flood_hours, recede_hour = t.recede_hour
+FROM t_road_flood_timing t
+WHERE t.nextgen_id = r.nextgen_id AND t.min_flood_flow = r.min_flood_flow;
+
+UPDATE s_flood_road_trim_ln r
+SET max_flow = t.max_flow, model_run_time = t.model_run_time,
+    onset_hour = t.onset_hour, flood_hours = t.flood_hours, recede_hour = t.recede_hour
+FROM t_road_flood_timing t
+WHERE t.nextgen_id = r.nextgen_id AND t.min_flood_flow = r.min_flood_flow;
+
+-- Selected polygons keep their flood_ar_id (what the incremental update compares)
+UPDATE s_selected_flood_ar o
+SET max_flow = f.max_flow, model_run_time = f.model_run_time, max_hour = f.max_hour
+FROM t_flow_per_nextgen f
+WHERE f.nextgen_id = o.nextgen_id;
+
+DROP TABLE IF EXISTS t_current_forecast;
+
+CREATE TABLE t_current_forecast AS
+SELECT model_run_time
+FROM t_flow_forecast
+LIMIT 1;
+
+UPDATE s_flood_merge_by_tile_ar
+SET model_run_time = (SELECT model_run_time FROM t_current_forecast LIMIT 1);
+
+UPDATE s_flood_merge_ar
+SET model_run_time = (SELECT model_run_time FROM t_current_forecast LIMIT 1);
+
+-- The incremental update's record of the last cycle, when it is in use
+DO $$
+BEGIN
+    IF to_regclass('t_incremental_state') IS NOT NULL THEN
+        UPDATE t_incremental_state
+        SET model_run_time = (SELECT model_run_time FROM t_current_forecast LIMIT 1),
+            updated_at = now();
+    END IF;
+END
+$$;
+
+-- Release the advisory lock manually (optional, as it auto-releases at session end)
+SELECT pg_advisory_unlock(COALESCE(NULLIF(current_setting('fast.lock_key', true), '')::bigint, 20250628));
@@ -0,0 +1,456 @@
+-- INCREMENTAL UPDATE OF THE FAST DYNAMIC TABLES
+-- Alternative to roadflood_create_dynamic_tables_big.sql.  Point [sql] sql_file_path
+-- at this file to use it.  Only the reaches whose selected flood polygon changed
+-- since the previous cycle are re-selected, and only the tiles they touch are
+-- re-merged in s_flood_merge_by_tile_ar.  Clean tiles keep their geometry.
+--
+-- Tiles come from the static s_tile_grid_ar and t_tile_flood_inundation
+-- (roadflood_create_static_tables.sql) so tile ids are stable between cycles.
+--
+-- t_incremental_state records the last incremental cycle.  If it is empty (first
+-- run, or the full script ran in between) every reach and every tile is rebuilt.
+-- created 2025.07.02
+
+-- SETTING A TIMEOUT FOR HEAVY QUERRIES
+SET statement_timeout TO '3min';
+
+-- Acquire an advisory lock to prevent concurrent executions
+-- revised 2025.07.21: the key is fast.lock_key when the session sets it
+-- (one per cycle schema in backfill_historical.py), else the shared key
+SELECT pg_advisory_lock(COALESCE(NULLIF(current_setting('fast.lock_key', true), '')::bigint, 20250628));
+
+CREATE TABLE IF NOT EXISTS t_incremental_state (
+    model_run_time TEXT,
+    updated_at TIMESTAMPTZ
+);
+
+-- ITEM #0
+-- Establish flows per stream
+DROP TABLE IF EXISTS t_flow_per_nextgen;
+
+CREATE TABLE t_flow_per_nextgen AS
+WITH unique_ids AS (
+    SELECT nextgen_id
+    FROM t_flood_flow_step
+),
+crosswalked AS (
+    SELECT u.nextgen_id, x.feature_id
+    FROM unique_ids u
+    JOIN t_nextgen_to_nwm x ON u.nextgen_id = x.nextgen_id
+),
+flows_with_array AS (
+    -- revised 2025.07.20: t_flow_forecast holds the whole horizon of the
+    -- NWM product as flow_array (18 hourly values for short_range, 80
+    -- three-hourly for medium_range); step_hours converts index to hours
+    SELECT
+        c.nextgen_id,
+        f.feature_id,
+        f.model_run_time,
+        f.flow_array,
+        f.step_hours
+    FROM crosswalked c
+    JOIN t_flow_forecast f ON c.feature_id = f.feature_id
+)
+SELECT
+    w.nextgen_id,
+    w.feature_id,
+    w.model_run_time,
+    w.flow_array,
+    w.step_hours,
+    p.max_flow,
+    -- one pass for the peak, first time step that reaches it
+    (array_position(w.flow_array, p.max_flow) - 1) * w.step_hours AS max_hour
+FROM flows_with_array w
+CROSS JOIN LATERAL (
+    SELECT MAX(val) AS max_flow FROM unnest(w.flow_array) AS val
+) p;
+
+CREATE INDEX idx_t_flow_per_nextgen_nextgen_id ON t_flow_per_nextgen(nextgen_id);
+
+-- ITEM #1 (incremental)
+-- Determine the flow step of each reach without copying any geometry
+-- keyed lookup on the static t_flood_flow_step (roadflood_create_static_tables.sql):
+-- width_bucket() is a binary search of max_flow on the sorted flow steps
+DROP TABLE IF EXISTS t_selected_flow_step_new;
+
+CREATE TABLE t_selected_flow_step_new AS
+SELECT
+    t.nextgen_id,
+    t.max_flow,
+    t.model_run_time,
+    t.max_hour,
+    k.flow_steps[b.step] AS flow,
+    k.flood_ar_ids[b.step] AS flood_ar_id
+FROM t_flow_per_nextgen t
+JOIN t_flood_flow_step k
+  ON k.nextgen_id = t.nextgen_id
+CROSS JOIN LATERAL (
+    SELECT width_bucket(t.max_flow::double precision, k.flow_steps) AS step
+) b
+WHERE b.step > 0;
+
+CREATE INDEX idx_t_selected_flow_step_new_nextgen_id ON t_selected_flow_step_new(nextgen_id);
+
+-- The previous cycle's selection is kept between runs
+CREATE TABLE IF NOT EXISTS s_selected_flood_ar AS
+SELECT
+    t.nextgen_id,
+    t.max_flow,
+    t.model_run_time,
+    t.max_hour,
+    s.flow,
+    s.geometry
+FROM t_flow_per_nextgen t
+JOIN s_flood_inundation_ar s
+  ON s.nextgen_id::text = t.nextgen_id
+WITH NO DATA;
+
+ALTER TABLE s_selected_flood_ar
+ADD COLUMN IF NOT EXISTS flood_ar_id BIGINT;
+
+-- A selection without polygon ids cannot be compared -- start over
+DELETE FROM t_incremental_state
+WHERE EXISTS (SELECT 1 FROM s_selected_flood_ar WHERE flood_ar_id IS NULL);
+
+-- No record of a previous incremental cycle -- start from an empty selection
+DELETE FROM s_selected_flood_ar
+WHERE NOT EXISTS (SELECT 1 FROM t_incremental_state);
+
+CREATE INDEX IF NOT EXISTS idx_s_selected_flood_ar_nextgen_id ON s_selected_flood_ar(nextgen_id);
+CREATE INDEX IF NOT EXISTS idx_s_selected_flood_ar_flood_ar_id ON s_selected_flood_ar(flood_ar_id);
+CREATE INDEX IF NOT EXISTS idx_s_selected_flood_ar_geom ON s_selected_flood_ar USING GIST (geometry);
+
+-- Reaches that moved to a different flow step (or appeared / disappeared)
+DROP TABLE IF EXISTS t_changed_nextgen;
+
+CREATE TABLE t_changed_nextgen AS
+SELECT COALESCE(n.nextgen_id, o.nextgen_id) AS nextgen_id
+FROM t_selected_flow_step_new n
+FULL OUTER JOIN s_selected_flood_ar o
+  ON o.nextgen_id = n.nextgen_id
+WHERE n.flood_ar_id IS DISTINCT FROM o.flood_ar_id;
+
+CREATE INDEX idx_t_changed_nextgen_nextgen_id ON t_changed_nextgen(nextgen_id);
+
+-- ITEM #3 (incremental)
+-- The tile grid is static: s_tile_grid_ar (roadflood_create_static_tables.sql)
+
+CREATE TABLE IF NOT EXISTS s_flood_merge_by_tile_ar (
+    tile_id BIGINT,
+    model_run_time TEXT,
+    geometry GEOMETRY,
+    is_real INTEGER
+);
+
+-- Dirty tiles: touched by the old or the new polygon of a changed reach.
+-- Without a previous incremental cycle, every existing tile is dirty as well.
+DROP TABLE IF EXISTS t_dirty_tile;
+
+CREATE TABLE t_dirty_tile AS
+WITH changed_flood_ar AS (
+    SELECT o.flood_ar_id
+    FROM s_selected_flood_ar o
+    JOIN t_changed_nextgen c ON o.nextgen_id = c.nextgen_id
+    UNION
+    SELECT n.flood_ar_id
+    FROM t_selected_flow_step_new n
+    JOIN t_changed_nextgen c ON n.nextgen_id = c.nextgen_id
+)
+SELECT ti.tile_id
+FROM t_tile_flood_inundation ti
+JOIN changed_flood_ar cf ON ti.flood_ar_id = cf.flood_ar_id
+UNION
+SELECT tile_id
+FROM s_flood_merge_by_tile_ar
+WHERE NOT EXISTS (SELECT 1 FROM t_incremental_state);
+
+-- Swap the changed reaches in s_selected_flood_ar
+DELETE FROM s_selected_flood_ar o
+USING t_changed_nextgen c
+WHERE o.nextgen_id = c.nextgen_id;
+
+INSERT INTO s_selected_flood_ar (nextgen_id, max_flow, model_run_time, max_hour, flow, flood_ar_id, geometry)
+SELECT
+    n.nextgen_id,
+    n.max_flow,
+    n.model_run_time,
+    n.max_hour,
+    s.flow,
+    s.flood_ar_id,
+    s.geometry
+FROM t_selected_flow_step_new n
+JOIN t_changed_nextgen c ON n.nextgen_id = c.nextgen_id
+JOIN s_flood_inundation_ar s ON s.flood_ar_id = n.flood_ar_id;
+
+-- Unchanged reaches only need their attributes refreshed
+UPDATE s_selected_flood_ar o
+SET
+    max_flow = n.max_flow,
+    model_run_time = n.model_run_time,
+    max_hour = n.max_hour
+FROM t_selected_flow_step_new n
+WHERE o.nextgen_id = n.nextgen_id
+  AND (o.max_flow, o.model_run_time, o.max_hour)
+      IS DISTINCT FROM (n.max_flow, n.model_run_time, n.max_hour);
+
+-- ITEM #2
+-- select the appropriate flooded road lines
+DROP TABLE IF EXISTS s_flood_road_ln;
+
+CREATE TABLE s_flood_road_ln AS
+WITH below_trigger_roads AS (
+    SELECT
+        ft.road_id,
+        ft.nextgen_id,
+        ft.min_flood_flow,
+        mf.max_flow,
+        mf.model_run_time,
+        tm.onset_hour,
+        tm.flood_hours,
+        tm.recede_hour
+    FROM
+        t_road_flood_trigger ft
+    INNER JOIN
+        t_flow_per_nextgen mf
+        ON ft.nextgen_id = mf.nextgen_id
+    -- revised 2025.07.24: when the road floods, from the whole flow_array --
+    -- one set-based pass over the trigger x time step pairs (unnest WITH
+    -- ORDINALITY).  Hours count from the first forecast step like max_hour;
+    -- recede_hour is the step after the last flooded one, NULL if the road is
+    -- still flooded at the end of the forecast
+    CROSS JOIN LATERAL (
+        SELECT
+            (MIN(h.n) - 1) * mf.step_hours AS onset_hour,
+            COUNT(*) * mf.step_hours AS flood_hours,
+            CASE WHEN MAX(h.n) < cardinality(mf.flow_array)
+                 THEN MAX(h.n) * mf.step_hours END AS recede_hour
+        FROM unnest(mf.flow_array) WITH ORDINALITY AS h(flow, n)
+        WHERE h.flow > ft.min_flood_flow
+    ) tm
+    WHERE
+        ft.min_flood_flow < mf.max_flow
+),
+joined_roads AS (
+    SELECT
+        s.geometry,
+        s.osm_id,
+        s.fclass,
+        s.name,
+        s.ref,
+        s.road_id,
+        btr.nextgen_id,
+        btr.min_flood_flow,
+        btr.max_flow,
+        btr.model_run_time,
+        btr.onset_hour,
+        btr.flood_hours,
+        btr.recede_hour
+    FROM
+        below_trigger_roads btr
+    JOIN
+        s_road_segment_ln s
+        ON btr.road_id = s.road_id
+),
+deduped_by_attributes AS (
+    SELECT DISTINCT ON (
+        osm_id, fclass, name, ref, road_id, nextgen_id,
+        min_flood_flow, max_flow, model_run_time
+    )
+    geometry,
+    osm_id,
+    fclass,
+    name,
+    ref,
+    road_id,
+    nextgen_id,
+    min_flood_flow,
+    max_flow,
+    model_run_time,
+    onset_hour,
+    flood_hours,
+    recede_hour
+    FROM joined_roads
+    ORDER BY
+        osm_id, fclass, name, ref, road_id, nextgen_id,
+        min_flood_flow, max_flow, model_run_time
+),
+deduped_by_geometry AS (
+    SELECT DISTINCT ON (geometry)
+        geometry,
+        osm_id,
+        fclass,
+        name,
+        ref,
+        road_id,
+        nextgen_id,
+        min_flood_flow,
+        max_flow,
+        model_run_time,
+        onset_hour,
+        flood_hours,
+        recede_hour
+    FROM deduped_by_attributes
+    ORDER BY geometry
+)
+SELECT * FROM deduped_by_geometry;
+
+-- ITEM #4 (incremental)
+-- re-merge only the dirty tiles -- heavy calculation, proportional to what changed
+DELETE FROM s_flood_merge_by_tile_ar
+WHERE tile_id IN (SELECT tile_id FROM t_dirty_tile);
+
+DROP TABLE IF EXISTS t_tile_union_queue;
+
+CREATE TABLE t_tile_union_queue AS
+SELECT DISTINCT
+    d.tile_id
+FROM t_dirty_tile d
+JOIN t_tile_flood_inundation ti ON ti.tile_id = d.tile_id
+JOIN s_selected_flood_ar sfa ON sfa.flood_ar_id = ti.flood_ar_id;
+
+-- With [sql] parallel_connections > 1, step 02 runs the block between the
+-- markers once per batch of tiles, each on its own connection.  Everything
+-- above is committed first -- the selection is already swapped and the dirty
+-- tiles deleted -- so until the end of the script records this cycle again,
+-- the state is cleared: if a batch fails or times out, the next run is a full
+-- rebuild instead of a diff against this half-applied cycle.
+-- (revised 2025.07.26)
+DELETE FROM t_incremental_state;
+
+-- @@ TILE_UNION_BEGIN
+INSERT INTO s_flood_merge_by_tile_ar (tile_id, model_run_time, geometry, is_real)
+SELECT
+    q.tile_id,
+    MIN(sfa.model_run_time) AS model_run_time,
+    ST_Multi(ST_Union(sfa.geometry)) AS geometry,
+    1::integer AS is_real
+FROM
+    t_tile_union_queue q
+JOIN
+    t_tile_flood_inundation ti ON ti.tile_id = q.tile_id
+JOIN
+    s_selected_flood_ar sfa ON sfa.flood_ar_id = ti.flood_ar_id
+GROUP BY
+    q.tile_id;
+-- @@ TILE_UNION_END
+
+UPDATE s_flood_merge_by_tile_ar
+SET model_run_time = (SELECT model_run_time FROM t_flow_forecast LIMIT 1);
+
+-- ITEM #5
+-- Index s_flood_road_ln by tile_id from the precomputed tile-clipped road segments
+DROP TABLE IF EXISTS s_flood_road_ln_tile;
+
+CREATE TABLE s_flood_road_ln_tile AS
+SELECT
+    c.tile_id,
+    r.osm_id,
+    r.fclass,
+    r.name,
+    r.ref,
+    r.road_id,
+    r.nextgen_id,
+    r.min_flood_flow,
+    r.max_flow,
+    r.model_run_time,
+    r.onset_hour,
+    r.flood_hours,
+    r.recede_hour,
+    c.geometry
+FROM
+    s_flood_road_ln r
+JOIN
+    s_tile_road_segment_ln c
+ON
+    c.road_id = r.road_id;
+
+CREATE INDEX idx_s_flood_road_ln_tile_geom ON s_flood_road_ln_tile USING GIST (geometry);
+CREATE INDEX idx_s_flood_road_ln_tile_tile_id ON s_flood_road_ln_tile (tile_id);
+
+-- ITEM #6
+-- Create the clipped flooded road lines per tile
+DROP TABLE IF EXISTS s_flood_road_trim_ln;
+
+CREATE TABLE s_flood_road_trim_ln AS
+SELECT
+    r.tile_id,
+    r.osm_id,
+    r.fclass,
+    r.name,
+    r.ref,
+    r.road_id,
+    r.nextgen_id,
+    r.min_flood_flow,
+    r.max_flow,
+    r.model_run_time,
+    r.onset_hour,
+    r.flood_hours,
+    r.recede_hour,
+    ST_Intersection(r.geometry, f.geometry) AS geometry,
+    ROUND(
+        ST_Length(
+            ST_Transform(
+                ST_Intersection(r.geometry, f.geometry), 3857
+            )
+        ) * 3.28084
+    ) AS length_ft
+FROM
+    s_flood_road_ln_tile r
+JOIN
+    s_flood_merge_by_tile_ar f
+    ON r.tile_id = f.tile_id
+WHERE
+    ST_Intersects(r.geometry, f.geometry);
+
+CREATE INDEX idx_s_flood_road_trim_ln_geom ON s_flood_road_trim_ln USING GIST (geometry);
+CREATE INDEX idx_s_flood_road_trim_ln_tile_id ON s_flood_road_trim_ln (tile_id);
+
+-- ITEM #7
+-- Clip the flood innundation to each tile's limit
+DROP TABLE IF EXISTS s_flood_merge_ar;
+
+CREATE TABLE s_flood_merge_ar AS
+SELECT
+    f.tile_id,
+    ST_Intersection(f.geometry, g.geom) AS geometry
+FROM
+    s_flood_merge_by_tile_ar f
+JOIN
+    s_tile_grid_ar g ON f.tile_id = g.id
+WHERE
+    ST_Intersects(f.geometry, g.geom);
+
+-- Assign SRID if missing (only needed if ST_SRID returns 0)
+UPDATE s_flood_road_ln SET geometry = ST_SetSRID(geometry, 4326) WHERE ST_SRID(geometry) = 0;
+UPDATE s_flood_merge_ar SET geometry = ST_SetSRID(geometry, 4326) WHERE ST_SRID(geometry) = 0;
+
+-- Spatial index for the vector tiles of step 04 (tile envelope joins)
+CREATE INDEX idx_s_flood_merge_ar_geom ON s_flood_merge_ar USING GIST (geometry);
+
+-- Create the new table with a single row containing the first model_run_time value from t_flow_forecast
+DROP TABLE IF EXISTS t_current_forecast;
+
+CREATE TABLE t_current_forecast AS
+SELECT model_run_time
+FROM t_flow_forecast
+LIMIT 1;
+
+-- Need to add col to s_flood_merge_ar
+ALTER TABLE s_flood_merge_ar
+ADD COLUMN model_run_time TEXT;
+
+-- Insert one row if s_flood_merge_ar is empty
+INSERT INTO s_flood_merge_ar (model_run_time) SELECT NULL WHERE NOT EXISTS (SELECT 1 FROM s_flood_merge_ar);
+
+UPDATE s_flood_merge_ar
+SET model_run_time = (SELECT model_run_time FROM t_current_forecast LIMIT 1);
+
+-- Record this cycle so the next run can be incremental
+DELETE FROM t_incremental_state;
+
+INSERT INTO t_incremental_state (model_run_time, updated_at)
+SELECT model_run_time, now()
+FROM t_current_forecast;
+
+-- Release the advisory lock manually (optional, as it auto-releases at session end)
+SELECT pg_advisory_unlock(COALESCE(NULLIF(current_setting('fast.lock_key', true), '')::bigint, 20250628));
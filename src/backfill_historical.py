@@ -0,0 +1,454 @@
+# FAST-realtime update
+# Script - backfill_historical
+#
+# Replay a range of past NWM cycles (a whole flood event) through steps
+# 01-04, several cycles at a time.  The NWM files come from a local archive
+# folder with the 'noaa-nwm-pds' layout (nwm.YYYYMMDD/short_range/...) or
+# from a bucket -- the NWM bucket itself or a local S3 stand-in such as
+# MinIO via s3_endpoint_url.
+#
+# Static tables are checked / built and the bridge inputs read once; every
+# cycle then runs in its own worker process with its own PostgreSQL schema
+# (fast_cycle_YYYYMMDDHH) first on the search_path, so the unchanged steps
+# write that cycle's t_flow_forecast, s_flood_* and s_bridge_warning_pnt
+# there while reading the static tables from public.  Optionally each
+# cycle's layers are published under its own S3 prefix.
+#
+# Created by: Andy Carter, PE
+# Created - 2025.07.21
+# Revised - 2025.07.25 -- Per-hour layers off for the cycles
+# ************************************************************
+
+# ************************************************************
+import os
+import re
+import sys
+import json
+import concurrent.futures
+
+import argparse
+import configparser
+import time
+import datetime
+import warnings
+
+import boto3
+import psycopg2
+from psycopg2 import sql
+
+from fast_realtime_update import fn_get_db_params
+from nwm_products import fn_get_nwm_product, fn_sort_product_files
+from run_metrics import fn_start_run_metrics, fn_metric_stage
+# ************************************************************
+
+
+# Written by steps 01 and 03 (not dropped by the SQL file)
+LIST_STEP_TABLES = ['t_flow_forecast', 't_flow_change', 's_bridge_warning_pnt']
+
+# Static bridge inputs, set once per worker process (fn_init_worker)
+TUP_BRIDGE_INPUTS = None
+
+
+# ^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
+def is_valid_file(parser, arg):
+    if not os.path.exists(arg):
+        parser.error("The file %s does not exist" % arg)
+    else:
+        # File exists so return the directory
+        return arg
+        return open(arg, 'r')  # return an open file handle
+# ^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
+
+
+# ----------------
+def fn_str_to_bool(value):
+    if isinstance(value, bool):
+        return value
+    if value.lower() in {'true', 't', '1'}:
+        return True
+    elif value.lower() in {'false', 'f', '0'}:
+        return False
+    else:
+        raise argparse.ArgumentTypeError(f"Boolean value expected. Got '{value}'.")
+# ----------------
+
+
+# ----------------
+def fn_parse_cycle(str_cycle):
+    # '2025-07-04T06', '2025-07-04T06:00:00' or '2025070406' -> datetime
+    for str_format in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H', '%Y%m%d%H'):
+        try:
+            return datetime.datetime.strptime(str_cycle.strip(), str_format)
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"Cycle expected as YYYY-MM-DDTHH or YYYYMMDDHH. Got '{str_cycle}'.")
+# ----------------
+
+
+# ----------------
+def fn_list_source_keys(str_nwm_source, str_prefix):
+    # Object keys under str_prefix, from a local archive folder or a bucket
+    if os.path.isdir(str_nwm_source):
+        str_folder = os.path.join(str_nwm_source, str_prefix)
+        if not os.path.isdir(str_folder):
+            return []
+        return [str_prefix + str_name for str_name in sorted(os.listdir(str_folder))]
+
+    s3 = boto3.client('s3')
+    list_keys = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=str_nwm_source, Prefix=str_prefix):
+        list_keys.extend(obj['Key'] for obj in page.get('Contents', []))
+    return list_keys
+# ----------------
+
+
+# ---------------------
+def fn_list_archive_cycles(str_nwm_source, dict_product, dt_start, dt_end):
+    """
+    Complete cycles of dict_product with dt_start <= cycle <= dt_end.
+
+    Returns:
+        list of (datetime cycle, list of keys in valid-time order), oldest first
+    """
+    list_cycles = []
+    dt_day = dt_start.replace(hour=0)
+    while dt_day <= dt_end:
+        str_prefix = f"nwm.{dt_day:%Y%m%d}/{dict_product['folder']}"
+
+        dict_groups = {}
+        for str_key in fn_list_source_keys(str_nwm_source, str_prefix):
+            match = dict_product['pattern'].search(str_key)
+            if match:
+                dict_groups.setdefault(int(match.group(1)), []).append(str_key)
+
+        for int_hour, list_keys in sorted(dict_groups.items()):
+            dt_cycle = dt_day.replace(hour=int_hour)
+            if not dt_start <= dt_cycle <= dt_end:
+                continue
+            if len(list_keys) < dict_product['files']:
+                print(f"  -- Skipping incomplete cycle {dt_cycle:%Y-%m-%dT%H} ({len(list_keys)} files)")
+                continue
+            list_cycles.append((dt_cycle, fn_sort_product_files(list_keys, dict_product)[:dict_product['files']]))
+
+        dt_day += datetime.timedelta(days=1)
+
+    return list_cycles
+# ---------------------
+
+
+# ----------------
+def fn_list_dynamic_tables(str_sql_file_path):
+    # Every table the cycle writes: the ones the SQL file drops and recreates
+    # plus the step 01 / 03 outputs
+    with open(str_sql_file_path, 'r') as sql_file:
+        list_tables = re.findall(r'DROP TABLE IF EXISTS\s+(\w+)', sql_file.read(), flags=re.IGNORECASE)
+    return list(dict.fromkeys(list_tables + LIST_STEP_TABLES))
+# ----------------
+
+
+# ----------------
+def fn_prepare_cycle_schema(dict_db_params, str_schema, list_tables):
+    # A fresh schema holding an empty placeholder of every dynamic table, so
+    # that 'DROP TABLE IF EXISTS x' on the cycle's search_path always finds the
+    # cycle's own table and never falls through to the one in public
+    conn = psycopg2.connect(
+        host=dict_db_params.get("host"),
+        user=dict_db_params.get("user"),
+        password=dict_db_params.get("password"),
+        dbname=dict_db_params.get("dbname"),
+        options='-c search_path=public'
+    )
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL("DROP SCHEMA IF EXISTS {} CASCADE").format(sql.Identifier(str_schema)))
+            cur.execute(sql.SQL("CREATE SCHEMA {}").format(sql.Identifier(str_schema)))
+            for str_table in list_tables:
+                cur.execute(sql.SQL("CREATE TABLE {}.{} ()").format(sql.Identifier(str_schema),
+                                                                  sql.Identifier(str_table)))
+        conn.commit()
+    finally:
+        conn.close()
+# ----------------
+
+
+# ----------------
+def fn_write_cycle_config(config, str_path, str_publish_sub_folder):
+    # The backfill config with this cycle's publish prefix.  Cycles are
+    # published side by side: no latest.json, no pruning, no skip-unchanged.
+    # The per-hour tables are not built per cycle (only the SQL file runs),
+    # so the hourly layers are off -- public's would be found instead.  Every
+    # cycle is a full update: no threshold-only refresh.
+    config_cycle = configparser.ConfigParser()
+    config_cycle.read_dict(config)
+    if 'write_to_s3' not in config_cycle:
+        config_cycle['write_to_s3'] = {}
+    config_cycle['write_to_s3']['publish_sub_folder'] = str_publish_sub_folder
+    config_cycle['write_to_s3']['immutable_runs'] = 'False'
+    config_cycle['write_to_s3']['skip_unchanged'] = 'False'
+    config_cycle['write_to_s3']['hourly_layers'] = 'False'
+    if 'sql' not in config_cycle:
+        config_cycle['sql'] = {}
+    config_cycle['sql']['skip_unchanged_cycles'] = 'False'
+    with open(str_path, 'w') as file_out:
+        config_cycle.write(file_out)
+# ----------------
+
+
+# ----------------
+def fn_point_s3_at_endpoint(str_endpoint_url):
+    # boto3 and s3fs read these when their clients are created (set before
+    # the step modules -- and so fsspec -- are imported in the workers)
+    os.environ['AWS_ENDPOINT_URL'] = str_endpoint_url
+    os.environ['FSSPEC_S3_ENDPOINT_URL'] = str_endpoint_url
+    if 'fsspec' in sys.modules:
+        import fsspec.config
+        fsspec.config.set_conf_env(fsspec.config.conf)
+# ----------------
+
+
+# ----------------
+def fn_init_worker(tup_bridge_inputs):
+    global TUP_BRIDGE_INPUTS
+    TUP_BRIDGE_INPUTS = tup_bridge_inputs
+    warnings.filterwarnings("ignore", category=UserWarning)
+# ----------------
+
+
+# .........................
+def fn_backfill_cycle(dict_job):
+    """
+    Steps 01-04 for one cycle, in a worker process.  PGOPTIONS puts the
+    cycle's schema first on the search_path of every connection the steps
+    open (psycopg2 and SQLAlchemy alike) and gives step 02 its own advisory
+    lock key, so cycles do not wait on each other.
+
+    Returns:
+        dict: cycle, schema, status, seconds
+    """
+    os.environ['PGOPTIONS'] = f"-c search_path={dict_job['schema']},public -c fast.lock_key={dict_job['lock_key']}"
+
+    run_metrics = fn_start_run_metrics({'district': dict_job['district'], 'model_run_time': dict_job['cycle'],
+                                        'mode': 'backfill'})
+    flt_start = time.time()
+    str_status = 'error'
+
+    try:
+        with fn_metric_stage('cycle'):
+            fn_prepare_cycle_schema(dict_job['db_params'], dict_job['schema'], dict_job['tables'])
+
+            with fn_metric_stage('step_01_flows'):
+                from populate_t_flow_forecast_from_NWM_01 import fn_populate_t_flow_forecast_from_NWM
+                fn_populate_t_flow_forecast_from_NWM(dict_job['config_path'], False,
+                                                     dict_job['keys'], dict_job['nwm_source'])
+
+            with fn_metric_stage('step_02_sql') as dict_stage:
+                from run_sql_udpate_dynamic_tables_02 import fn_run_sql_script
+                str_status = fn_run_sql_script(dict_job['db_params'], dict_job['sql_file_path'])
+                if dict_stage is not None and str_status != "success":
+                    dict_stage['outcome'] = str_status
+
+            if str_status == "success":
+                with fn_metric_stage('step_03_bridges'):
+                    from create_s_bridge_warning_pnt_03 import fn_create_s_bridge_warning_pnt
+                    fn_create_s_bridge_warning_pnt(dict_job['config_path'], False, TUP_BRIDGE_INPUTS)
+
+                if dict_job['publish']:
+                    with fn_metric_stage('step_04_publish'):
+                        from push_to_s3_04 import fn_push_to_s3
+                        fn_push_to_s3(dict_job['config_path'], False)
+    except Exception as e:
+        print(f"  !! Cycle {dict_job['cycle']} failed: {e}")
+        str_status = 'error'
+    finally:
+        if dict_job['metrics_jsonl_path']:
+            try:
+                run_metrics.write_jsonl(dict_job['metrics_jsonl_path'])
+            except OSError as e:
+                print(f"  !! Could not write run metrics: {e}")
+
+    return {'cycle': dict_job['cycle'], 'schema': dict_job['schema'], 'status': str_status,
+            'seconds': round(time.time() - flt_start, 1)}
+# .........................
+
+
+# .........................................................
+def fn_backfill_historical(str_config_file_path, dt_start, dt_end, int_max_workers, b_print_output):
+    # suppress all warnings
+    warnings.filterwarnings("ignore", category=UserWarning)
+
+    print(" ")
+    if b_print_output:
+        print("+=================================================================+")
+        print("|              FAST HISTORICAL BACKFILL (NWM REPLAY)              |")
+        print("|                Created by Andy Carter, PE of                    |")
+        print("|             Center for Water and the Environment                |")
+        print("|                 University of Texas at Austin                   |")
+        print("+-----------------------------------------------------------------+")
+        print("  ---(c) INPUT GLOBAL CONFIGURATION FILE: " + str_config_file_path)
+        print(f"  ---(s) FIRST CYCLE: {dt_start:%Y-%m-%dT%H}")
+        print(f"  ---(e) LAST CYCLE: {dt_end:%Y-%m-%dT%H}")
+        print("===================================================================")
+    else:
+        print(f'Backfill: {dt_start:%Y-%m-%dT%H} to {dt_end:%Y-%m-%dT%H}')
+
+    # --- Read variables from config.ini ---
+    config = configparser.ConfigParser()
+    config.read(str_config_file_path)
+
+    if 'database' not in config:
+        raise KeyError("Missing [database] section in config file")
+    dict_db_params = fn_get_db_params(config)
+
+    dict_product = fn_get_nwm_product(config)
+
+    # [backfill] -- all optional
+    str_nwm_source = config.get('backfill', 'nwm_source', fallback='noaa-nwm-pds').strip()
+    if str_nwm_source.startswith('s3://'):
+        str_nwm_source = str_nwm_source[len('s3://'):].strip('/')
+    str_s3_endpoint_url = config.get('backfill', 's3_endpoint_url', fallback='').strip()
+
+    if int_max_workers is None:
+        int_max_workers = config.getint('backfill', 'max_workers', fallback=4)
+
+    # Always the full rebuild -- a new cycle schema has no incremental state
+    str_sql_default = os.path.join(os.path.dirname(config.get('sql', 'sql_file_path', fallback='')),
+                                   'roadflood_create_dynamic_tables_big.sql')
+    str_sql_file_path = config.get('backfill', 'sql_file_path', fallback=str_sql_default)
+    str_static_sql_file_path = config.get('sql', 'static_sql_file_path', fallback=os.path.join(
+        os.path.dirname(str_sql_file_path), 'roadflood_create_static_tables.sql'))
+
+    b_publish = config.getboolean('backfill', 'publish', fallback=False)
+    str_publish_template = config.get('backfill', 'publish_sub_folder', fallback='backfill/{cycle}/')
+    str_work_dir = config.get('backfill', 'work_dir', fallback='backfill_work')
+    str_results_path = config.get('backfill', 'results_path', fallback='')
+
+    str_metrics_jsonl_path = config.get('metrics', 'jsonl_path', fallback='')
+    str_district = config.get('metrics', 'district', fallback=dict_db_params['dbname'] or 'unknown')
+
+    if str_s3_endpoint_url:
+        fn_point_s3_at_endpoint(str_s3_endpoint_url)
+
+    # --- Cycles in the range ---
+    list_cycles = fn_list_archive_cycles(str_nwm_source, dict_product, dt_start, dt_end)
+    print(f"  -- {len(list_cycles)} complete {dict_product['name']} cycles in {str_nwm_source}")
+    if not list_cycles:
+        return []
+
+    # --- Static data, once for every cycle ---
+    from run_sql_udpate_dynamic_tables_02 import fn_ensure_static_tables
+    from create_s_bridge_warning_pnt_03 import fn_load_bridge_inputs
+
+    str_status = fn_ensure_static_tables(dict_db_params, str_static_sql_file_path)
+    if str_status != "success":
+        raise RuntimeError(f"Static tables could not be built ({str_status})")
+    tup_bridge_inputs = fn_load_bridge_inputs(dict_db_params)
+
+    list_tables = fn_list_dynamic_tables(str_sql_file_path)
+
+    # --- One job per cycle ---
+    os.makedirs(str_work_dir, exist_ok=True)
+    list_jobs = []
+    for dt_cycle, list_keys in list_cycles:
+        str_cycle = f"{dt_cycle:%Y%m%dT%H}"
+        str_config_path = os.path.join(str_work_dir, f"config_{str_cycle}.ini")
+        fn_write_cycle_config(config, str_config_path, str_publish_template.format(cycle=str_cycle))
+        list_jobs.append({
+            'cycle': dt_cycle.strftime('%Y-%m-%dT%H:%M:%S'),
+            'schema': f"fast_cycle_{dt_cycle:%Y%m%d%H}",
+            'lock_key': int(f"{dt_cycle:%Y%m%d%H}"),
+            'keys': list_keys,
+            'config_path': str_config_path,
+            'nwm_source': str_nwm_source,
+            'sql_file_path': str_sql_file_path,
+            'db_params': dict_db_params,
+            'tables': list_tables,
+            'publish': b_publish,
+            'district': str_district,
+            'metrics_jsonl_path': str_metrics_jsonl_path,
+        })
+
+    # --- Cycles in parallel, one process each ---
+    print(f"  -- Replaying {len(list_jobs)} cycles on {int_max_workers} workers")
+    list_results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=int_max_workers, initializer=fn_init_worker,
+                                                initargs=(tup_bridge_inputs,)) as executor:
+        list_futures = [executor.submit(fn_backfill_cycle, dict_job) for dict_job in list_jobs]
+        for future in concurrent.futures.as_completed(list_futures):
+            dict_result = future.result()
+            list_results.append(dict_result)
+            print(f"  -- [{len(list_results)}/{len(list_jobs)}] {dict_result['cycle']} "
+                  f"{dict_result['status']} ({dict_result['seconds']} s) -> {dict_result['schema']}")
+
+    list_results.sort(key=lambda dict_result: dict_result['cycle'])
+    if str_results_path:
+        with open(str_results_path, 'a') as file_out:
+            for dict_result in list_results:
+                file_out.write(json.dumps(dict_result) + '\n')
+
+    list_failed = [dict_result['cycle'] for dict_result in list_results if dict_result['status'] != "success"]
+    if list_failed:
+        print(f"  !! {len(list_failed)} cycles failed: {', '.join(list_failed)}")
+
+    return list_results
+# .........................................................
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+if __name__ == '__main__':
+
+    flt_start_run = time.time()
+
+    parser = argparse.ArgumentParser(description='========= FAST HISTORICAL BACKFILL (NWM REPLAY) =========')
+
+    parser.add_argument('-c',
+                        dest = "str_config_file_path",
+                        help=r'REQUIRED: Global configuration filepath Example:C:\Users\civil\dev\fast_realtime\src\config_historical.ini',
+                        required=True,
+                        metavar='FILE',
+                        type=lambda x: is_valid_file(parser, x))
+
+    parser.add_argument('-s',
+                        dest = "dt_start",
+                        help=r'REQUIRED: First cycle (UTC) Example: 2025-07-04T00',
+                        required=True,
+                        metavar='CYCLE',
+                        type=fn_parse_cycle)
+
+    parser.add_argument('-e',
+                        dest = "dt_end",
+                        help=r'REQUIRED: Last cycle (UTC) Example: 2025-07-06T23',
+                        required=True,
+                        metavar='CYCLE',
+                        type=fn_parse_cycle)
+
+    parser.add_argument('-w',
+                        dest = "int_max_workers",
+                        help=r'OPTIONAL: Cycles processed at once Default: [backfill] max_workers or 4',
+                        required=False,
+                        default=None,
+                        metavar='INT',
+                        type=int)
+
+    parser.add_argument('-r',
+                    dest = "b_print_output",
+                    help=r'OPTIONAL: Print output messages Default: True',
+                    required=False,
+                    default=True,
+                    metavar='T/F',
+                    type=fn_str_to_bool)
+
+    args = vars(parser.parse_args())
+
+    list_results = fn_backfill_historical(args['str_config_file_path'], args['dt_start'], args['dt_end'],
+                                          args['int_max_workers'], args['b_print_output'])
+
+    flt_end_run = time.time()
+    flt_time_pass = (flt_end_run - flt_start_run) // 1
+    time_pass = datetime.timedelta(seconds=flt_time_pass)
+
+    print('Compute Time: ' + str(time_pass))
+
+    if any(dict_result['status'] != "success" for dict_result in list_results):
+        raise SystemExit(1)
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
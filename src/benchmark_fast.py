@@ -0,0 +1,419 @@
+# FAST-realtime update
+# Script - benchmark_fast
+#
+# Offline end-to-end benchmark of steps 00-04.  No network access:
+#  -- synthetic NWM 'channel_rt' cycles (benchmark_synthetic_nwm), one per
+#     flood scenario, served from a local S3 stand-in (moto server, or any
+#     S3-compatible endpoint such as MinIO via s3_endpoint_url)
+#  -- a local PostGIS seeded with synthetic districts of several sizes
+#     (benchmark_seed_postgis), one database per size
+#  -- each size x scenario is run 'repeats' times; the median time of every
+#     step is compared with a stored baseline and regressions are flagged
+#
+# The steps are called unchanged: boto3 and s3fs are pointed at the stand-in
+# with AWS_ENDPOINT_URL / FSSPEC_S3_ENDPOINT_URL before they are imported.
+#
+# Created by: Andy Carter, PE
+# Created - 2025.07.18
+# ************************************************************
+
+# ************************************************************
+import os
+import sys
+import json
+import statistics
+
+import argparse
+import configparser
+import time
+import datetime
+import warnings
+
+import pandas as pd
+
+from run_metrics import fn_start_run_metrics, fn_metric_stage
+from benchmark_synthetic_nwm import (fn_parse_scenarios, fn_synthetic_feature_ids,
+                                     fn_synthetic_texas_feature_ids, fn_write_synthetic_cycle,
+                                     fn_write_texas_feature_id_list, INT_CONUS_FEATURE_COUNT)
+from benchmark_seed_postgis import fn_create_database, fn_is_seeded, fn_seed_district
+
+# Optional: in-process S3 stand-in (not needed with s3_endpoint_url)
+try:
+    from moto.server import ThreadedMotoServer
+except ImportError:
+    ThreadedMotoServer = None
+# ************************************************************
+
+
+# Same bucket the steps read (hard coded in steps 00 and 01)
+STR_NWM_BUCKET = 'noaa-nwm-pds'
+
+# Timed steps -- same stage names as fast_realtime_update
+LIST_STEPS = ['step_00_check', 'step_01_flows', 'step_02_sql', 'step_03_bridges', 'step_04_publish']
+
+
+# ^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
+def is_valid_file(parser, arg):
+    if not os.path.exists(arg):
+        parser.error("The file %s does not exist" % arg)
+    else:
+        # File exists so return the directory
+        return arg
+        return open(arg, 'r')  # return an open file handle
+# ^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
+
+
+# ----------------
+def fn_str_to_bool(value):
+    if isinstance(value, bool):
+        return value
+    if value.lower() in {'true', 't', '1'}:
+        return True
+    elif value.lower() in {'false', 'f', '0'}:
+        return False
+    else:
+        raise argparse.ArgumentTypeError(f"Boolean value expected. Got '{value}'.")
+# ----------------
+
+
+# ----------------
+def fn_parse_district_sizes(str_sizes):
+    # 'small:500, large:50000' -> {'small': 500, 'large': 50000}
+    dict_sizes = {}
+    for str_item in str_sizes.split(','):
+        if str_item.strip():
+            str_name, str_count = [s.strip() for s in str_item.split(':')]
+            dict_sizes[str_name] = int(str_count)
+    return dict_sizes
+# ----------------
+
+
+# ----------------
+def fn_point_s3_at_endpoint(str_endpoint_url):
+    # boto3 (steps 00, 01, 04) and s3fs (step 01) read these when their
+    # clients are created; s3fs reads its env config when fsspec is imported
+    os.environ['AWS_ENDPOINT_URL'] = str_endpoint_url
+    os.environ['FSSPEC_S3_ENDPOINT_URL'] = str_endpoint_url
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    if 'fsspec' in sys.modules:
+        import fsspec.config
+        fsspec.config.set_conf_env(fsspec.config.conf)
+# ----------------
+
+
+# ----------------
+def fn_replace_bucket_contents(s3, str_bucket_name, str_local_dir, list_keys):
+    # The stand-in NWM bucket holds exactly one cycle
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=str_bucket_name):
+        list_objects = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+        if list_objects:
+            s3.delete_objects(Bucket=str_bucket_name, Delete={'Objects': list_objects})
+
+    for str_key in list_keys:
+        s3.upload_file(os.path.join(str_local_dir, str_key), str_bucket_name, str_key)
+# ----------------
+
+
+# ----------------
+def fn_write_district_config(config, str_path, str_dbname, str_texas_feature_id_path):
+    # The benchmark config with this district's database and feature id list
+    config_district = configparser.ConfigParser()
+    config_district.read_dict(config)
+    config_district['database']['dbname'] = str_dbname
+    if 'flow_from_nwm' not in config_district:
+        config_district['flow_from_nwm'] = {}
+    config_district['flow_from_nwm']['texas_faeture_id_list'] = str_texas_feature_id_path
+    with open(str_path, 'w') as file_out:
+        config_district.write(file_out)
+# ----------------
+
+
+# ----------------
+def fn_compare_to_baseline(dict_results, dict_baseline, flt_tolerance, flt_min_seconds):
+    """
+    A step regresses when it is slower than its baseline by more than
+    flt_tolerance (fraction) and by more than flt_min_seconds.
+
+    Returns:
+        list of (case, step, baseline seconds, current seconds)
+    """
+    list_regressions = []
+    for str_case, dict_steps in dict_results.items():
+        for str_step, flt_seconds in dict_steps.items():
+            flt_base = dict_baseline.get(str_case, {}).get(str_step)
+            if flt_base is None or flt_seconds is None:
+                continue
+            if flt_seconds > flt_base * (1 + flt_tolerance) and flt_seconds - flt_base > flt_min_seconds:
+                list_regressions.append((str_case, str_step, flt_base, flt_seconds))
+    return list_regressions
+# ----------------
+
+
+# ----------------
+def fn_run_case(str_district_config_path, dict_labels, str_metrics_jsonl_path, b_print_output):
+    # One pass of steps 00-04; returns {step: seconds} (None when not reached)
+    from determine_if_database_current_00 import fn_determine_if_database_current
+    from populate_t_flow_forecast_from_NWM_01 import fn_populate_t_flow_forecast_from_NWM
+    from run_sql_udpate_dynamic_tables_02 import fn_run_sql_udpate_dynamic_tables
+    from create_s_bridge_warning_pnt_03 import fn_create_s_bridge_warning_pnt
+    from push_to_s3_04 import fn_push_to_s3
+
+    run_metrics = fn_start_run_metrics(dict_labels)
+    try:
+        with fn_metric_stage('run'):
+            with fn_metric_stage('step_00_check'):
+                fn_determine_if_database_current(str_district_config_path, b_print_output)
+            with fn_metric_stage('step_01_flows'):
+                fn_populate_t_flow_forecast_from_NWM(str_district_config_path, b_print_output)
+            with fn_metric_stage('step_02_sql') as dict_stage:
+                str_status = fn_run_sql_udpate_dynamic_tables(str_district_config_path, b_print_output)
+                dict_stage['outcome'] = str_status
+            if str_status == "success":
+                with fn_metric_stage('step_03_bridges'):
+                    fn_create_s_bridge_warning_pnt(str_district_config_path, b_print_output)
+                with fn_metric_stage('step_04_publish'):
+                    fn_push_to_s3(str_district_config_path, b_print_output)
+    finally:
+        if str_metrics_jsonl_path:
+            run_metrics.write_jsonl(str_metrics_jsonl_path)
+
+    dict_seconds = {dict_stage['stage'].split('/')[-1]: dict_stage['seconds']
+                    for dict_stage in run_metrics.list_stages
+                    if dict_stage['stage'].startswith('run/') and dict_stage['outcome'] == 'success'}
+    return {str_step: dict_seconds.get(str_step) for str_step in LIST_STEPS}
+# ----------------
+
+
+# .........................................................
+def fn_benchmark_fast(str_config_file_path, b_print_output, b_save_baseline=False):
+    # suppress all warnings
+    warnings.filterwarnings("ignore", category=UserWarning)
+
+    print(" ")
+    if b_print_output:
+        print("+=================================================================+")
+        print("|                FAST OFFLINE END-TO-END BENCHMARK                |")
+        print("|                Created by Andy Carter, PE of                    |")
+        print("|             Center for Water and the Environment                |")
+        print("|                 University of Texas at Austin                   |")
+        print("+-----------------------------------------------------------------+")
+        print("  ---(c) INPUT GLOBAL CONFIGURATION FILE: " + str_config_file_path)
+        print("  ---[r] PRINT OUTPUT: " + str(b_print_output))
+        print("  ---[b] SAVE BASELINE: " + str(b_save_baseline))
+        print("===================================================================")
+    else:
+        print('Benchmark: steps 00-04 on synthetic data')
+
+    # --- Read variables from config.ini ---
+    config = configparser.ConfigParser()
+    config.read(str_config_file_path)
+
+    if 'database' not in config or 'benchmark' not in config:
+        raise KeyError("Missing [database] or [benchmark] section in config file")
+
+    section = config['database']
+    dict_db_params = {
+        'host': section.get('host', ''),
+        'dbname': section.get('dbname', 'fast_benchmark'),
+        'user': section.get('username', ''),
+        'password': section.get('password', ''),
+        'port': section.get('port', '5432')
+    }
+    if dict_db_params['password'] == 'xxx':
+        dict_db_params['password'] = os.environ.get('DB_PASSWORD', '')
+
+    section = config['benchmark']
+    str_work_dir = section.get('work_dir', '/tmp/fast_benchmark')
+    dict_sizes = fn_parse_district_sizes(section.get('district_sizes', 'small:500, medium:5000, large:50000'))
+    dict_scenarios = fn_parse_scenarios(section.get('scenarios', 'dry:0:0, moderate:0.05:3, major:0.3:6'))
+    int_repeats = section.getint('repeats', 3)
+    int_seed = section.getint('seed', 20250628)
+    int_conus_count = section.getint('conus_feature_count', INT_CONUS_FEATURE_COUNT)
+    int_texas_count = section.getint('texas_feature_count', max(dict_sizes.values()))
+    str_reference_time = section.get('reference_time', '2025-06-01T12:00:00')
+    b_extra_variables = section.getboolean('nwm_extra_variables', True)
+    b_reseed = section.getboolean('reseed', False)
+    int_flow_steps = section.getint('flow_steps', 10)
+    int_roads_per_reach = section.getint('roads_per_reach', 2)
+    int_bridge_every = section.getint('bridge_every', 5)
+    str_endpoint_url = section.get('s3_endpoint_url', '')
+    int_s3_port = section.getint('s3_port', 5005)
+    str_baseline_path = section.get('baseline_path', os.path.join(str_work_dir, 'benchmark_baseline.json'))
+    str_results_path = section.get('results_path', os.path.join(str_work_dir, 'benchmark_results.jsonl'))
+    str_metrics_path = section.get('metrics_jsonl_path', os.path.join(str_work_dir, 'benchmark_metrics.jsonl'))
+    flt_tolerance = section.getfloat('regression_tolerance', 0.15)
+    flt_min_seconds = section.getfloat('regression_min_seconds', 0.5)
+
+    if int_texas_count < max(dict_sizes.values()):
+        raise ValueError("texas_feature_count must be at least the largest district size")
+
+    str_publish_bucket = config.get('write_to_s3', 'publish_bucket', fallback='fast-benchmark-publish')
+
+    os.makedirs(str_work_dir, exist_ok=True)
+
+    # --- S3 stand-in ---
+    moto_server = None
+    if not str_endpoint_url:
+        if ThreadedMotoServer is None:
+            raise ImportError("benchmark requires the 'moto[server]' package or [benchmark] s3_endpoint_url")
+        moto_server = ThreadedMotoServer(ip_address='127.0.0.1', port=int_s3_port)
+        moto_server.start()
+        str_endpoint_url = f"http://127.0.0.1:{int_s3_port}"
+    fn_point_s3_at_endpoint(str_endpoint_url)
+    print(f"  -- S3 stand-in: {str_endpoint_url}")
+
+    import boto3
+    s3 = boto3.client('s3')
+
+    try:
+        for str_bucket_name in (STR_NWM_BUCKET, str_publish_bucket):
+            try:
+                s3.create_bucket(Bucket=str_bucket_name)
+            except s3.exceptions.BucketAlreadyOwnedByYou:
+                pass
+
+        # --- Synthetic NWM cycles, one per scenario (cached in work_dir) ---
+        arr_feature_ids = fn_synthetic_feature_ids(int_conus_count, int_seed)
+        arr_texas_ids = fn_synthetic_texas_feature_ids(arr_feature_ids, int_texas_count, int_seed)
+
+        str_texas_path = os.path.join(str_work_dir, 'texas_feature_ids.csv')
+        fn_write_texas_feature_id_list(str_texas_path, arr_texas_ids)
+
+        str_nwm_dir = os.path.join(str_work_dir, 'nwm')
+        dict_cycle_keys = {}
+        for int_index, (str_scenario, (flt_fraction, flt_peak)) in enumerate(dict_scenarios.items()):
+            # A distinct cycle per scenario, so model_run_time tells them apart
+            str_cycle_time = (pd.Timestamp(str_reference_time) + pd.Timedelta(hours=int_index)).isoformat()
+            flt_start = time.time()
+            dict_cycle_keys[str_scenario] = fn_write_synthetic_cycle(
+                os.path.join(str_nwm_dir, str_scenario), arr_feature_ids, str_cycle_time,
+                flt_fraction, flt_peak, b_extra_variables)
+            print(f"  -- NWM cycle '{str_scenario}' ({str_cycle_time}): {time.time() - flt_start:.1f} s")
+
+        # --- Each district size x scenario ---
+        from run_sql_create_static_tables import fn_run_sql_create_static_tables
+
+        dict_results = {}
+        for str_size, int_reaches in dict_sizes.items():
+            dict_district_db = dict(dict_db_params, dbname=f"{dict_db_params['dbname']}_{str_size}")
+            str_district_config_path = os.path.join(str_work_dir, f"config_{str_size}.ini")
+            fn_write_district_config(config, str_district_config_path, dict_district_db['dbname'], str_texas_path)
+
+            fn_create_database(dict_district_db)
+            if b_reseed or not fn_is_seeded(dict_district_db, int_reaches):
+                flt_start = time.time()
+                fn_seed_district(dict_district_db, arr_texas_ids[:int_reaches], int_flow_steps,
+                                 int_roads_per_reach, int_bridge_every)
+                if fn_run_sql_create_static_tables(str_district_config_path, False) != "success":
+                    raise RuntimeError(f"Static tables of district '{str_size}' failed")
+                print(f"  -- Seeded '{str_size}': {time.time() - flt_start:.1f} s")
+
+            for str_scenario in dict_scenarios:
+                fn_replace_bucket_contents(s3, STR_NWM_BUCKET,
+                                           os.path.join(str_nwm_dir, str_scenario), dict_cycle_keys[str_scenario])
+
+                list_runs = []
+                for int_repeat in range(int_repeats):
+                    dict_labels = {'district': f"benchmark_{str_size}", 'scenario': str_scenario,
+                                   'repeat': str(int_repeat)}
+                    list_runs.append(fn_run_case(str_district_config_path, dict_labels,
+                                                 str_metrics_path, b_print_output))
+
+                dict_median = {}
+                for str_step in LIST_STEPS:
+                    list_seconds = [dict_run[str_step] for dict_run in list_runs if dict_run[str_step] is not None]
+                    dict_median[str_step] = round(statistics.median(list_seconds), 3) if list_seconds else None
+                if all(dict_median[str_step] is not None for str_step in LIST_STEPS):
+                    dict_median['total'] = round(sum(dict_median[str_step] for str_step in LIST_STEPS), 3)
+                dict_results[f"{str_size}/{str_scenario}"] = dict_median
+    finally:
+        if moto_server is not None:
+            moto_server.stop()
+
+    # --- Report and compare with the baseline ---
+    dict_baseline = {}
+    if os.path.exists(str_baseline_path):
+        with open(str_baseline_path, 'r') as file_in:
+            dict_baseline = json.load(file_in).get('results', {})
+
+    list_regressions = fn_compare_to_baseline(dict_results, dict_baseline, flt_tolerance, flt_min_seconds)
+    set_regressed = {(str_case, str_step) for str_case, str_step, _, _ in list_regressions}
+
+    print("+-----------------------------------------------------------------+")
+    print(f"  {'case':<22}" + ''.join(f"{str_step[:7]:>10}" for str_step in LIST_STEPS + ['total']))
+    for str_case, dict_steps in dict_results.items():
+        str_line = f"  {str_case:<22}"
+        for str_step in LIST_STEPS + ['total']:
+            flt_seconds = dict_steps.get(str_step)
+            str_cell = '-' if flt_seconds is None else f"{flt_seconds:.1f}"
+            if (str_case, str_step) in set_regressed:
+                str_cell += '!'
+            str_line += f"{str_cell:>10}"
+        print(str_line)
+
+    for str_case, str_step, flt_base, flt_seconds in list_regressions:
+        print(f"  !! Regression {str_case} {str_step}: {flt_base:.1f} s -> {flt_seconds:.1f} s")
+    if dict_baseline and not list_regressions:
+        print(f"  -- No regressions against {str_baseline_path}")
+
+    str_time = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S')
+    with open(str_results_path, 'a') as file_out:
+        file_out.write(json.dumps({'time_utc': str_time, 'results': dict_results,
+                                   'regressions': [list(tup) for tup in list_regressions]}) + '\n')
+
+    if b_save_baseline:
+        with open(str_baseline_path, 'w') as file_out:
+            json.dump({'created_utc': str_time, 'results': dict_results}, file_out, indent=2)
+        print(f"  -- Baseline saved to {str_baseline_path}")
+
+    return list_regressions
+# .........................................................
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+if __name__ == '__main__':
+
+    flt_start_run = time.time()
+
+    parser = argparse.ArgumentParser(description='========= FAST OFFLINE END-TO-END BENCHMARK =========')
+
+    parser.add_argument('-c',
+                        dest = "str_config_file_path",
+                        help=r'REQUIRED: Benchmark configuration filepath Example:config_benchmark.ini',
+                        required=True,
+                        metavar='FILE',
+                        type=lambda x: is_valid_file(parser, x))
+
+    parser.add_argument('-r',
+                    dest = "b_print_output",
+                    help=r'OPTIONAL: Print output messages Default: False',
+                    required=False,
+                    default=False,
+                    metavar='T/F',
+                    type=fn_str_to_bool)
+
+    parser.add_argument('-b',
+                    dest = "b_save_baseline",
+                    help=r'OPTIONAL: Save these results as the new baseline Default: False',
+                    required=False,
+                    default=False,
+                    metavar='T/F',
+                    type=fn_str_to_bool)
+
+    args = vars(parser.parse_args())
+
+    list_regressions = fn_benchmark_fast(args['str_config_file_path'], args['b_print_output'],
+                                         args['b_save_baseline'])
+
+    flt_end_run = time.time()
+    flt_time_pass = (flt_end_run - flt_start_run) // 1
+    time_pass = datetime.timedelta(seconds=flt_time_pass)
+
+    print('Compute Time: ' + str(time_pass))
+
+    # Non-zero exit when a step regressed -- usable as a CI gate
+    sys.exit(1 if list_regressions else 0)
+ #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
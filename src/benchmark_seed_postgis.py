@@ -0,0 +1,204 @@
+# FAST-realtime update
+# Script - benchmark_seed_postgis
+#
+# Synthetic static tables of one district for the offline benchmark
+# (benchmark_fast.py): reaches on a regular grid, nested inundation
+# polygons per flow step, road segments with flood triggers and bridges
+# with rating curves.  Flow steps are multiples of the same base flow the
+# synthetic NWM files use (benchmark_synthetic_nwm.fn_base_flow_cms).
+#
+# Created by: Andy Carter, PE
+# Created - 2025.07.18
+# ************************************************************
+
+# ************************************************************
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+# ************************************************************
+
+
+# Bump when the synthetic tables change -- seeded databases are rebuilt
+INT_SEED_VERSION = 1
+
+# benchmark_synthetic_nwm.fn_base_flow_cms in cfs
+BASE_FLOW_CFS_SQL = "((1.0 + (r.feature_id %% 997) / 10.0) * 35.3147)"
+
+# Tables replaced by the seed (static inputs, plus what an earlier run left)
+LIST_SEED_TABLES = [
+    's_flood_inundation_ar', 't_nextgen_to_nwm', 's_road_segment_ln', 't_road_flood_trigger',
+    't_bridge_rating_curve', 's_bridge_pnt', 't_current_forecast', 't_flow_forecast',
+    't_incremental_state', 't_benchmark_reach', 't_benchmark_seed']
+
+# Reaches on a grid starting at the lower left corner (degrees) -- the
+# inundation polygon of step k is a buffer of k x FLT_STEP_RADIUS, so the
+# higher steps of neighbouring reaches overlap and the tile union has work
+STR_SQL_SEED = """
+CREATE TABLE t_benchmark_reach AS
+SELECT
+    r.reach_id,
+    'bench-' || r.reach_id AS nextgen_id,
+    r.feature_id,
+    ST_SetSRID(ST_MakePoint(
+        %(lon)s + ((r.reach_id - 1) %% %(columns)s) * %(spacing)s,
+        %(lat)s + ((r.reach_id - 1) / %(columns)s) * %(spacing)s), 4326) AS geometry
+FROM t_benchmark_feature r;
+
+CREATE TABLE t_nextgen_to_nwm AS
+SELECT nextgen_id, feature_id FROM t_benchmark_reach;
+
+CREATE TABLE s_flood_inundation_ar AS
+SELECT
+    r.nextgen_id,
+    round(BASE_FLOW * (1 + 0.5 * k))::double precision AS flow,
+    ST_Multi(ST_Buffer(r.geometry, k * %(radius)s, 'quad_segs=4')) AS geometry
+FROM t_benchmark_reach r, generate_series(1, %(flow_steps)s) AS k;
+
+CREATE TABLE s_road_segment_ln AS
+SELECT
+    r.reach_id * 10 + n AS road_id,
+    r.reach_id * 10 + n AS osm_id,
+    (ARRAY['primary', 'secondary', 'residential'])[1 + n %% 3] AS fclass,
+    'Benchmark Rd ' || (r.reach_id * 10 + n) AS name,
+    'BR ' || n AS ref,
+    ST_SetSRID(ST_MakeLine(
+        ST_Translate(r.geometry, -%(road_half_length)s, (n - 0.5) * %(radius)s),
+        ST_Translate(r.geometry, %(road_half_length)s, (n - 0.5) * %(radius)s)), 4326) AS geometry
+FROM t_benchmark_reach r, generate_series(1, %(roads_per_reach)s) AS n;
+
+CREATE TABLE t_road_flood_trigger AS
+SELECT
+    r.reach_id * 10 + n AS road_id,
+    r.nextgen_id,
+    round(BASE_FLOW * (1.5 + 0.5 * n))::double precision AS min_flood_flow
+FROM t_benchmark_reach r, generate_series(1, %(roads_per_reach)s) AS n;
+
+CREATE TABLE t_bridge_rating_curve AS
+SELECT
+    'bench-' || r.reach_id AS uuid_bridge,
+    r.nextgen_id,
+    round(BASE_FLOW * 1.2)::double precision AS min_flow,
+    format('[(0.0, 100.0), (%%s, 104.0), (%%s, 108.0), (%%s, 112.0), (%%s, 116.0)]',
+           round(BASE_FLOW * 1.5), round(BASE_FLOW * 3),
+           round(BASE_FLOW * 5), round(BASE_FLOW * 8)) AS list_rating_curve
+FROM t_benchmark_reach r
+WHERE r.reach_id %% %(bridge_every)s = 0;
+
+CREATE TABLE s_bridge_pnt AS
+SELECT
+    'bench-' || r.reach_id AS uuid_bridge,
+    'B' || lpad(r.reach_id::text, 9, '0') AS "BRDG_ID",
+    108.0::double precision AS min_low_ch,
+    100.0::double precision AS min_ground,
+    112.0::double precision AS min_overtop,
+    'Benchmark Rd ' || (r.reach_id * 10 + 1) AS name,
+    'BR 1' AS ref,
+    'Benchmark Creek ' || r.reach_id AS nhd_name,
+    r.geometry
+FROM t_benchmark_reach r
+WHERE r.reach_id %% %(bridge_every)s = 0;
+
+-- Never matches a synthetic cycle, so step 00 reports an update
+CREATE TABLE t_current_forecast AS
+SELECT '1900-01-01T00:00:00'::text AS model_run_time;
+
+CREATE INDEX idx_s_flood_inundation_ar_geom ON s_flood_inundation_ar USING GIST (geometry);
+CREATE INDEX idx_s_flood_inundation_ar_nextgen_id ON s_flood_inundation_ar (nextgen_id);
+CREATE INDEX idx_s_road_segment_ln_geom ON s_road_segment_ln USING GIST (geometry);
+CREATE INDEX idx_s_road_segment_ln_road_id ON s_road_segment_ln (road_id);
+CREATE INDEX idx_t_road_flood_trigger_nextgen_id ON t_road_flood_trigger (nextgen_id);
+CREATE INDEX idx_s_bridge_pnt_uuid_bridge ON s_bridge_pnt (uuid_bridge);
+CREATE INDEX idx_t_nextgen_to_nwm_nextgen_id ON t_nextgen_to_nwm (nextgen_id);
+
+CREATE TABLE t_benchmark_seed AS
+SELECT %(seed_version)s AS seed_version, %(reaches)s AS reaches;
+""".replace('BASE_FLOW', BASE_FLOW_CFS_SQL)
+
+
+# ----------------
+def fn_get_connection(db_params, str_dbname=None):
+    return psycopg2.connect(
+        host=db_params.get("host"),
+        dbname=str_dbname or db_params.get("dbname"),
+        user=db_params.get("user"),
+        password=db_params.get("password"),
+        port=db_params.get("port", "5432")
+    )
+# ----------------
+
+
+# ----------------
+def fn_create_database(db_params):
+    # CREATE DATABASE cannot run in a transaction; connects to 'postgres'
+    connection = fn_get_connection(db_params, 'postgres')
+    connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (db_params['dbname'],))
+            if cursor.fetchone() is None:
+                cursor.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(db_params['dbname'])))
+                print(f"  -- Created database {db_params['dbname']}")
+    finally:
+        connection.close()
+
+    connection = fn_get_connection(db_params)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS postgis")
+        connection.commit()
+    finally:
+        connection.close()
+# ----------------
+
+
+# ----------------
+def fn_is_seeded(db_params, int_reaches):
+    connection = fn_get_connection(db_params)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('public.t_benchmark_seed')")
+            if cursor.fetchone()[0] is None:
+                return False
+            cursor.execute("SELECT seed_version, reaches FROM t_benchmark_seed")
+            return cursor.fetchone() == (INT_SEED_VERSION, int_reaches)
+    finally:
+        connection.close()
+# ----------------
+
+
+# ----------------------
+def fn_seed_district(db_params, arr_district_feature_ids, int_flow_steps=10, int_roads_per_reach=2,
+                     int_bridge_every=5, flt_spacing=0.01, flt_lon=-102.0, flt_lat=31.0):
+    """
+    Replace the static tables of db_params['dbname'] with a synthetic
+    district of one reach per feature id.  The lookup tables of
+    roadflood_create_static_tables.sql are built afterwards by the caller.
+    """
+    int_reaches = len(arr_district_feature_ids)
+    int_columns = max(int(int_reaches ** 0.5), 1)
+
+    dict_params = {
+        'lon': flt_lon, 'lat': flt_lat, 'columns': int_columns, 'spacing': flt_spacing,
+        'radius': flt_spacing * 0.12, 'road_half_length': flt_spacing * 0.6,
+        'flow_steps': int_flow_steps, 'roads_per_reach': int_roads_per_reach,
+        'bridge_every': int_bridge_every, 'seed_version': INT_SEED_VERSION, 'reaches': int_reaches}
+
+    connection = fn_get_connection(db_params)
+    try:
+        with connection.cursor() as cursor:
+            for str_table in LIST_SEED_TABLES:
+                cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(str_table)))
+
+            cursor.execute("CREATE TEMP TABLE t_benchmark_feature "
+                           "(reach_id BIGINT, feature_id BIGINT) ON COMMIT DROP")
+            execute_values(cursor, "INSERT INTO t_benchmark_feature (reach_id, feature_id) VALUES %s",
+                           [(i + 1, int(feature_id)) for i, feature_id in enumerate(arr_district_feature_ids)],
+                           page_size=10000)
+
+            cursor.execute(STR_SQL_SEED, dict_params)
+        connection.commit()
+    finally:
+        connection.close()
+
+    print(f"  -- Seeded {int_reaches} reaches x {int_flow_steps} flow steps into {db_params['dbname']}")
+# ----------------------
@@ -0,0 +1,175 @@
+# FAST-realtime update
+# Script - benchmark_synthetic_nwm
+#
+# Synthetic NWM short-range forecasts for the offline benchmark
+# (benchmark_fast.py).  Writes the 18 'channel_rt' NetCDF files of one cycle
+# with the layout of s3://noaa-nwm-pds -- feature_id / time / reference_time
+# coordinates, int32 streamflow scaled by 0.01 -- over a CONUS-sized set of
+# feature ids, plus the Texas feature id list read by step 01.
+#
+# Flows are deterministic functions of the feature id, so the synthetic
+# PostGIS tables (benchmark_seed_postgis.py) can place their flow steps and
+# road triggers relative to the same base flow.
+#
+# Created by: Andy Carter, PE
+# Created - 2025.07.18
+# ************************************************************
+
+# ************************************************************
+import os
+import numpy as np
+import pandas as pd
+import xarray as xr
+# ************************************************************
+
+
+# Real channel_rt files hold ~2.7 million reaches
+INT_CONUS_FEATURE_COUNT = 2776738
+INT_FORECAST_HOURS = 18
+FLT_CMS_TO_CFS = 35.3147
+
+# Hour of the peak of the synthetic flood hydrograph (0..17)
+INT_PEAK_HOUR = 8
+
+# Variables of a real channel_rt file besides streamflow (same encoding)
+LIST_EXTRA_VARIABLES = ['nudge', 'velocity', 'qSfcLatRunoff', 'qBucket', 'qBtmVertRunoff']
+
+
+# ----------------
+def fn_parse_scenarios(str_scenarios):
+    # 'dry:0:0, moderate:0.05:3' -> {'dry': (0.0, 0.0), 'moderate': (0.05, 3.0)}
+    # fraction of reaches flooded : peak flow as a multiple of the base flow
+    dict_scenarios = {}
+    for str_item in str_scenarios.split(','):
+        str_item = str_item.strip()
+        if not str_item:
+            continue
+        str_name, str_fraction, str_peak = [s.strip() for s in str_item.split(':')]
+        dict_scenarios[str_name] = (float(str_fraction), float(str_peak))
+    return dict_scenarios
+# ----------------
+
+
+# ----------------
+def fn_synthetic_feature_ids(int_feature_count, int_seed):
+    # Sorted, unique, with irregular gaps like NHDPlus COMIDs
+    rng = np.random.default_rng(int_seed)
+    return 100 + np.cumsum(rng.integers(1, 800, size=int_feature_count, dtype=np.int64))
+# ----------------
+
+
+# ----------------
+def fn_synthetic_texas_feature_ids(arr_feature_ids, int_texas_count, int_seed):
+    # A fixed random subset, in a fixed random order: district i holds the
+    # first n ids, so a larger district is a superset of a smaller one
+    rng = np.random.default_rng(int_seed + 1)
+    arr_index = rng.choice(len(arr_feature_ids), size=int_texas_count, replace=False)
+    return arr_feature_ids[arr_index]
+# ----------------
+
+
+# ----------------
+def fn_base_flow_cms(arr_feature_ids):
+    # Same expression as BASE_FLOW_CFS_SQL in benchmark_seed_postgis
+    return 1.0 + (arr_feature_ids % 997) / 10.0
+# ----------------
+
+
+# ----------------
+def fn_scenario_flows_cms(arr_feature_ids, flt_flood_fraction, flt_peak_ratio):
+    """
+    Forecast flows (INT_FORECAST_HOURS x features) in m3/s.
+
+    Reaches outside the flood stay at 0.8 x base flow -- below the first
+    flow step of the seeded inundation polygons.  Flooded reaches follow a
+    triangular hydrograph peaking at (0.8 + flt_peak_ratio + 0.2) x base
+    flow at INT_PEAK_HOUR.
+    """
+    arr_base = fn_base_flow_cms(arr_feature_ids)
+    arr_flooded = ((arr_feature_ids * 7919) % 10000) < flt_flood_fraction * 10000
+
+    arr_hours = np.arange(INT_FORECAST_HOURS)
+    arr_shape = np.clip(1.0 - np.abs(arr_hours - INT_PEAK_HOUR) / INT_PEAK_HOUR, 0.0, None)
+
+    arr_flows = np.tile(arr_base * 0.8, (INT_FORECAST_HOURS, 1))
+    arr_flows[:, arr_flooded] += np.outer(arr_shape, arr_base[arr_flooded] * (flt_peak_ratio + 0.2))
+    return arr_flows
+# ----------------
+
+
+# ----------------
+def fn_nwm_key(str_reference_time, int_hour):
+    # Object key of forecast hour int_hour (1..18) in the noaa-nwm-pds layout
+    ts = pd.Timestamp(str_reference_time)
+    return (f"nwm.{ts:%Y%m%d}/short_range/"
+            f"nwm.t{ts:%H}z.short_range.channel_rt.f{int_hour:03d}.conus.nc")
+# ----------------
+
+
+# ----------------
+def fn_write_channel_rt(str_path, arr_feature_ids, arr_flow_cms, str_reference_time, int_hour,
+                        b_extra_variables=True):
+    # One forecast hour, encoded as in the real files
+    ts_reference = pd.Timestamp(str_reference_time)
+
+    dict_encoding = {'feature_id': {'dtype': 'int64'}}
+    dict_data_vars = {}
+
+    list_variables = ['streamflow'] + (LIST_EXTRA_VARIABLES if b_extra_variables else [])
+    for str_variable in list_variables:
+        arr_values = arr_flow_cms if str_variable == 'streamflow' else np.zeros_like(arr_flow_cms)
+        dict_data_vars[str_variable] = ('feature_id', arr_values.astype(np.float64),
+                                        {'units': 'm3 s-1' if str_variable != 'velocity' else 'm s-1'})
+        dict_encoding[str_variable] = {'dtype': 'int32', 'scale_factor': 0.01, '_FillValue': -999900}
+
+    dataset = xr.Dataset(
+        data_vars=dict_data_vars,
+        coords={'feature_id': ('feature_id', arr_feature_ids),
+                'time': ('time', [ts_reference + pd.Timedelta(hours=int_hour)]),
+                'reference_time': ('reference_time', [ts_reference])},
+        attrs={'model_configuration': 'short_range',
+               'model_output_type': 'channel_rt',
+               'model_initialization_time': f"{ts_reference:%Y-%m-%d_%H:%M:%S}",
+               'comment': 'FAST benchmark -- synthetic data'})
+
+    dataset.to_netcdf(str_path, encoding=dict_encoding)
+# ----------------
+
+
+# ----------------------
+def fn_write_synthetic_cycle(str_output_dir, arr_feature_ids, str_reference_time,
+                             flt_flood_fraction, flt_peak_ratio, b_extra_variables=True):
+    """
+    Write the INT_FORECAST_HOURS files of one cycle under str_output_dir,
+    keyed as in the NWM bucket.  Files already present are kept.
+
+    Returns:
+        list of object keys (relative to str_output_dir)
+    """
+    arr_flows = None
+    list_keys = []
+
+    for int_hour in range(1, INT_FORECAST_HOURS + 1):
+        str_key = fn_nwm_key(str_reference_time, int_hour)
+        str_path = os.path.join(str_output_dir, str_key)
+        list_keys.append(str_key)
+        if os.path.exists(str_path):
+            continue
+
+        if arr_flows is None:
+            arr_flows = fn_scenario_flows_cms(arr_feature_ids, flt_flood_fraction, flt_peak_ratio)
+
+        os.makedirs(os.path.dirname(str_path), exist_ok=True)
+        fn_write_channel_rt(str_path + '.tmp', arr_feature_ids, arr_flows[int_hour - 1],
+                            str_reference_time, int_hour, b_extra_variables)
+        os.replace(str_path + '.tmp', str_path)
+
+    return list_keys
+# ----------------------
+
+
+# ----------------------
+def fn_write_texas_feature_id_list(str_path, arr_texas_feature_ids):
+    # Same single-column layout as inputs/texas_feature_ids.csv
+    pd.DataFrame({'feature_id': np.sort(arr_texas_feature_ids)}).to_csv(str_path, index=False)
+# ----------------------
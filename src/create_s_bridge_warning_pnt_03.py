@@ -4,12 +4,16 @@
 #
 # Created by: Andy Carter, PE
 # Created - 2025.05.02
+# Revised - 2025.07.17 -- Per-stage metrics (run_metrics)
+# Revised - 2025.07.19 -- Bridge inputs loadable ahead of the flows (fn_load_bridge_inputs)
+# Revised - 2025.07.21 -- Dynamic tables read through the search_path (backfill cycle schemas)
+# Revised - 2025.07.25 -- GIST index on s_bridge_warning_pnt for the vector tiles
 # ************************************************************
 
 # ************************************************************
 import pandas as pd
 import psycopg2
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 import geopandas as gpd
 import numpy as np
 import ast
@@ -20,6 +24,8 @@ import configparser
 import time
 import datetime
 import warnings
+
+from run_metrics import fn_metric_stage, fn_metric_add
 # ************************************************************
 
 
@@ -57,8 +63,9 @@ def fn_get_dataframe_from_postgresql(str_table_name, dict_db_params):
     )
 
     cur = conn.cursor()
-    query = f"SELECT * FROM public.{str_table_name}"
+    query = f"SELECT * FROM {str_table_name}"
     cur.execute(query)
+    fn_metric_add('db_round_trips', 1)
     rows = cur.fetchall()
     colnames = [desc[0] for desc in cur.description]
     df = pd.DataFrame(rows, columns=colnames)
@@ -82,7 +89,7 @@ def fn_get_geodataframe_from_postgresql(str_table_name,
     )
 
     # Read GeoDataFrame using raw psycopg2 connection
-    gdf = gpd.read_postgis(f"SELECT * FROM public.{str_table_name}", con=conn, geom_col=str_geom_col)
+    gdf = gpd.read_postgis(f"SELECT * FROM {str_table_name}", con=conn, geom_col=str_geom_col)
     
     conn.close()
     return gdf
@@ -137,8 +144,35 @@ def fn_calculate_depth_array(row):
 # -------
 
 
+# -------------
+def fn_load_bridge_inputs(dict_db_params):
+    # Static inputs of the bridge points -- independent of the current flows,
+    # so the caller may load them while steps 01 and 02 run
+    df_rating_curves = fn_get_dataframe_from_postgresql('t_bridge_rating_curve', dict_db_params)
+
+    # Extract unique uuid_bridge values from df_rating_curves
+    uuid_list = df_rating_curves['uuid_bridge'].dropna().unique().tolist()
+    uuid_tuple = tuple(uuid_list)
+
+    # Ensure that the tuple is handled correctly when only one element is present
+    if len(uuid_tuple) == 1:
+        uuid_tuple = (uuid_tuple[0], uuid_tuple[0])
+
+    # Use psycopg2 connection to execute the query
+    with psycopg2.connect(**dict_db_params) as conn:
+        sql_query = f"""
+            SELECT * FROM public.s_bridge_pnt
+            WHERE uuid_bridge IN %s
+        """
+        gdf_flow_points = gpd.read_postgis(sql_query, conn, params=(uuid_tuple,), geom_col='geometry')
+        fn_metric_add('db_round_trips', 1)
+
+    return df_rating_curves, gdf_flow_points
+# -------------
+
+
 # .........................................................
-def fn_create_s_bridge_warning_pnt(str_config_file_path, b_print_output):
+def fn_create_s_bridge_warning_pnt(str_config_file_path, b_print_output, tup_bridge_inputs=None):
     # suppress all warnings
     warnings.filterwarnings("ignore", category=UserWarning)
     warnings.filterwarnings("ignore", category=RuntimeWarning)
@@ -180,24 +214,11 @@ def fn_create_s_bridge_warning_pnt(str_config_file_path, b_print_output):
         
     print('  -- Computing bridge points')
     
-    df_rating_curves = fn_get_dataframe_from_postgresql('t_bridge_rating_curve', dict_db_params)
-    df_max_flow = fn_get_dataframe_from_postgresql('t_flow_per_nextgen', dict_db_params)
-    
-    # Extract unique uuid_bridge values from df_rating_curves
-    uuid_list = df_rating_curves['uuid_bridge'].dropna().unique().tolist()
-    uuid_tuple = tuple(uuid_list)
-    
-    # Ensure that the tuple is handled correctly when only one element is present
-    if len(uuid_tuple) == 1:
-        uuid_tuple = (uuid_tuple[0], uuid_tuple[0])
-    
-    # Use psycopg2 connection to execute the query
-    with psycopg2.connect(**dict_db_params) as conn:
-        sql_query = f"""
-            SELECT * FROM public.s_bridge_pnt
-            WHERE uuid_bridge IN %s
-        """
-        gdf_flow_points = gpd.read_postgis(sql_query, conn, params=(uuid_tuple,), geom_col='geometry')
+    with fn_metric_stage('db_read'):
+        if tup_bridge_inputs is None:
+            tup_bridge_inputs = fn_load_bridge_inputs(dict_db_params)
+        df_rating_curves, gdf_flow_points = tup_bridge_inputs
+        df_max_flow = fn_get_dataframe_from_postgresql('t_flow_per_nextgen', dict_db_params)
         
     df_rating_max_flow = df_rating_curves.merge(
         df_max_flow,
@@ -292,8 +313,28 @@ def fn_create_s_bridge_warning_pnt(str_config_file_path, b_print_output):
     engine = create_engine(connection_string)
     
     # Upload to PostGIS
-    with engine.connect() as conn:
-        gdf_flow_points.to_postgis(table_name, conn, if_exists='replace', index=False)
+    with fn_metric_stage('db_write'):
+        with engine.connect() as conn:
+            gdf_flow_points.to_postgis(table_name, conn, if_exists='replace', index=False)
+
+        # Spatial index for the vector tiles of step 04 (tile envelope joins),
+        # unless the table was created with one
+        with engine.begin() as conn:
+            conn.execute(text(f"""
+                DO $$
+                BEGIN
+                    IF NOT EXISTS (
+                        SELECT 1
+                        FROM pg_index i
+                        JOIN pg_class c ON c.oid = i.indexrelid
+                        JOIN pg_am a ON a.oid = c.relam
+                        WHERE i.indrelid = '{table_name}'::regclass AND a.amname = 'gist'
+                    ) THEN
+                        CREATE INDEX idx_{table_name}_geom ON {table_name} USING GIST (geometry);
+                    END IF;
+                END $$;"""))
+        fn_metric_add('db_round_trips', 1)
+        fn_metric_add('rows_written', len(gdf_flow_points))
         
     print('  -- Bridge points successfully uploaded')
 
@@ -4,22 +4,26 @@
 #
 # Created by: Andy Carter, PE
 # Created - 2025.05.03
+# Revised - 2025.07.17 -- Per-stage metrics (run_metrics)
+# Revised - 2025.07.20 -- Light imports only (boto3, psycopg2); pandas imported on use
+# Revised - 2025.07.20 -- NWM product from [flow_from_nwm] product (nwm_products)
 # ************************************************************
 
 # ************************************************************
+# Kept light: this is the whole no-op run of fast_realtime_update
 import boto3
 import os
 import re
-import pandas as pd
-import s3fs
 import psycopg2
-from sqlalchemy import create_engine
 
 import argparse
 import configparser
 import time
 import datetime
 import warnings
+
+from run_metrics import fn_metric_stage, fn_metric_add
+from nwm_products import fn_get_nwm_product
 # ************************************************************
 
 
@@ -48,12 +52,13 @@ def fn_str_to_bool(value):
 
 
 # ---------------------
-def fn_get_valid_forecast_group(date_prefix, bucket_name, file_pattern):
+def fn_get_valid_forecast_group(date_prefix, bucket_name, file_pattern,
+                                str_folder='short_range/', int_min_files=18):
     
     s3 = boto3.client('s3')
     
-    """Check all forecast hours on a given date, and return the most recent with 18+ files."""
-    short_range_prefix = date_prefix + 'short_range/'
+    """Check all forecast hours on a given date, and return the most recent with int_min_files+ files."""
+    short_range_prefix = date_prefix + str_folder
 
     forecast_groups = {}  # Maps tXXz -> list of matching files
 
@@ -69,7 +74,7 @@ def fn_get_valid_forecast_group(date_prefix, bucket_name, file_pattern):
 
     # Sort by forecast group time, descending (e.g., t23z > t22z > ...)
     for group_key in sorted(forecast_groups.keys(), reverse=True):
-        if len(forecast_groups[group_key]) >= 18:
+        if len(forecast_groups[group_key]) >= int_min_files:
             return forecast_groups[group_key]  # Return the first valid group
 
     return None  # No valid group for this day
@@ -91,8 +96,8 @@ def fn_parse_iso8601_date_from_s3(str_s3_filepath):
 
 
 # ~~~~~~~~~~~~~~~~~~~~~~
-def fn_determine_current_forecast():
-    # get Short-range from AWS nwm
+def fn_determine_current_forecast(dict_product=None):
+    # get the newest complete cycle of dict_product (default short range) from AWS nwm
     s3 = boto3.client('s3')
     
     result = []
@@ -111,11 +116,17 @@ def fn_determine_current_forecast():
     )
 
     # Regex pattern to extract time and forecast hour
-    file_pattern = re.compile(r'nwm\.t(\d{2})z\.short_range\.channel_rt\.f(\d{3})\.conus\.nc')
+    if dict_product is None:
+        file_pattern = re.compile(r'nwm\.t(\d{2})z\.short_range\.channel_rt\.f(\d{3})\.conus\.nc')
+        str_folder, int_min_files = 'short_range/', 18
+    else:
+        file_pattern = dict_product['pattern']
+        str_folder, int_min_files = dict_product['folder'], dict_product['files']
 
     # Walk through dates, find the most recent day with valid forecast group
     for date_prefix in date_prefixes:
-        result = fn_get_valid_forecast_group(date_prefix, bucket_name, file_pattern)
+        result = fn_get_valid_forecast_group(date_prefix, bucket_name, file_pattern,
+                                             str_folder, int_min_files)
         if result:
             #print(f"  -- Found valid forecast group in {date_prefix}:")
             break
@@ -129,6 +140,8 @@ def fn_determine_current_forecast():
 
 # ------------
 def fn_get_dataframe_from_postgresql(str_table_name, dict_db_params):
+    import pandas as pd
+
     conn = psycopg2.connect(
         host=dict_db_params.get("host"),
         user=dict_db_params.get("user"),
@@ -139,6 +152,7 @@ def fn_get_dataframe_from_postgresql(str_table_name, dict_db_params):
     cur = conn.cursor()
     query = f"SELECT * FROM public.{str_table_name}"
     cur.execute(query)
+    fn_metric_add('db_round_trips', 1)
     rows = cur.fetchall()
     colnames = [desc[0] for desc in cur.description]
     df = pd.DataFrame(rows, columns=colnames)
@@ -149,6 +163,27 @@ def fn_get_dataframe_from_postgresql(str_table_name, dict_db_params):
 # ------------
 
 
+# ------------
+def fn_get_current_db_forecast(dict_db_params):
+    # model_run_time of the last update (t_current_forecast), without pandas
+    conn = psycopg2.connect(
+        host=dict_db_params.get("host"),
+        user=dict_db_params.get("user"),
+        password=dict_db_params.get("password"),
+        dbname=dict_db_params.get("dbname")
+    )
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT model_run_time FROM public.t_current_forecast LIMIT 1")
+            fn_metric_add('db_round_trips', 1)
+            row = cur.fetchone()
+    finally:
+        conn.close()
+
+    return row[0] if row else None
+# ------------
+
+
 # .........................................................
 def fn_determine_if_database_current(str_config_file_path, b_print_output):
     # suppress all warnings
@@ -192,14 +227,15 @@ def fn_determine_if_database_current(str_config_file_path, b_print_output):
         raise KeyError("Missing [database] section in config file")
     
     # -- From the s3 bucket,determine the current NWM forecast
-    result = fn_determine_current_forecast()
+    with fn_metric_stage('nwm_discovery'):
+        result = fn_determine_current_forecast(fn_get_nwm_product(config))
     str_iso8601_time = fn_parse_iso8601_date_from_s3(result[0])
     if b_print_output:
         print(f'  --  Current NWM forecast:  {str_iso8601_time}')
     
     # -- From the FAST database, determine the last update time
-    df_current_forecast = fn_get_dataframe_from_postgresql('t_current_forecast', dict_db_params)
-    str_current_db_forecast = df_current_forecast.iloc[0]['model_run_time']
+    with fn_metric_stage('db_check'):
+        str_current_db_forecast = fn_get_current_db_forecast(dict_db_params)
     if b_print_output:
         print(f'  -- Current FAST forecast: {str_current_db_forecast}')
     
@@ -0,0 +1,243 @@
+# FAST-realtime update
+# Script - fast_district_scheduler
+#
+# Run the realtime update (fast_realtime_update) of many districts at once,
+# one process per district.  The heavy part, the step 02 SQL, is limited per
+# database host: a district waits for a slot on its own host only, so
+# districts on different hosts run fully in parallel while a shared host
+# (e.g. database3.roadflood.com) never runs more than max_sql_per_host
+# updates at a time.  Steps 00, 01, 03 and 04 are not limited.
+#
+# Each district keeps its own config (txdot_dist_ini_v2/...), run metrics
+# and advisory lock key (run_sql_udpate_dynamic_tables_02.fn_get_lock_key).
+#
+# Created by: Andy Carter, PE
+# Created - 2025.07.23
+# ************************************************************
+
+# ************************************************************
+import os
+import sys
+import glob
+import multiprocessing
+import concurrent.futures
+
+import argparse
+import configparser
+import time
+import datetime
+import warnings
+# ************************************************************
+
+
+# ^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
+def is_valid_file(parser, arg):
+    if not os.path.exists(arg):
+        parser.error("The file %s does not exist" % arg)
+    else:
+        # File exists so return the directory
+        return arg
+        return open(arg, 'r')  # return an open file handle
+# ^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
+
+
+# ----------------
+def fn_str_to_bool(value):
+    if isinstance(value, bool):
+        return value
+    if value.lower() in {'true', 't', '1'}:
+        return True
+    elif value.lower() in {'false', 'f', '0'}:
+        return False
+    else:
+        raise argparse.ArgumentTypeError(f"Boolean value expected. Got '{value}'.")
+# ----------------
+
+
+# ----------------
+def fn_list_district_configs(str_district_configs):
+    # Config files from a comma / newline separated list of paths and globs
+    list_paths = []
+    for str_item in str_district_configs.replace('\n', ',').split(','):
+        str_item = str_item.strip()
+        if not str_item:
+            continue
+        list_matches = sorted(glob.glob(str_item))
+        if not list_matches:
+            print(f"  !! No district config matches {str_item}")
+        list_paths.extend(str_path for str_path in list_matches if str_path not in list_paths)
+    return list_paths
+# ----------------
+
+
+# ----------------
+def fn_order_by_host(list_districts):
+    # Alternate hosts, so a pool smaller than the district count does not
+    # fill up with districts all waiting on one host
+    dict_by_host = {}
+    for dict_district in list_districts:
+        dict_by_host.setdefault(dict_district['host'], []).append(dict_district)
+
+    list_ordered = []
+    while any(dict_by_host.values()):
+        for list_host in dict_by_host.values():
+            if list_host:
+                list_ordered.append(list_host.pop(0))
+    return list_ordered
+# ----------------
+
+
+# .........................
+def fn_run_district(str_config_path, sql_gate, b_print_output):
+    """
+    fast_realtime_update for one district, in a worker process.  sql_gate
+    is the semaphore of the district's database host; step 02 holds it
+    while its SQL runs.
+
+    Returns:
+        dict: config, status, seconds
+    """
+    warnings.filterwarnings("ignore", category=UserWarning)
+
+    import run_sql_udpate_dynamic_tables_02
+    from fast_realtime_update import fn_fast_realtime_update
+
+    run_sql_udpate_dynamic_tables_02.SQL_GATE = sql_gate
+
+    flt_start = time.time()
+    str_status = 'success'
+    try:
+        fn_fast_realtime_update(str_config_path, b_print_output)
+    except SystemExit as e:
+        # fn_fast_realtime_update exits 1 on a failed or timed-out SQL
+        str_status = 'success' if not e.code else 'error'
+    except Exception as e:
+        print(f"  !! {str_config_path} failed: {e}")
+        str_status = 'error'
+
+    return {'config': str_config_path, 'status': str_status, 'seconds': round(time.time() - flt_start, 1)}
+# .........................
+
+
+# .........................................................
+def fn_fast_district_scheduler(str_config_file_path, b_print_output):
+    # suppress all warnings
+    warnings.filterwarnings("ignore", category=UserWarning)
+
+    print(" ")
+    print("+=================================================================+")
+    print("|               FAST REALTIME UPDATE - ALL DISTRICTS              |")
+    print("|                Created by Andy Carter, PE of                    |")
+    print("|             Center for Water and the Environment                |")
+    print("|                 University of Texas at Austin                   |")
+    print("+-----------------------------------------------------------------+")
+    print("  ---(c) INPUT GLOBAL CONFIGURATION FILE: " + str_config_file_path)
+    print("===================================================================")
+
+    # --- Read variables from config.ini ---
+    config = configparser.ConfigParser()
+    config.read(str_config_file_path)
+
+    if 'scheduler' not in config:
+        raise KeyError("Missing [scheduler] section in config file")
+
+    section = config['scheduler']
+    list_config_paths = fn_list_district_configs(section.get('district_configs', ''))
+    if not list_config_paths:
+        raise ValueError("No district configs found ([scheduler] district_configs)")
+
+    # Concurrent step 02 runs per database host; [scheduler_host_limits] overrides per host
+    int_max_sql_per_host = section.getint('max_sql_per_host', 2)
+    dict_host_limits = {str_host: int(str_limit) for str_host, str_limit in config.items('scheduler_host_limits')} \
+        if 'scheduler_host_limits' in config else {}
+
+    # --- Host of each district ---
+    list_districts = []
+    for str_config_path in list_config_paths:
+        config_district = configparser.ConfigParser()
+        config_district.read(str_config_path)
+        list_districts.append({'config': str_config_path,
+                               'host': config_district.get('database', 'host', fallback='').strip().lower()})
+    list_districts = fn_order_by_host(list_districts)
+
+    int_max_workers = section.getint('max_workers', len(list_districts))
+
+    # --- One semaphore per host, shared with the worker processes ---
+    manager = multiprocessing.Manager()
+    dict_gates = {}
+    for dict_district in list_districts:
+        str_host = dict_district['host']
+        if str_host not in dict_gates:
+            int_limit = dict_host_limits.get(str_host, int_max_sql_per_host)
+            dict_gates[str_host] = manager.BoundedSemaphore(int_limit)
+            int_count = sum(1 for dict_item in list_districts if dict_item['host'] == str_host)
+            print(f"  -- {str_host}: {int_count} districts, {int_limit} SQL updates at a time")
+
+    # --- Districts in parallel, one process each ---
+    print(f"  -- Updating {len(list_districts)} districts on {int_max_workers} workers")
+    list_results = []
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=int_max_workers) as executor:
+            dict_futures = {executor.submit(fn_run_district, dict_district['config'],
+                                            dict_gates[dict_district['host']], b_print_output): dict_district
+                            for dict_district in list_districts}
+            for future in concurrent.futures.as_completed(dict_futures):
+                try:
+                    dict_result = future.result()
+                except Exception as e:
+                    dict_result = {'config': dict_futures[future]['config'], 'status': 'error', 'seconds': None}
+                    print(f"  !! Worker failed: {e}")
+                list_results.append(dict_result)
+                print(f"  -- [{len(list_results)}/{len(list_districts)}] "
+                      f"{os.path.basename(dict_result['config'])} {dict_result['status']} "
+                      f"({dict_result['seconds']} s)")
+    finally:
+        manager.shutdown()
+
+    list_failed = [os.path.basename(dict_result['config'])
+                   for dict_result in list_results if dict_result['status'] != "success"]
+    if list_failed:
+        print(f"  !! {len(list_failed)} districts failed: {', '.join(sorted(list_failed))}")
+
+    return list_results
+# .........................................................
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+if __name__ == '__main__':
+
+    flt_start_run = time.time()
+
+    parser = argparse.ArgumentParser(description='========= FAST REALTIME UPDATE - ALL DISTRICTS =========')
+
+    parser.add_argument('-c',
+                        dest = "str_config_file_path",
+                        help=r'REQUIRED: Scheduler configuration filepath Example:/fast_realtime/src/config_district_scheduler.ini',
+                        required=True,
+                        metavar='FILE',
+                        type=lambda x: is_valid_file(parser, x))
+
+    parser.add_argument('-r',
+                    dest = "b_print_output",
+                    help=r'OPTIONAL: Print output messages Default: False',
+                    required=False,
+                    default=False,
+                    metavar='T/F',
+                    type=fn_str_to_bool)
+
+    args = vars(parser.parse_args())
+
+    str_config_file_path = args['str_config_file_path']
+    b_print_output = args['b_print_output']
+
+    list_results = fn_fast_district_scheduler(str_config_file_path, b_print_output)
+
+    flt_end_run = time.time()
+    flt_time_pass = (flt_end_run - flt_start_run) // 1
+    time_pass = datetime.timedelta(seconds=flt_time_pass)
+
+    print('Compute Time: ' + str(time_pass))
+
+    if any(dict_result['status'] != "success" for dict_result in list_results):
+        sys.exit(1)
+ #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
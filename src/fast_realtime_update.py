@@ -5,6 +5,14 @@
 #
 # Created by: Andy Carter, PE
 # 2025.05.02
+# Revised - 2025.07.17 -- Per-stage run metrics, optional [metrics] section
+# Revised - 2025.07.19 -- Steps run as a dependency graph ([pipeline] scheduler = dag)
+# Revised - 2025.07.20 -- Step modules 01-04 imported only when their step runs;
+#                         'Temp for testing' forced update is now [pipeline] force_update
+# Revised - 2025.07.20 -- NWM product from [flow_from_nwm] product
+# Revised - 2025.07.23 -- Static table build takes the district's advisory lock key;
+#                         many districts at once: fast_district_scheduler
+# Revised - 2025.07.25 -- Step 01 waits for the static table check (a rebuild drops its tables)
 
 # ************************************************************
 import argparse
@@ -13,15 +21,18 @@ import datetime
 import warnings
 import os
 import sys
+import configparser
 
 
 # Import modules
-from determine_if_database_current_00 import fn_determine_if_database_current
-from populate_t_flow_forecast_01 import fn_populate_t_flow_forecast
-from populate_t_flow_forecast_from_NWM_01 import fn_populate_t_flow_forecast_from_NWM
-from run_sql_udpate_dynamic_tables_02 import fn_run_sql_udpate_dynamic_tables
-from create_s_bridge_warning_pnt_03 import fn_create_s_bridge_warning_pnt
-from push_to_s3_04 import fn_push_to_s3
+# Only step 00 (boto3, psycopg2) is imported up front -- steps 01-04 pull in
+# xarray, s3fs, geopandas, shapely and SQLAlchemy, and are imported when
+# their step runs, so a run that finds the database current starts fast
+from determine_if_database_current_00 import (fn_determine_if_database_current, fn_determine_current_forecast,
+                                               fn_parse_iso8601_date_from_s3, fn_get_current_db_forecast)
+from run_metrics import fn_start_run_metrics, fn_metric_stage
+from nwm_products import fn_get_nwm_product
+from pipeline_dag import fn_run_dag, SKIPPED
 # ************************************************************
 
 
@@ -49,6 +60,116 @@ def fn_str_to_bool(value):
 # ----------------
 
 
+# ----------------
+def fn_get_db_params(config):
+    # [database] section, as read by each step
+    section = config['database']
+    dict_db_params = {
+        'host': section.get('host', ''),
+        'dbname': section.get('dbname', ''),
+        'user': section.get('username', ''),
+        'password': section.get('password', '')
+    }
+    if dict_db_params['password'] == 'xxx':
+        dict_db_params['password'] = os.environ.get('DB_PASSWORD', '')
+    return dict_db_params
+# ----------------
+
+
+# ----------------------
+def fn_build_fast_dag(str_config_file_path, b_print_output, b_use_nwm, b_force_update, config):
+    """
+    Steps 00-04 as a dependency graph (see pipeline_dag).  Besides the chain
+    static tables > flows > SQL > bridges > publish, two steps need nothing
+    from the new flows and run alongside: the S3 discovery and the DB check
+    of step 00, and the rating curves and bridge points of step 03.  Step 01
+    waits for the static tables: a rebuild drops t_flow_per_nextgen,
+    t_flow_change and t_reach_flow_threshold, which step 01 reads.  All but
+    step 00 wait for the update decision, so a run that finds the database
+    current imports nothing heavy.
+    """
+    dict_db_params = fn_get_db_params(config)
+
+    str_sql_file_path = config.get('sql', 'sql_file_path', fallback='')
+    str_static_sql_file_path = config.get(
+        'sql', 'static_sql_file_path',
+        fallback=os.path.join(os.path.dirname(str_sql_file_path), 'roadflood_create_static_tables.sql'))
+
+    # ---------
+    def fn_node_nwm_discovery():
+        return {'list_valid_files': fn_determine_current_forecast(fn_get_nwm_product(config))}
+
+    def fn_node_db_check():
+        return {'str_db_forecast': fn_get_current_db_forecast(dict_db_params)}
+
+    def fn_node_needs_update(list_valid_files, str_db_forecast):
+        b_needs_update = fn_parse_iso8601_date_from_s3(list_valid_files[0]) != str_db_forecast
+        print('  -- Update of FAST database required' if b_needs_update else '  -- FAST database is current')
+        return {'b_needs_update': b_needs_update or b_force_update}
+
+    def fn_node_static_tables():
+        from run_sql_udpate_dynamic_tables_02 import (fn_ensure_static_tables, fn_prewarm_tables,
+                                                      fn_get_lock_key, LIST_STATIC_TABLES)
+
+        str_status = fn_ensure_static_tables(dict(dict_db_params, lock_key=fn_get_lock_key(config)),
+                                             str_static_sql_file_path)
+        if str_status == "success":
+            fn_prewarm_tables(dict_db_params, LIST_STATIC_TABLES + ['s_flood_inundation_ar'])
+        return {'str_static_status': str_status}
+
+    def fn_node_bridge_inputs():
+        from create_s_bridge_warning_pnt_03 import fn_load_bridge_inputs
+
+        return {'tup_bridge_inputs': fn_load_bridge_inputs(dict_db_params)}
+
+    def fn_node_flows(list_valid_files, str_static_status):
+        if b_use_nwm:
+            from populate_t_flow_forecast_from_NWM_01 import fn_populate_t_flow_forecast_from_NWM
+            fn_populate_t_flow_forecast_from_NWM(str_config_file_path, b_print_output, list_valid_files)
+        else:
+            from populate_t_flow_forecast_01 import fn_populate_t_flow_forecast
+            fn_populate_t_flow_forecast(str_config_file_path, b_print_output)
+        return {'b_flows_written': True}
+
+    def fn_node_sql(b_flows_written, str_static_status):
+        str_status = str_static_status
+        if str_status == "success":
+            from run_sql_udpate_dynamic_tables_02 import fn_run_sql_udpate_dynamic_tables
+            str_status = fn_run_sql_udpate_dynamic_tables(str_config_file_path, b_print_output)
+        return {'str_sql_status': str_status, 'b_sql_success': str_status == "success"}
+
+    def fn_node_bridges(tup_bridge_inputs):
+        from create_s_bridge_warning_pnt_03 import fn_create_s_bridge_warning_pnt
+        fn_create_s_bridge_warning_pnt(str_config_file_path, b_print_output, tup_bridge_inputs)
+        return {'b_bridges_written': True}
+
+    def fn_node_publish(b_bridges_written):
+        from push_to_s3_04 import fn_push_to_s3
+        fn_push_to_s3(str_config_file_path, b_print_output)
+        return {'b_published': True}
+    # ---------
+
+    return [
+        {'name': 'nwm_discovery', 'fn': fn_node_nwm_discovery, 'inputs': [], 'outputs': ['list_valid_files']},
+        {'name': 'db_check', 'fn': fn_node_db_check, 'inputs': [], 'outputs': ['str_db_forecast']},
+        {'name': 'needs_update', 'fn': fn_node_needs_update,
+         'inputs': ['list_valid_files', 'str_db_forecast'], 'outputs': ['b_needs_update']},
+        {'name': 'static_tables', 'fn': fn_node_static_tables, 'when': 'b_needs_update',
+         'inputs': [], 'outputs': ['str_static_status']},
+        {'name': 'bridge_inputs', 'fn': fn_node_bridge_inputs, 'when': 'b_needs_update',
+         'inputs': [], 'outputs': ['tup_bridge_inputs']},
+        {'name': 'step_01_flows', 'fn': fn_node_flows, 'when': 'b_needs_update',
+         'inputs': ['list_valid_files', 'str_static_status'], 'outputs': ['b_flows_written']},
+        {'name': 'step_02_sql', 'fn': fn_node_sql,
+         'inputs': ['b_flows_written', 'str_static_status'], 'outputs': ['str_sql_status', 'b_sql_success']},
+        {'name': 'step_03_bridges', 'fn': fn_node_bridges, 'when': 'b_sql_success',
+         'inputs': ['tup_bridge_inputs'], 'outputs': ['b_bridges_written']},
+        {'name': 'step_04_publish', 'fn': fn_node_publish,
+         'inputs': ['b_bridges_written'], 'outputs': ['b_published']},
+    ]
+# ----------------------
+
+
 # +++++++++++++++++++++++++++++
 def fn_fast_realtime_update(str_config_file_path, b_print_output): 
 
@@ -70,29 +191,73 @@ def fn_fast_realtime_update(str_config_file_path, b_print_output):
     print("  ---(c) INPUT GLOBAL CONFIGURATION FILE: " + str_config_file_path)
     print("+-----------------------------------------------------------------+")
 
-    try:
-        b_needs_update = fn_determine_if_database_current(str_config_file_path, b_print_output)
-        # ************ Temp for testing
-        b_needs_update = True
-        # ************ Temp for testing
+    # --- Optional run metrics (JSON lines and/or Prometheus textfile) ---
+    config = configparser.ConfigParser()
+    config.read(str_config_file_path)
 
-        if b_needs_update:
-            if b_use_nwm:
-                fn_populate_t_flow_forecast_from_NWM(str_config_file_path, b_print_output)
-            else:
-                fn_populate_t_flow_forecast(str_config_file_path, b_print_output)
+    str_metrics_jsonl_path = config.get('metrics', 'jsonl_path', fallback='')
+    str_metrics_prom_path = config.get('metrics', 'prometheus_textfile_path', fallback='')
+    str_district = config.get('metrics', 'district',
+                              fallback=config.get('database', 'dbname', fallback='unknown'))
 
-            str_status = fn_run_sql_udpate_dynamic_tables(str_config_file_path, b_print_output)
-            
-            if str_status == "success":
-                fn_create_s_bridge_warning_pnt(str_config_file_path, b_print_output)
-                fn_push_to_s3(str_config_file_path, b_print_output)
-            elif str_status == "timeout":
+    run_metrics = fn_start_run_metrics({'district': str_district, 'model_run_time': 'unknown'})
+
+    # 'dag' runs independent steps concurrently; 'sequential' is the original order
+    str_scheduler = config.get('pipeline', 'scheduler', fallback='dag')
+    int_dag_workers = config.getint('pipeline', 'max_workers', fallback=4)
+    # Update even when the database already holds the current NWM cycle
+    b_force_update = config.getboolean('pipeline', 'force_update', fallback=False)
+
+    try:
+        if str_scheduler == 'dag':
+            with fn_metric_stage('run'):
+                list_nodes = fn_build_fast_dag(str_config_file_path, b_print_output, b_use_nwm,
+                                               b_force_update, config)
+                dict_values = fn_run_dag(list_nodes, int_dag_workers)
+
+            # SKIPPED when the database was current
+            str_status = dict_values['str_sql_status']
+            if str_status == "timeout":
                 print(" -- SQL timed out.")
                 sys.exit(1)
-            else:
+            elif str_status != "success" and str_status is not SKIPPED:
                 print(" -- SQL failed or config was invalid.")
                 sys.exit(1)
+
+        else:
+            with fn_metric_stage('run'):
+                with fn_metric_stage('step_00_check'):
+                    b_needs_update = fn_determine_if_database_current(str_config_file_path, b_print_output)
+
+                if b_needs_update or b_force_update:
+                    from run_sql_udpate_dynamic_tables_02 import fn_run_sql_udpate_dynamic_tables
+                    from create_s_bridge_warning_pnt_03 import fn_create_s_bridge_warning_pnt
+                    from push_to_s3_04 import fn_push_to_s3
+
+                    with fn_metric_stage('step_01_flows'):
+                        if b_use_nwm:
+                            from populate_t_flow_forecast_from_NWM_01 import fn_populate_t_flow_forecast_from_NWM
+                            fn_populate_t_flow_forecast_from_NWM(str_config_file_path, b_print_output)
+                        else:
+                            from populate_t_flow_forecast_01 import fn_populate_t_flow_forecast
+                            fn_populate_t_flow_forecast(str_config_file_path, b_print_output)
+
+                    with fn_metric_stage('step_02_sql') as dict_stage:
+                        str_status = fn_run_sql_udpate_dynamic_tables(str_config_file_path, b_print_output)
+                        if dict_stage is not None and str_status != "success":
+                            dict_stage['outcome'] = str_status
+
+                    if str_status == "success":
+                        with fn_metric_stage('step_03_bridges'):
+                            fn_create_s_bridge_warning_pnt(str_config_file_path, b_print_output)
+                        with fn_metric_stage('step_04_publish'):
+                            fn_push_to_s3(str_config_file_path, b_print_output)
+                    elif str_status == "timeout":
+                        print(" -- SQL timed out.")
+                        sys.exit(1)
+                    else:
+                        print(" -- SQL failed or config was invalid.")
+                        sys.exit(1)
         
         print("+-----------------------------------------------------------------+")
 
@@ -100,6 +265,16 @@ def fn_fast_realtime_update(str_config_file_path, b_print_output):
         print("ERROR: Fast realtime update failed.")
         print(f"Reason: {str(e)}")
         raise  # re-raise if you want the traceback to bubble up
+
+    finally:
+        # Written even when a step failed -- a failed run is the one worth seeing
+        try:
+            if str_metrics_jsonl_path:
+                run_metrics.write_jsonl(str_metrics_jsonl_path)
+            if str_metrics_prom_path:
+                run_metrics.write_prometheus(str_metrics_prom_path)
+        except OSError as e:
+            print(f"  !! Could not write run metrics: {e}")
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 if __name__ == '__main__':
     flt_start_run = time.time()
@@ -0,0 +1,78 @@
+# FAST-realtime update
+# Script - nwm_products
+#
+# NWM forecast products that steps 00 and 01 can read from 'noaa-nwm-pds':
+# the folder of each cycle, the channel_rt file names, how many files make a
+# complete cycle and the hours between them.  Chosen with [flow_from_nwm]
+# product (default short_range).  Standard library only -- step 00 imports it.
+#
+# Created by: Andy Carter, PE
+# Created - 2025.07.20
+# Revised - 2025.07.25 -- Medium range members 2-6 are 68 files (8.5 days), not 80
+# ************************************************************
+
+# ************************************************************
+import re
+# ************************************************************
+
+
+# folder        -- prefix under nwm.YYYYMMDD/
+# file_regex    -- group 1 is the cycle hour, group 2 the forecast (or look-back) hour
+# files         -- files of a complete cycle
+# step_hours    -- hours between consecutive files
+# b_reverse     -- file names count back from the cycle (tm02, tm01, tm00)
+DICT_NWM_PRODUCTS = {
+    'short_range': {
+        'folder': 'short_range/',
+        'file_regex': r'nwm\.t(\d{2})z\.short_range\.channel_rt\.f(\d{3})\.conus\.nc',
+        'files': 18, 'step_hours': 1, 'b_reverse': False},
+    'medium_range_blend': {
+        'folder': 'medium_range_blend/',
+        'file_regex': r'nwm\.t(\d{2})z\.medium_range_blend\.channel_rt\.f(\d{3})\.conus\.nc',
+        'files': 80, 'step_hours': 3, 'b_reverse': False},
+    'analysis_assim': {
+        'folder': 'analysis_assim/',
+        'file_regex': r'nwm\.t(\d{2})z\.analysis_assim\.channel_rt\.tm(\d{2})\.conus\.nc',
+        'files': 3, 'step_hours': 1, 'b_reverse': True},
+}
+
+# Medium range ensemble members, 3-hourly: member 1 out to 10 days
+# (f003-f240), members 2-6 out to 8.5 days (f003-f204)
+DICT_MEDIUM_RANGE_MEMBER_FILES = {1: 80, 2: 68, 3: 68, 4: 68, 5: 68, 6: 68}
+
+for _int_member, _int_files in DICT_MEDIUM_RANGE_MEMBER_FILES.items():
+    DICT_NWM_PRODUCTS[f'medium_range_mem{_int_member}'] = {
+        'folder': f'medium_range_mem{_int_member}/',
+        'file_regex': rf'nwm\.t(\d{{2}})z\.medium_range\.channel_rt_{_int_member}\.f(\d{{3}})\.conus\.nc',
+        'files': _int_files, 'step_hours': 3, 'b_reverse': False}
+
+
+# ----------------
+def fn_get_nwm_product(config):
+    """
+    Product named by [flow_from_nwm] product, with optional overrides
+    forecast_files and forecast_step_hours (e.g. a shorter medium range).
+
+    Returns:
+        dict: name, folder, pattern (compiled), files, step_hours, b_reverse
+    """
+    str_product = config.get('flow_from_nwm', 'product', fallback='short_range').strip()
+    if str_product not in DICT_NWM_PRODUCTS:
+        raise ValueError(f"Unknown NWM product '{str_product}' -- one of {sorted(DICT_NWM_PRODUCTS)}")
+
+    dict_product = dict(DICT_NWM_PRODUCTS[str_product], name=str_product)
+    dict_product['files'] = config.getint('flow_from_nwm', 'forecast_files', fallback=dict_product['files'])
+    dict_product['step_hours'] = config.getint('flow_from_nwm', 'forecast_step_hours',
+                                               fallback=dict_product['step_hours'])
+    dict_product['pattern'] = re.compile(dict_product['file_regex'])
+    return dict_product
+# ----------------
+
+
+# ----------------
+def fn_sort_product_files(list_files, dict_product):
+    # Files of one cycle in valid-time order
+    return sorted(list_files,
+                  key=lambda str_key: int(dict_product['pattern'].search(str_key).group(2)),
+                  reverse=dict_product['b_reverse'])
+# ----------------
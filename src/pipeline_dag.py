@@ -0,0 +1,166 @@
+# FAST-realtime update
+# Script - pipeline_dag
+#
+# Minimal dependency-graph scheduler for the orchestrator.  Each node names
+# the values it needs (inputs) and the values it produces (outputs); a node
+# starts as soon as all of its inputs exist, so independent work runs
+# concurrently and the run takes as long as its critical path.
+#
+# Node:  {'name': str,
+#         'fn': callable(**inputs) -> dict of outputs,
+#         'inputs': [value names],
+#         'outputs': [value names],
+#         'when': value name (optional) -- node runs only if that value is truthy}
+#
+# A node that does not run (false 'when', or an input from a node that did
+# not run) produces SKIPPED for each of its outputs.
+#
+# Created by: Andy Carter, PE
+# Created - 2025.07.19
+# ************************************************************
+
+# ************************************************************
+import time
+import concurrent.futures
+
+from run_metrics import fn_metric_stage, fn_metric_bind
+# ************************************************************
+
+
+# Value of the outputs of a node that did not run
+SKIPPED = object()
+
+
+# ----------------
+def fn_validate_dag(list_nodes, dict_values):
+    # Every input is produced by exactly one node (or given up front) and
+    # the graph has no cycle
+    dict_producer = {str_value: None for str_value in dict_values}
+    for dict_node in list_nodes:
+        for str_value in dict_node['outputs']:
+            if str_value in dict_producer:
+                raise ValueError(f"DAG value '{str_value}' is produced twice")
+            dict_producer[str_value] = dict_node['name']
+
+    for dict_node in list_nodes:
+        for str_value in dict_node['inputs'] + ([dict_node['when']] if dict_node.get('when') else []):
+            if str_value not in dict_producer:
+                raise ValueError(f"DAG node '{dict_node['name']}' needs '{str_value}', which nothing produces")
+
+    set_available = set(dict_values)
+    list_pending = list(list_nodes)
+    while list_pending:
+        list_ready = [dict_node for dict_node in list_pending
+                      if set(dict_node['inputs']) <= set_available
+                      and (not dict_node.get('when') or dict_node['when'] in set_available)]
+        if not list_ready:
+            raise ValueError(f"DAG has a cycle through {[dict_node['name'] for dict_node in list_pending]}")
+        for dict_node in list_ready:
+            set_available.update(dict_node['outputs'])
+            list_pending.remove(dict_node)
+
+    return dict_producer
+# ----------------
+
+
+# ----------------
+def fn_critical_path(list_nodes, dict_producer, dict_timing):
+    # Walk back from the node that finished last through the input that
+    # became available last
+    dict_by_name = {dict_node['name']: dict_node for dict_node in list_nodes}
+    list_path = []
+    str_name = max(dict_timing, key=lambda str_key: dict_timing[str_key][1]) if dict_timing else None
+    while str_name is not None:
+        list_path.insert(0, str_name)
+        dict_node = dict_by_name[str_name]
+        list_upstream = [dict_producer[str_value]
+                         for str_value in dict_node['inputs'] + ([dict_node['when']] if dict_node.get('when') else [])
+                         if dict_producer.get(str_value) in dict_timing]
+        str_name = max(list_upstream, key=lambda str_key: dict_timing[str_key][1]) if list_upstream else None
+    return list_path
+# ----------------
+
+
+# ----------------------
+def fn_run_dag(list_nodes, int_max_workers=4, dict_values=None):
+    """
+    Run list_nodes on a thread pool (the nodes wait on PostgreSQL and S3 and
+    share DataFrames).  The first failing node cancels the nodes not yet
+    started and its exception is raised once the running ones finish.
+
+    Returns:
+        dict of every value produced (SKIPPED for nodes that did not run)
+    """
+    dict_values = dict(dict_values or {})
+    dict_producer = fn_validate_dag(list_nodes, dict_values)
+
+    flt_start_dag = time.time()
+    dict_timing = {}  # name -> (start, end) seconds from the start of the DAG
+    list_pending = list(list_nodes)
+    dict_running = {}
+    exc_first = None
+
+    # ---------
+    def fn_run_node(dict_node, dict_inputs):
+        # A metrics stage per node; stages opened inside the node nest under it
+        flt_start = time.time()
+        try:
+            with fn_metric_stage(dict_node['name']):
+                dict_outputs = dict_node['fn'](**dict_inputs) or {}
+        finally:
+            dict_timing[dict_node['name']] = (flt_start - flt_start_dag, time.time() - flt_start_dag)
+        missing = set(dict_node['outputs']) - set(dict_outputs)
+        if missing:
+            raise ValueError(f"DAG node '{dict_node['name']}' did not return {sorted(missing)}")
+        return dict_outputs
+    # ---------
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=int_max_workers) as executor:
+        while list_pending or dict_running:
+            # --- Start (or skip) every node whose inputs exist ---
+            b_progress = True
+            while b_progress and exc_first is None:
+                b_progress = False
+                for dict_node in list(list_pending):
+                    list_needed = dict_node['inputs'] + ([dict_node['when']] if dict_node.get('when') else [])
+                    if not all(str_value in dict_values for str_value in list_needed):
+                        continue
+                    list_pending.remove(dict_node)
+                    b_progress = True
+
+                    b_skip = any(dict_values[str_value] is SKIPPED for str_value in list_needed)
+                    if dict_node.get('when') and not b_skip:
+                        b_skip = not dict_values[dict_node['when']]
+                    if b_skip:
+                        dict_values.update({str_value: SKIPPED for str_value in dict_node['outputs']})
+                        continue
+
+                    dict_inputs = {str_value: dict_values[str_value] for str_value in dict_node['inputs']}
+                    dict_running[executor.submit(fn_metric_bind(fn_run_node), dict_node, dict_inputs)] = dict_node
+
+            if not dict_running:
+                break
+
+            # --- Collect whatever finished ---
+            set_done, _ = concurrent.futures.wait(dict_running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in set_done:
+                dict_node = dict_running.pop(future)
+                try:
+                    dict_values.update(future.result())
+                except BaseException as e:
+                    if exc_first is None:
+                        exc_first = e
+                        print(f"  !! {dict_node['name']} failed: {e}")
+
+            if exc_first is not None:
+                list_pending = []
+
+    if exc_first is not None:
+        raise exc_first
+
+    list_path = fn_critical_path(list_nodes, dict_producer, dict_timing)
+    print(f"  -- DAG {time.time() - flt_start_dag:.1f} s, critical path: " +
+          " > ".join(f"{str_name} ({dict_timing[str_name][1] - dict_timing[str_name][0]:.1f} s)"
+                     for str_name in list_path))
+    return dict_values
+# ----------------------
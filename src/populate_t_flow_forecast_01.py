@@ -10,6 +10,7 @@
 #
 # Created by: Andy Carter, PE
 # Created - 2025.05.01
+# Revised - 2025.07.20 -- t_flow_forecast as flow_array + step_hours, written with COPY
 # ************************************************************
 
 # ************************************************************
@@ -18,7 +19,8 @@ import xarray as xr
 import pandas as pd
 import requests
 from tqdm import tqdm
-from sqlalchemy import create_engine
+
+from populate_t_flow_forecast_from_NWM_01 import fn_copy_flow_forecast_to_postgresql
 
 import argparse
 import configparser
@@ -127,25 +129,21 @@ def fn_populate_t_flow_forecast(str_config_file_path, b_print_output):
             print('  -- Converting netCDF')
     
             flow = (ds['streamflow'] * 35.3147).round().astype(int)
-            time_labels = [f'flow_t{str(i).zfill(2)}' for i in range(flow.sizes['time'])]
-    
-            df = flow.to_dataframe().reset_index()
-            df_pivot = df.pivot(index='feature_id', columns='time', values='streamflow')
-            df_pivot.columns = time_labels
-            df_pivot['model_run_time'] = pd.to_datetime(ds['reference_time'].values[0])
-            df_final = df_pivot.reset_index()
-    
-            cols = ['feature_id', 'model_run_time'] + time_labels
-            df_final = df_final[cols]
+
+            # One row per reach, hours in order (KISTERS forecasts are hourly)
+            arr_feature_ids = flow['feature_id'].values
+            arr_flow_cfs = flow.transpose('feature_id', 'time').values
+            str_model_run_time = pd.to_datetime(ds['reference_time'].values[0]).isoformat()
     except Exception as e:
         print(f"Failed to process NetCDF: {e}")
         raise
         
     print('  -- Updating PostgreSQL')
     try:
-        connection_string = f'postgresql://{username}:{password}@{host}:{port}/{dbname}'
-        engine = create_engine(connection_string)
-        df_final.to_sql('t_flow_forecast', engine, if_exists='replace', index=False)
+        dict_db_params = {'host': host, 'user': username, 'password': password,
+                          'dbname': dbname, 'port': port}
+        fn_copy_flow_forecast_to_postgresql(dict_db_params, arr_feature_ids, str_model_run_time,
+                                            arr_flow_cfs, 1)
         print("  -- Data successfully pushed to PostgreSQL")
     except Exception as e:
         print(f" *** Database write failed: {e}")
@@ -9,23 +9,34 @@
 #
 # Created by: Andy Carter, PE
 # Created - 2025.05.03
+# Revised - 2025.07.17 -- Per-stage metrics (run_metrics)
+# Revised - 2025.07.19 -- Optional list_valid_files from the caller (skips discovery)
+# Revised - 2025.07.20 -- Any NWM product/horizon ([flow_from_nwm] product); Texas rows
+#                         picked per file, t_flow_forecast written as flow_array with COPY
+# Revised - 2025.07.21 -- NWM files may come from a local archive folder (backfill)
+# Revised - 2025.07.22 -- Threshold-crossing check against the previous cycle (t_flow_change)
 # ************************************************************
 
 # ************************************************************
 import boto3
 import os
 import re
+import io
+import numpy as np
 import pandas as pd
 import xarray as xr
 import s3fs
 import concurrent.futures
-from sqlalchemy import create_engine
+import psycopg2
 
 import argparse
 import configparser
 import time
 import datetime
 import warnings
+
+from run_metrics import fn_metric_stage, fn_metric_add, fn_metric_set_label
+from nwm_products import fn_get_nwm_product, fn_sort_product_files
 # ************************************************************
 
 
@@ -71,78 +82,219 @@ def fn_feature_id_list_from_file(str_s3_filepath):
 
 
 # >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
-def fn_open_and_process_dataset_from_s3(file):
-    # Open a NetCDF file from S3 using s3fs with proper file closing
-    s3 = s3fs.S3FileSystem(anon=True)  # Use anon=True for anonymous access
-
-    # Use 'with' to ensure the dataset is properly closed after processing
-    with xr.open_dataset(file) as dataset:
-        # Keep only specified variables
-        variables_to_keep = ['streamflow', 'reference_time']
-        dataset = dataset.drop_vars(set(dataset.variables) - set(variables_to_keep))
-
-        # Optional: you can load data if needed
-        dataset.load()  # Ensures data is read before exiting 'with' block
-
-    # Return dataset after closing
-    return dataset
+def fn_read_texas_streamflow(file_object, arr_texas_ids, dict_index_cache):
+    # Streamflow (m3/s) of the Texas reaches from one CONUS channel_rt file;
+    # NaN where a Texas reach is missing.  Only feature_id and streamflow
+    # are read, and the Texas rows are picked before anything is stacked.
+    with xr.open_dataset(file_object) as dataset:
+        arr_feature_ids = dataset['feature_id'].values
+
+        # Position of each Texas id in this file -- the same for every file
+        # of a cycle, so computed once and checked cheaply afterwards
+        tup_signature = (len(arr_feature_ids), int(arr_feature_ids[0]), int(arr_feature_ids[-1]),
+                         int(arr_feature_ids[len(arr_feature_ids) // 2]))
+        arr_index = dict_index_cache.get(tup_signature)
+        if arr_index is None:
+            arr_index = pd.Index(arr_feature_ids).get_indexer(arr_texas_ids)
+            dict_index_cache[tup_signature] = arr_index
+
+        arr_streamflow = dataset['streamflow'].values
+        arr_texas_flow = np.where(arr_index >= 0, arr_streamflow[arr_index], np.nan)
+        utc_reference_time = dataset['reference_time'].values[0]
+
+    return arr_texas_flow, utc_reference_time
 # >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
 
 
 # .........................
-def fn_streamflow_from_list_valid_files(list_valid_files, str_bucket):
-    #try:
+def fn_streamflow_from_list_valid_files(list_valid_files, str_bucket, arr_texas_ids):
+    """
+    Texas flows of one cycle, one row per reach, one column per file of
+    list_valid_files (already in valid-time order).  str_bucket is the NWM
+    bucket, or a local folder with the same nwm.YYYYMMDD/... layout.
+
+    Returns:
+        arr_flow_cfs (n_texas x n_files, int32) -- cfs truncated to integers, 0 where missing
+        utc_forecast_time (numpy datetime64)
+    """
     num_threads = 10
-    print('  -- Accessing forecast data... (~10 sec)')
+    print(f'  -- Accessing forecast data... ({len(list_valid_files)} files)')
 
-    fs = s3fs.S3FileSystem(anon=True)
-
-    # Construct full S3 paths (adjust based on valid date)
-    s3_paths = [f'{str_bucket}/{path}' for path in list_valid_files]
+    if os.path.isdir(str_bucket):
+        # Local archive (historical backfill)
+        list_of_file_objects = [open(os.path.join(str_bucket, path), 'rb') for path in list_valid_files]
+        int_bytes = sum(os.path.getsize(os.path.join(str_bucket, path)) for path in list_valid_files)
+    else:
+        fs = s3fs.S3FileSystem(anon=True)
 
-    # Open files with multithreading
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+        # Construct full S3 paths (adjust based on valid date)
+        s3_paths = [f'{str_bucket}/{path}' for path in list_valid_files]
         list_of_file_objects = [fs.open(f's3://{s3_path}', 'rb') for s3_path in s3_paths]
-        list_datasets = list(executor.map(fn_open_and_process_dataset_from_s3, list_of_file_objects))
-
-    feature_id_list = fn_feature_id_list_from_file(list_of_file_objects[0])
+        int_bytes = sum(file_object.size for file_object in list_of_file_objects)
 
-    print('  -- Aggregating forecast data... (~3 sec)')
-    ds = xr.concat(list_datasets, dim='time')
-
-    for dataset in list_datasets:
-        if dataset is not None:
-            dataset.close()
+    dict_index_cache = {}
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+            list_results = list(executor.map(
+                lambda file_object: fn_read_texas_streamflow(file_object, arr_texas_ids, dict_index_cache),
+                list_of_file_objects))
+        fn_metric_add('s3_bytes_fetched', int_bytes)
+    finally:
+        for file_object in list_of_file_objects:
+            file_object.close()
+
+    # n_texas x n_files, converted to cfs as the flow_tXX columns were
+    arr_flow_cms = np.column_stack([arr_texas_flow for arr_texas_flow, _ in list_results])
+    arr_flow_cfs = np.nan_to_num(arr_flow_cms * 35.3147, nan=0.0).astype(np.int32)
+
+    return arr_flow_cfs, list_results[0][1]
+# .........................
 
-    for file_object in list_of_file_objects:
-        file_object.close()
 
-    utc_forecast_time = ds['reference_time'].values
-    ds_flow = ds[['streamflow']]  # Keep only streamflow
-    ds.close()
+# ~~~~~~~~~~~~~~~~~~~~
+def fn_detect_threshold_crossing(dict_db_params, arr_feature_ids, arr_flow_cfs):
+    """
+    Number of reaches whose new peak flow sits on the other side of any of
+    their thresholds (t_reach_flow_threshold: polygon flow steps, road
+    triggers, bridge rating-curve minimums) than the peak the published
+    layers were built from (t_flow_per_nextgen).  Both '>=' (flow steps) and
+    '>' (road triggers) are compared, so a peak landing exactly on a
+    threshold counts as a change.
+
+    Returns:
+        int, or None when there is no previous cycle to compare with
+    """
+    conn = psycopg2.connect(
+        host=dict_db_params.get("host"),
+        user=dict_db_params.get("user"),
+        password=dict_db_params.get("password"),
+        dbname=dict_db_params.get("dbname"),
+        port=dict_db_params.get("port") or "5432"
+    )
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('t_reach_flow_threshold'), to_regclass('t_flow_per_nextgen'), "
+                        "to_regclass('t_current_forecast')")
+            if None in cur.fetchone():
+                return None
+
+            # The tables may be column-less placeholders (a backfill cycle schema)
+            cur.execute("SELECT "
+                        "(SELECT count(*) FROM pg_attribute WHERE attrelid = to_regclass('t_flow_per_nextgen') "
+                        " AND attname IN ('feature_id', 'max_flow', 'model_run_time') AND NOT attisdropped), "
+                        "(SELECT count(*) FROM pg_attribute WHERE attrelid = to_regclass('t_current_forecast') "
+                        " AND attname = 'model_run_time' AND NOT attisdropped)")
+            if cur.fetchone() != (3, 1):
+                return None
+
+            # t_flow_per_nextgen is written early in step 02; t_current_forecast
+            # only once the whole update succeeded.  Empty tables: no previous cycle.
+            cur.execute("SELECT (SELECT model_run_time FROM t_flow_per_nextgen LIMIT 1), "
+                        "(SELECT model_run_time FROM t_current_forecast LIMIT 1)")
+            str_previous, str_current = cur.fetchone()
+            if str_previous is None or str_previous != str_current:
+                return None
+
+            cur.execute("SELECT feature_id, thresholds FROM t_reach_flow_threshold")
+            list_thresholds = cur.fetchall()
+            cur.execute("SELECT feature_id, MAX(max_flow) FROM t_flow_per_nextgen GROUP BY feature_id")
+            list_previous = cur.fetchall()
+            fn_metric_add('db_round_trips', 5)
+    finally:
+        conn.close()
+
+    if not list_thresholds:
+        return 0
+
+    # One entry per (reach, threshold)
+    arr_reach_ids = np.array([row[0] for row in list_thresholds], dtype=np.int64)
+    arr_counts = np.array([len(row[1]) for row in list_thresholds], dtype=np.int64)
+    arr_threshold = np.fromiter((flt for row in list_thresholds for flt in row[1]), dtype=np.float64,
+                                count=int(arr_counts.sum()))
+    arr_threshold_reach = np.repeat(np.arange(len(arr_reach_ids)), arr_counts)
+
+    # Peaks per reach -- 0 where a reach has no forecast / no previous row
+    arr_index = pd.Index(arr_feature_ids).get_indexer(arr_reach_ids)
+    arr_new_max = np.where(arr_index >= 0, arr_flow_cfs.max(axis=1)[arr_index], 0).astype(np.float64)
+
+    if list_previous:
+        arr_prev_ids = np.array([row[0] for row in list_previous], dtype=np.int64)
+        arr_prev_flow = np.array([row[1] if row[1] is not None else 0 for row in list_previous], dtype=np.float64)
+        arr_index = pd.Index(arr_prev_ids).get_indexer(arr_reach_ids)
+        arr_prev_max = np.where(arr_index >= 0, arr_prev_flow[arr_index], 0.0)
+    else:
+        arr_prev_max = np.zeros(len(arr_reach_ids))
 
-    numpy_array = ds_flow['streamflow'].values
-    ds_flow.close()
+    arr_new = arr_new_max[arr_threshold_reach]
+    arr_prev = arr_prev_max[arr_threshold_reach]
+    arr_crossed = (((arr_new >= arr_threshold) != (arr_prev >= arr_threshold)) |
+                   ((arr_new > arr_threshold) != (arr_prev > arr_threshold)))
 
-    df = pd.DataFrame(numpy_array, columns=feature_id_list)
-    df_flow_cfs = df * 35.3147  # Convert to cfs
-    del df
+    return int(len(np.unique(arr_threshold_reach[arr_crossed])))
+# ~~~~~~~~~~~~~~~~~~~~
 
-    return df_flow_cfs, utc_forecast_time
 
-    #except Exception as e:
-    #    print(f"An error occurred: {e}")
-    #    return None, None  # Safeguard for unpacking
-# .........................
+# ~~~~~~~~~~~~~~~~~~~~
+def fn_copy_flow_forecast_to_postgresql(dict_db_params, arr_feature_ids, str_model_run_time,
+                                        arr_flow_cfs, int_step_hours, int_reaches_changed=None):
+    """
+    Replace t_flow_forecast with one row per reach:
+        feature_id, model_run_time, flow_array (integer[], valid-time order), step_hours
+    streamed with COPY in a single transaction.
+
+    t_flow_change is replaced in the same transaction: the number of reaches
+    whose peak crossed a threshold (fn_detect_threshold_crossing), or no
+    table at all when that is unknown -- step 02 then runs the full update.
+    """
+    buffer = io.StringIO()
+    for int_feature_id, arr_row in zip(arr_feature_ids, arr_flow_cfs):
+        buffer.write(f"{int(int_feature_id)}\t{str_model_run_time}\t"
+                     f"{{{','.join(map(str, arr_row.tolist()))}}}\t{int_step_hours}\n")
+    buffer.seek(0)
+
+    conn = psycopg2.connect(
+        host=dict_db_params.get("host"),
+        user=dict_db_params.get("user"),
+        password=dict_db_params.get("password"),
+        dbname=dict_db_params.get("dbname"),
+        port=dict_db_params.get("port") or "5432"
+    )
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                DROP TABLE IF EXISTS t_flow_forecast;
+                CREATE TABLE t_flow_forecast (
+                    feature_id BIGINT,
+                    model_run_time TEXT,
+                    flow_array INTEGER[],
+                    step_hours INTEGER
+                );""")
+            cur.copy_expert("COPY t_flow_forecast (feature_id, model_run_time, flow_array, step_hours) "
+                            "FROM STDIN", buffer)
+            cur.execute("CREATE INDEX idx_t_flow_forecast_feature_id ON t_flow_forecast (feature_id)")
+
+            cur.execute("DROP TABLE IF EXISTS t_flow_change")
+            if int_reaches_changed is not None:
+                cur.execute("CREATE TABLE t_flow_change AS "
+                            "SELECT %s::text AS model_run_time, %s::integer AS reaches_changed",
+                            (str_model_run_time, int_reaches_changed))
+        conn.commit()
+        fn_metric_add('db_round_trips', 5)
+    finally:
+        conn.close()
+
+    return len(arr_feature_ids)
+# ~~~~~~~~~~~~~~~~~~~~
 
 
 # ---------------------
-def fn_get_valid_forecast_group(date_prefix, bucket_name, file_pattern):
+def fn_get_valid_forecast_group(date_prefix, bucket_name, file_pattern,
+                                str_folder='short_range/', int_min_files=18):
     
     s3 = boto3.client('s3')
     
-    """Check all forecast hours on a given date, and return the most recent with 18+ files."""
-    short_range_prefix = date_prefix + 'short_range/'
+    """Check all forecast hours on a given date, and return the most recent with int_min_files+ files."""
+    short_range_prefix = date_prefix + str_folder
 
     forecast_groups = {}  # Maps tXXz -> list of matching files
 
@@ -158,55 +310,16 @@ def fn_get_valid_forecast_group(date_prefix, bucket_name, file_pattern):
 
     # Sort by forecast group time, descending (e.g., t23z > t22z > ...)
     for group_key in sorted(forecast_groups.keys(), reverse=True):
-        if len(forecast_groups[group_key]) >= 18:
+        if len(forecast_groups[group_key]) >= int_min_files:
             return forecast_groups[group_key]  # Return the first valid group
 
     return None  # No valid group for this day
 # ---------------------
 
 
-# ~~~~~~~~~~~~~~~~~~~~
-def fn_format_flow_table(df, utc_time, str_texas_fature_id_filepath):
-    
-    # df is the short range forecast for the entire CONUS-18 hours
-    # filter it down to Texas and format for 'FAST' databse table 't_flow_forecast'
-    
-    df_feature_ids = pd.read_csv(str_texas_fature_id_filepath)
-    
-    # Get the column names from the CSV (assuming they are listed in one column)
-    columns_to_keep = df_feature_ids.iloc[:, 0].tolist()
-    
-    # Filter the original DataFrame
-    df_filtered = df[columns_to_keep]
-    
-    del df
-    
-    df_filtered = df_filtered.fillna(0).astype(int)
-    
-    # Transpose the DataFrame
-    df_transposed = df_filtered.transpose()
-    
-    del df_filtered
-    
-    # Rename the columns (flow_t00, flow_t01, ...)
-    df_transposed.columns = [f'flow_t{str(i).zfill(2)}' for i in range(df_transposed.shape[1])]
-    
-    df_transposed = df_transposed.reset_index(names='feature_id')
-    
-    iso_time_str_clean = pd.to_datetime(utc_time[0]).isoformat()
-    df_transposed['model_run_time'] = iso_time_str_clean
-    
-    # Move 'model_run_time' to the second column
-    cols = df_transposed.columns.tolist()
-    cols.insert(1, cols.pop(cols.index('model_run_time')))
-    df_transposed = df_transposed[cols]
-    
-    return(df_transposed)
-# ~~~~~~~~~~~~~~~~~~~~
-
-
 # .........................................................
-def fn_populate_t_flow_forecast_from_NWM(str_config_file_path, b_print_output):
+def fn_populate_t_flow_forecast_from_NWM(str_config_file_path, b_print_output, list_valid_files=None,
+                                         str_nwm_source=None):
     # suppress all warnings
     warnings.filterwarnings("ignore", category=UserWarning)
 
@@ -249,48 +362,86 @@ def fn_populate_t_flow_forecast_from_NWM(str_config_file_path, b_print_output):
         str_texas_fature_id_filepath = section.get('texas_faeture_id_list', '')
     else:
         raise KeyError("Missing [flow_from_nwm] section in config file")
+
+    dict_product = fn_get_nwm_product(config)
+
+    # Compare the new peaks with the previous cycle's thresholds (step 02 may skip the heavy SQL)
+    b_skip_unchanged_cycles = config.getboolean('sql', 'skip_unchanged_cycles', fallback=False)
+    if b_print_output:
+        print(f"  -- NWM product: {dict_product['name']} "
+              f"({dict_product['files']} x {dict_product['step_hours']} hr)")
         
-    # -------- get Short-range from AWS nwm
-    s3 = boto3.client('s3')
-    
+    # -------- get the forecast product from AWS nwm
     # ********* HARD CODED BUCKET **********
     bucket_name = 'noaa-nwm-pds'
     # ********* HARD CODED BUCKET **********
+
+    if str_nwm_source:
+        # Another bucket or a local archive folder, with list_valid_files (backfill)
+        bucket_name = str_nwm_source
+
+    if list_valid_files is not None:
+        # Already discovered by the caller (fast_realtime_update DAG)
+        result = list_valid_files
+    else:
+        s3 = boto3.client('s3')
+
+        base_prefix = ''  # Root of the bucket
+
+        # Get the list of date folders (e.g., 'nwm.20250502/')
+        response = s3.list_objects_v2(Bucket=bucket_name, Delimiter='/')
+        date_prefixes = sorted(
+            [p['Prefix'] for p in response.get('CommonPrefixes', []) if re.match(r'nwm\.\d{8}/', p['Prefix'])],
+            reverse=True
+        )
+
+        # Regex pattern to extract time and forecast hour
+        file_pattern = dict_product['pattern']
+
+        # Walk through dates, find the most recent day with valid forecast group
+        with fn_metric_stage('nwm_discovery'):
+            for date_prefix in date_prefixes:
+                result = fn_get_valid_forecast_group(date_prefix, bucket_name, file_pattern,
+                                                     dict_product['folder'], dict_product['files'])
+                if result:
+                    print(f"  -- Found valid forecast group in {date_prefix}:")
+                    for key in result:
+                        #print(f"  - {key}")
+                        pass
+                    break
+                else:
+                    print(f"  -- No valid forecast group found in {date_prefix}")
+
+    # 'result' is the list of most current complete s3 files in bucket,
+    # in valid-time order (a longer listing keeps its first 'files' entries)
+    result = fn_sort_product_files(result, dict_product)[:dict_product['files']]
+
+    arr_texas_ids = pd.read_csv(str_texas_fature_id_filepath).iloc[:, 0].to_numpy(dtype=np.int64)
+
+    with fn_metric_stage('fetch'):
+        arr_flow_cfs, utc_time = fn_streamflow_from_list_valid_files(result, bucket_name, arr_texas_ids)
+
+    str_model_run_time = pd.to_datetime(utc_time).isoformat()
+    fn_metric_set_label('model_run_time', str_model_run_time)
     
-    base_prefix = ''  # Root of the bucket
-    
-    # Get the list of date folders (e.g., 'nwm.20250502/')
-    response = s3.list_objects_v2(Bucket=bucket_name, Delimiter='/')
-    date_prefixes = sorted(
-        [p['Prefix'] for p in response.get('CommonPrefixes', []) if re.match(r'nwm\.\d{8}/', p['Prefix'])],
-        reverse=True
-    )
-    
-    # Regex pattern to extract time and forecast hour
-    file_pattern = re.compile(r'nwm\.t(\d{2})z\.short_range\.channel_rt\.f(\d{3})\.conus\.nc')
-    
-    # Walk through dates, find the most recent day with valid forecast group
-    for date_prefix in date_prefixes:
-        result = fn_get_valid_forecast_group(date_prefix, bucket_name, file_pattern)
-        if result:
-            print(f"  -- Found valid forecast group in {date_prefix}:")
-            for key in result:
-                #print(f"  - {key}")
-                pass
-            break
-        else:
-            print(f"  -- No valid forecast group found in {date_prefix}")
-            
-    # 'result' is the list of most current complete s3 files in bucket
-    df, utc_time = fn_streamflow_from_list_valid_files(result, bucket_name)
-    
-    df_flow_forecast = fn_format_flow_table(df, utc_time, str_texas_fature_id_filepath)
-    
-    print('  -- Updating PostgreSQL... (~25 sec)')
+    print('  -- Updating PostgreSQL...')
     try:
-        connection_string = f'postgresql://{username}:{password}@{host}:{port}/{dbname}'
-        engine = create_engine(connection_string)
-        df_flow_forecast.to_sql('t_flow_forecast', engine, if_exists='replace', index=False)
+        with fn_metric_stage('db_write'):
+            dict_db_params = {'host': host, 'user': username, 'password': password,
+                              'dbname': dbname, 'port': port}
+
+            int_reaches_changed = None
+            if b_skip_unchanged_cycles:
+                with fn_metric_stage('threshold_check'):
+                    int_reaches_changed = fn_detect_threshold_crossing(dict_db_params, arr_texas_ids, arr_flow_cfs)
+                if int_reaches_changed is not None:
+                    fn_metric_add('reaches_crossing_threshold', int_reaches_changed)
+                    print(f"  -- {int_reaches_changed} reaches crossed a flood threshold")
+
+            int_rows = fn_copy_flow_forecast_to_postgresql(dict_db_params, arr_texas_ids, str_model_run_time,
+                                                           arr_flow_cfs, dict_product['step_hours'],
+                                                           int_reaches_changed)
+            fn_metric_add('rows_written', int_rows)
         print("  -- Data successfully pushed to PostgreSQL")
     except Exception as e:
         print(f" *** Database write failed: {e}")
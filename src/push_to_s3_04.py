@@ -6,6 +6,23 @@
 # Created - 2025.05.03
 # Revised - 2025.06.06 -- Subfolder allowed on S3 -- publish_sub_folder
 # Revised - 2025.06.13 -- Revised to Esri.json  - commented out
+# Revised - 2025.07.06 -- Simplified flood area layers (flood_ar_simplify)
+# Revised - 2025.07.07 -- Streaming GeoJSON into S3 multipart upload
+# Revised - 2025.07.08 -- Layers read, prepared and uploaded concurrently
+# Revised - 2025.07.09 -- Optional gzip/brotli GeoJSON, FlatGeobuf and GeoParquet outputs
+# Revised - 2025.07.10 -- Skip uploads of unchanged layers (content hash manifest)
+# Revised - 2025.07.11 -- Optional vector tiles (PMTiles archive) -- vector_tiles
+# Revised - 2025.07.12 -- GeoJSON built in PostGIS and streamed via COPY -- sql_geojson
+# Revised - 2025.07.13 -- Immutable per-cycle prefixes with latest.json -- immutable_runs
+# Revised - 2025.07.14 -- Coordinate precision, compact JSON and per-layer property allowlists
+# Revised - 2025.07.15 -- Built-in Esri JSON writer (esrijson_layers), replaces esrijson package
+# Revised - 2025.07.16 -- Statewide run split into district folders -- [statewide]
+# Revised - 2025.07.17 -- Per-stage metrics (run_metrics)
+# Revised - 2025.07.24 -- Flooded roads carry onset_hour, flood_hours and recede_hour
+# Revised - 2025.07.25 -- Optional per-hour flood area and road layers ([write_to_s3] hourly_layers)
+# Revised - 2025.07.25 -- Simplified flood areas as one coverage (ST_CoverageSimplify) when available
+# Revised - 2025.07.25 -- One shared S3 client for the publish threads (fn_get_s3_client)
+# Revised - 2025.07.25 -- Statewide split clips boundary features; statewide PMTiles under runs/ prefix
 # ************************************************************
 
 # ************************************************************
@@ -16,6 +33,7 @@ import psycopg2
 import argparse
 import configparser
 from shapely.geometry import MultiLineString, Point, Polygon
+from shapely.geometry.polygon import orient
 import os
 
 import time
@@ -25,49 +43,1075 @@ import warnings
 import subprocess
 import tempfile
 import json
-#import esrijson
+import numpy as np
+import concurrent.futures
+import threading
+from functools import partial
+import zlib
+import hashlib
+import pandas as pd
+
+from vector_tiles_04 import fn_publish_vector_tiles, STR_SQL_WARN_CLASS
+from run_metrics import fn_metric_stage, fn_metric_add, fn_metric_record, fn_metric_bind
+
+# Optional: brotli encoded GeoJSON ('geojson.br' in output_formats)
+try:
+    import brotli
+except ImportError:
+    brotli = None
 # ************************************************************
 
 
-# ^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
-def is_valid_file(parser, arg):
-    if not os.path.exists(arg):
-        parser.error("The file %s does not exist" % arg)
-    else:
-        # File exists so return the directory
-        return arg
-        return open(arg, 'r')  # return an open file handle
-# ^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
+# One S3 client for the step, shared by the publish threads.  Clients are
+# thread-safe once built, but building them from boto3's default session on
+# several threads at once is not -- fn_push_to_s3 builds it up front.
+S3_CLIENT = None
+S3_CLIENT_LOCK = threading.Lock()
+
+
+# ----------------
+def fn_get_s3_client():
+    global S3_CLIENT
+    with S3_CLIENT_LOCK:
+        if S3_CLIENT is None:
+            S3_CLIENT = boto3.session.Session().client('s3')
+        return S3_CLIENT
+# ----------------
+
+
+# ^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
+def is_valid_file(parser, arg):
+    if not os.path.exists(arg):
+        parser.error("The file %s does not exist" % arg)
+    else:
+        # File exists so return the directory
+        return arg
+        return open(arg, 'r')  # return an open file handle
+# ^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
+
+
+# ----------------
+def fn_str_to_bool(value):
+    if isinstance(value, bool):
+        return value
+    if value.lower() in {'true', 't', '1'}:
+        return True
+    elif value.lower() in {'false', 'f', '0'}:
+        return False
+    else:
+        raise argparse.ArgumentTypeError(f"Boolean value expected. Got '{value}'.")
+# ----------------
+
+
+# ------------------
+def fn_get_geodataframe_from_postgresql(table_name: str,
+                                        db_params: dict,
+                                        geom_col: str = 'geometry') -> gpd.GeoDataFrame:
+    """
+    Fetch a GeoDataFrame from a PostGIS table using psycopg2.
+
+    Parameters:
+        table_name (str): Name of the table in 'schema.table' or 'table' format.
+        db_params (dict): Dictionary with keys: host, dbname, user, password, port.
+        geom_col (str): Name of the geometry column.
+
+    Returns:
+        GeoDataFrame: The queried spatial data.
+    """
+    connection = psycopg2.connect(
+        host=db_params.get("host"),
+        dbname=db_params.get("dbname"),
+        user=db_params.get("user"),
+        password=db_params.get("password"),
+        port=db_params.get("port", "5432")
+    )
+
+    try:
+        sql = f"SELECT * FROM {table_name}"
+        gdf = gpd.read_postgis(sql, con=connection, geom_col=geom_col)
+        fn_metric_add('db_round_trips', 1)
+    finally:
+        connection.close()
+
+    return gdf
+# ------------------
+
+
+# ------------------
+def fn_get_simplified_geodataframe_from_postgresql(table_name: str,
+                                                   db_params: dict,
+                                                   flt_tolerance: float,
+                                                   list_columns: list,
+                                                   geom_col: str = 'geometry',
+                                                   b_coverage_simplify: bool = False) -> gpd.GeoDataFrame:
+    """
+    Fetch a GeoDataFrame from a PostGIS table with the geometry simplified in the
+    database, so only the reduced vertices are transferred.
+
+    Parameters:
+        table_name (str): Name of the table in 'schema.table' or 'table' format.
+        db_params (dict): Dictionary with keys: host, dbname, user, password, port.
+        flt_tolerance (float): Simplification tolerance in degrees.
+        list_columns (list): Attribute columns to fetch along with the geometry.
+        geom_col (str): Name of the geometry column.
+        b_coverage_simplify (bool): Simplify the rows as one coverage (see fn_sql_simplify).
+
+    Returns:
+        GeoDataFrame: The queried spatial data.
+    """
+    connection = psycopg2.connect(
+        host=db_params.get("host"),
+        dbname=db_params.get("dbname"),
+        user=db_params.get("user"),
+        password=db_params.get("password"),
+        port=db_params.get("port", "5432")
+    )
+
+    try:
+        str_columns = ', '.join(list_columns)
+        str_simplify = fn_sql_simplify(geom_col, '%(tolerance)s', b_coverage_simplify)
+        sql = f"SELECT {str_columns}, {str_simplify} AS {geom_col} FROM {table_name}"
+        gdf = gpd.read_postgis(sql, con=connection, geom_col=geom_col,
+                               params={'tolerance': flt_tolerance})
+        fn_metric_add('db_round_trips', 1)
+    finally:
+        connection.close()
+
+    return gdf
+# ------------------
+
+
+# ------------------
+def fn_sql_simplify(str_geometry, tolerance, b_coverage_simplify):
+    """
+    Simplification of the tile-clipped flood polygons.  ST_CoverageSimplify
+    (a window function, PostGIS >= 3.4) simplifies the shared edges of
+    neighbouring tiles once, so the tile seams stay closed.  Otherwise each
+    piece is simplified on its own (ST_SimplifyPreserveTopology) and coarse
+    tolerances leave gaps and slivers along the seams.
+    """
+    if b_coverage_simplify:
+        return f"ST_CoverageSimplify({str_geometry}, {tolerance}) OVER ()"
+    return f"ST_SimplifyPreserveTopology({str_geometry}, {tolerance})"
+# ------------------
+
+
+# ------------------
+def fn_has_coverage_simplify(db_params):
+    # ST_CoverageSimplify is in PostGIS 3.4 and later (GEOS 3.12)
+    connection = psycopg2.connect(
+        host=db_params.get("host"),
+        dbname=db_params.get("dbname"),
+        user=db_params.get("user"),
+        password=db_params.get("password"),
+        port=db_params.get("port", "5432")
+    )
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_proc WHERE proname = 'st_coveragesimplify')")
+            b_available = cursor.fetchone()[0]
+        fn_metric_add('db_round_trips', 1)
+    finally:
+        connection.close()
+    return b_available
+# ------------------
+
+
+# ------------------
+def fn_parse_simplify_layers(str_simplify):
+    """
+    Parse 'name:tolerance, name:tolerance' into a list of (name, float) tuples.
+    Example: 'coarse:0.002, medium:0.0005'
+    """
+    list_layers = []
+    for str_item in str_simplify.split(','):
+        str_item = str_item.strip()
+        if not str_item:
+            continue
+        str_name, str_tolerance = str_item.split(':')
+        list_layers.append((str_name.strip(), float(str_tolerance)))
+    return list_layers
+# ------------------
+
+
+# ----------------
+def fn_add_flood_ar_placeholder(gdf_flood_ar):
+    # With no flooding the single row has no geometry -- use a tiny
+    # placeholder polygon so that AGOL can still load the layer
+    geometry_fake_area = Polygon([
+            (-97.793186, 30.547194),
+            (-97.7892304, 30.5487087),
+            (-97.7892304, 30.5497087),
+            (-97.793186, 30.547194)
+        ])
+
+    if gdf_flood_ar.iloc[0]['geometry'] is None:
+        gdf_flood_ar.at[gdf_flood_ar.index[0], 'geometry'] = geometry_fake_area
+        gdf_flood_ar['is_real'] = 0
+        gdf_flood_ar['is_real'] = gdf_flood_ar['is_real'].astype(int)
+
+    return gdf_flood_ar
+# ----------------
+
+
+# ======================
+class S3MultipartWriter:
+    """
+    Write-only file-like object that uploads to S3 while it is being written.
+
+    Bytes are collected into parts of int_part_size; each full part is sent with
+    upload_part on a background thread while the next part is filled, so memory
+    holds at most two parts.  Objects smaller than one part go up with a single
+    put_object.  On error (or abort) the multipart upload is aborted.
+    """
+
+    def __init__(self, str_bucket_name, str_s3_key,
+                 int_part_size=8 * 1024 * 1024, dict_extra_args=None):
+        self.str_bucket_name = str_bucket_name
+        self.str_s3_key = str_s3_key
+        self.int_part_size = max(int_part_size, 5 * 1024 * 1024)  # S3 minimum part size
+        self.dict_extra_args = dict_extra_args or {}
+
+        self.s3 = fn_get_s3_client()
+        self.buffer = BytesIO()
+        self.upload_id = None
+        self.int_part_number = 0
+        self.list_parts = []
+        self.future = None
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.buffer.write(data)
+        if self.buffer.tell() >= self.int_part_size:
+            self._flush_part()
+        return len(data)
+
+    def _upload_part(self, bytes_part, int_part_number):
+        response = self.s3.upload_part(Bucket=self.str_bucket_name,
+                                       Key=self.str_s3_key,
+                                       UploadId=self.upload_id,
+                                       PartNumber=int_part_number,
+                                       Body=bytes_part)
+        fn_metric_add('s3_bytes_uploaded', len(bytes_part))
+        return {'PartNumber': int_part_number, 'ETag': response['ETag']}
+
+    def _wait_for_part(self):
+        if self.future is not None:
+            self.list_parts.append(self.future.result())
+            self.future = None
+
+    def _flush_part(self):
+        if self.upload_id is None:
+            response = self.s3.create_multipart_upload(Bucket=self.str_bucket_name,
+                                                       Key=self.str_s3_key,
+                                                       **self.dict_extra_args)
+            self.upload_id = response['UploadId']
+
+        # Only one part in flight -- keeps memory bounded
+        self._wait_for_part()
+
+        bytes_part = self.buffer.getvalue()
+        self.buffer = BytesIO()
+        self.int_part_number += 1
+        self.future = self.executor.submit(fn_metric_bind(self._upload_part), bytes_part, self.int_part_number)
+
+    def close(self):
+        try:
+            if self.upload_id is None:
+                self.s3.put_object(Bucket=self.str_bucket_name,
+                                   Key=self.str_s3_key,
+                                   Body=self.buffer.getvalue(),
+                                   **self.dict_extra_args)
+                fn_metric_add('s3_bytes_uploaded', self.buffer.tell())
+            else:
+                if self.buffer.tell() > 0:
+                    self._flush_part()
+                self._wait_for_part()
+                self.s3.complete_multipart_upload(Bucket=self.str_bucket_name,
+                                                  Key=self.str_s3_key,
+                                                  UploadId=self.upload_id,
+                                                  MultipartUpload={'Parts': self.list_parts})
+        finally:
+            self.buffer = BytesIO()
+            self.executor.shutdown(wait=True)
+
+    def abort(self):
+        try:
+            if self.future is not None:
+                self.future.cancel()
+            if self.upload_id is not None:
+                self.s3.abort_multipart_upload(Bucket=self.str_bucket_name,
+                                               Key=self.str_s3_key,
+                                               UploadId=self.upload_id)
+        finally:
+            self.buffer = BytesIO()
+            self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+# ======================
+
+
+# ----------------
+def fn_json_default(obj):
+    # numpy scalars and arrays that json cannot serialize on its own
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return None if np.isnan(obj) else float(obj)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+# ----------------
+
+
+# ----------------
+def fn_round_coordinates(coords, int_precision):
+    # GeoJSON coordinates (any nesting depth) rounded to int_precision decimals
+    if len(coords) == 0:
+        return coords
+    if isinstance(coords[0], (int, float)) or (len(coords[0]) and isinstance(coords[0][0], (int, float))):
+        return np.round(np.asarray(coords, dtype=float), int_precision).tolist()
+    return [fn_round_coordinates(part, int_precision) for part in coords]
+# ----------------
+
+
+# ----------------
+def fn_round_geometry(dict_geometry, int_precision):
+    if dict_geometry is None:
+        return None
+    if dict_geometry['type'] == 'GeometryCollection':
+        return {'type': 'GeometryCollection',
+                'geometries': [fn_round_geometry(dict_part, int_precision)
+                               for dict_part in dict_geometry['geometries']]}
+    return {'type': dict_geometry['type'],
+            'coordinates': fn_round_coordinates(dict_geometry['coordinates'], int_precision)}
+# ----------------
+
+
+# ----------------------
+def fn_iter_geojson_chunks(gdf, int_batch_size=2000, int_precision=None, b_compact=False):
+    """
+    Yield a GeoJSON FeatureCollection of gdf as string chunks, one batch of
+    features at a time, so the full document is never held in memory.
+
+    int_precision rounds the coordinates to that many decimals (6 is ~0.1 m);
+    b_compact drops the whitespace after separators.
+    """
+    list_datetime_cols = [col for col in gdf.columns
+                          if col != gdf.geometry.name and gdf[col].dtype == 'datetime64[ns]']
+
+    tup_separators = (',', ':') if b_compact else (', ', ': ')
+    str_sep = tup_separators[0]
+
+    yield '{"type":"FeatureCollection","features":[' if b_compact else '{"type": "FeatureCollection", "features": ['
+
+    int_object_id = 0
+    for int_start in range(0, len(gdf), int_batch_size):
+        gdf_batch = gdf.iloc[int_start:int_start + int_batch_size]
+
+        # Convert datetime columns to string format
+        if list_datetime_cols:
+            gdf_batch = gdf_batch.copy()
+            for col in list_datetime_cols:
+                gdf_batch[col] = gdf_batch[col].dt.strftime('%Y-%m-%dT%H:%M:%S')
+
+        list_features = gdf_batch.iterfeatures()
+        if int_precision is not None:
+            list_features = ({**feature, 'geometry': fn_round_geometry(feature['geometry'], int_precision)}
+                             for feature in list_features)
+
+        str_features = str_sep.join(json.dumps(feature, default=fn_json_default, separators=tup_separators)
+                                    for feature in list_features)
+        yield (str_sep if int_start > 0 else '') + str_features
+
+    yield ']}'
+# ----------------------
+
+
+# Output formats for [write_to_s3] output_formats -- (key suffix, content encoding)
+DICT_OUTPUT_FORMATS = {
+    'geojson': ('.geojson', None),
+    'geojson.gz': ('.geojson.gz', 'gzip'),
+    'geojson.br': ('.geojson.br', 'br'),
+    'fgb': ('.fgb', None),
+    'parquet': ('.parquet', None),
+}
+
+
+# ----------------
+def fn_parse_output_formats(str_output_formats):
+    # Comma separated list of DICT_OUTPUT_FORMATS keys, default is plain GeoJSON
+    list_formats = [str_item.strip().lower() for str_item in str_output_formats.split(',') if str_item.strip()]
+    if not list_formats:
+        list_formats = ['geojson']
+
+    for str_format in list_formats:
+        if str_format not in DICT_OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format '{str_format}'. "
+                             f"Expected one of {list(DICT_OUTPUT_FORMATS.keys())}")
+        if str_format == 'geojson.br' and brotli is None:
+            raise ImportError("Output format 'geojson.br' requires the 'brotli' package")
+
+    return list_formats
+# ----------------
+
+
+# ----------------
+def fn_get_compressor(str_content_encoding):
+    # Returns (fn_compress, fn_finish) for a streaming Content-Encoding
+    if str_content_encoding == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 -> gzip container
+        return compressor.compress, compressor.flush
+    if str_content_encoding == 'br':
+        compressor = brotli.Compressor(quality=5)
+        return compressor.process, compressor.finish
+    raise ValueError(f"Unsupported content encoding '{str_content_encoding}'")
+# ----------------
+
+
+# ----------------------
+def fn_write_gdf_to_s3(gdf, str_bucket_name, str_s3_key, str_content_encoding=None, str_cache_control=None,
+                       int_precision=None, b_compact=False):
+
+    dict_extra_args = {}
+    fn_compress = None
+    if str_content_encoding:
+        dict_extra_args = {'ContentType': 'application/geo+json',
+                           'ContentEncoding': str_content_encoding}
+        fn_compress, fn_finish = fn_get_compressor(str_content_encoding)
+    if str_cache_control:
+        dict_extra_args['CacheControl'] = str_cache_control
+
+    # Serialize the features in batches straight into a multipart upload
+    with S3MultipartWriter(str_bucket_name, str_s3_key, dict_extra_args=dict_extra_args) as writer:
+        for str_chunk in fn_iter_geojson_chunks(gdf, int_precision=int_precision, b_compact=b_compact):
+            if fn_compress:
+                writer.write(fn_compress(str_chunk.encode('utf-8')))
+            else:
+                writer.write(str_chunk)
+        if fn_compress:
+            writer.write(fn_finish())
+
+    print(f"  -- Uploaded to s3://{str_bucket_name}/{str_s3_key}")
+# ----------------------
+
+
+# ----------------------
+def fn_write_gdf_to_s3_binary(gdf, str_bucket_name, str_s3_key, str_format, str_cache_control=None):
+    # FlatGeobuf (with spatial index, for HTTP range reads) or GeoParquet
+    # written to a temporary file, then uploaded (multipart for large files)
+    gdf = gdf.apply(lambda x: x.dt.strftime('%Y-%m-%dT%H:%M:%S') if x.dtype == 'datetime64[ns]' else x)
+
+    with tempfile.TemporaryDirectory() as str_temp_dir:
+        str_local_path = os.path.join(str_temp_dir, os.path.basename(str_s3_key))
+
+        if str_format == 'fgb':
+            gdf.to_file(str_local_path, driver='FlatGeobuf', SPATIAL_INDEX='YES')
+            dict_extra_args = {'ContentType': 'application/octet-stream'}
+        else:
+            gdf.to_parquet(str_local_path, index=False)  # requires pyarrow
+            dict_extra_args = {'ContentType': 'application/vnd.apache.parquet'}
+        if str_cache_control:
+            dict_extra_args['CacheControl'] = str_cache_control
+
+        s3 = fn_get_s3_client()
+        s3.upload_file(str_local_path, str_bucket_name, str_s3_key, ExtraArgs=dict_extra_args)
+        fn_metric_add('s3_bytes_uploaded', os.path.getsize(str_local_path))
+
+    print(f"  -- Uploaded to s3://{str_bucket_name}/{str_s3_key}")
+# ----------------------
+
+
+# Esri JSON geometry types by shapely geometry type
+DICT_ESRI_GEOMETRY_TYPES = {
+    'Point': 'esriGeometryPoint',
+    'MultiPoint': 'esriGeometryMultipoint',
+    'LineString': 'esriGeometryPolyline',
+    'MultiLineString': 'esriGeometryPolyline',
+    'Polygon': 'esriGeometryPolygon',
+    'MultiPolygon': 'esriGeometryPolygon',
+    'LinearRing': 'esriGeometryPolyline',
+}
+
+# Dimension of each Esri geometry type
+DICT_ESRI_DIMENSIONS = {
+    'esriGeometryPoint': 0,
+    'esriGeometryMultipoint': 0,
+    'esriGeometryPolyline': 1,
+    'esriGeometryPolygon': 2,
+}
+
+
+# ----------------
+def fn_esri_coords(coords, int_precision=None):
+    # x, y pairs (z dropped) of a coordinate sequence as a nested list
+    arr_coords = np.asarray(coords, dtype=float)[:, :2]
+    if int_precision is not None:
+        arr_coords = np.round(arr_coords, int_precision)
+    return arr_coords.tolist()
+# ----------------
+
+
+# ----------------
+def fn_esri_geometry_parts(geom, int_dimension):
+    # Points, lines or polygons (int_dimension 0, 1, 2) of a geometry, from
+    # inside Multi* and GeometryCollections; parts of other dimensions dropped
+    if geom is None or geom.is_empty:
+        return
+    if hasattr(geom, 'geoms'):
+        for part in geom.geoms:
+            yield from fn_esri_geometry_parts(part, int_dimension)
+    elif DICT_ESRI_DIMENSIONS[DICT_ESRI_GEOMETRY_TYPES[geom.geom_type]] == int_dimension:
+        yield geom
+# ----------------
+
+
+# ----------------
+def fn_esri_layer_geometry_type(geoseries):
+    """
+    Esri geometry type of a layer: its highest dimension, so a line layer
+    whose intersections left some points (or point + line collections) stays
+    a polyline layer.
+    """
+    set_types = set(geoseries.geom_type.dropna().unique())
+    if 'GeometryCollection' in set_types:
+        for geom in geoseries[geoseries.geom_type == 'GeometryCollection'].values:
+            for int_dimension in (0, 1, 2):
+                set_types.update(part.geom_type for part in fn_esri_geometry_parts(geom, int_dimension))
+
+    if set_types & {'Polygon', 'MultiPolygon'}:
+        return 'esriGeometryPolygon'
+    if set_types & {'LineString', 'MultiLineString', 'LinearRing'}:
+        return 'esriGeometryPolyline'
+    if 'MultiPoint' in set_types:
+        return 'esriGeometryMultipoint'
+    if 'Point' in set_types:
+        return 'esriGeometryPoint'
+    return 'esriGeometryPolygon'
+# ----------------
+
+
+# ----------------
+def fn_geometry_to_esri(geom, str_geometry_type='esriGeometryPolygon', int_precision=None):
+    """
+    Shapely geometry to an Esri JSON geometry dict of str_geometry_type.  Only
+    the parts of the layer's dimension are kept; None if nothing is left.
+    Polygon exterior rings are written clockwise and holes counter-clockwise,
+    as Esri expects.
+    """
+    list_parts = list(fn_esri_geometry_parts(geom, DICT_ESRI_DIMENSIONS[str_geometry_type]))
+    if not list_parts:
+        return None
+
+    if str_geometry_type == 'esriGeometryPoint':
+        # A point layer holds single points -- the first of a collection
+        flt_x, flt_y = fn_esri_coords([list_parts[0].coords[0]], int_precision)[0]
+        return {'x': flt_x, 'y': flt_y}
+    if str_geometry_type == 'esriGeometryMultipoint':
+        return {'points': fn_esri_coords([point.coords[0] for point in list_parts], int_precision)}
+    if str_geometry_type == 'esriGeometryPolyline':
+        return {'paths': [fn_esri_coords(line.coords, int_precision) for line in list_parts]}
+
+    list_rings = []
+    for polygon in list_parts:
+        polygon = orient(polygon, sign=-1.0)
+        list_rings.append(fn_esri_coords(polygon.exterior.coords, int_precision))
+        list_rings.extend(fn_esri_coords(ring.coords, int_precision) for ring in polygon.interiors)
+    return {'rings': list_rings}
+# ----------------
+
+
+# ----------------
+def fn_esri_field_type(series):
+    if pd.api.types.is_bool_dtype(series):
+        return 'esriFieldTypeSmallInteger'
+    if pd.api.types.is_integer_dtype(series):
+        return 'esriFieldTypeInteger'
+    if pd.api.types.is_float_dtype(series):
+        return 'esriFieldTypeDouble'
+    return 'esriFieldTypeString'
+# ----------------
+
+
+# ----------------------
+def fn_iter_esrijson_chunks(gdf, int_batch_size=2000, int_precision=None, b_compact=False):
+    """
+    Yield an Esri JSON FeatureSet of gdf as string chunks, one batch of
+    features at a time, straight from the shapely coordinate arrays.
+    """
+    str_geom_col = gdf.geometry.name
+    list_attr_cols = [col for col in gdf.columns if col != str_geom_col]
+    list_datetime_cols = [col for col in list_attr_cols if gdf[col].dtype == 'datetime64[ns]']
+
+    tup_separators = (',', ':') if b_compact else (', ', ': ')
+    str_sep = tup_separators[0]
+
+    str_geometry_type = fn_esri_layer_geometry_type(gdf.geometry)
+
+    list_fields = [{'name': 'OBJECTID', 'type': 'esriFieldTypeOID', 'alias': 'OBJECTID'}]
+    list_fields.extend({'name': col,
+                        'type': 'esriFieldTypeString' if col in list_datetime_cols else fn_esri_field_type(gdf[col]),
+                        'alias': col}
+                       for col in list_attr_cols)
+
+    str_header = json.dumps({'geometryType': str_geometry_type,
+                             'spatialReference': {'wkid': 4326},
+                             'fields': list_fields},
+                            separators=tup_separators)
+    yield str_header[:-1] + str_sep + '"features"' + tup_separators[1] + '['
+
+    for int_start in range(0, len(gdf), int_batch_size):
+        gdf_batch = gdf.iloc[int_start:int_start + int_batch_size]
+
+        df_attr = gdf_batch[list_attr_cols].copy()
+        for col in list_datetime_cols:
+            df_attr[col] = df_attr[col].dt.strftime('%Y-%m-%dT%H:%M:%S')
+        df_attr = df_attr.astype(object).where(pd.notna(df_attr), None)
+
+        list_features = []
+        for dict_attr, geom in zip(df_attr.to_dict('records'), gdf_batch.geometry.values):
+            dict_geometry = fn_geometry_to_esri(geom, str_geometry_type, int_precision)
+            if dict_geometry is None and geom is not None and not geom.is_empty:
+                # Nothing of the layer's dimension (a road clipped to a single point)
+                continue
+            int_object_id += 1
+            dict_attr = {'OBJECTID': int_object_id, **dict_attr}
+            list_features.append(json.dumps({'attributes': dict_attr, 'geometry': dict_geometry},
+                                            default=fn_json_default, separators=tup_separators))
+
+        if list_features:
+            yield (str_sep if int_object_id > len(list_features) else '') + str_sep.join(list_features)
+
+    yield ']}'
+# ----------------------
+
+
+# ----------------------
+def fn_write_gdf_to_s3_esrijson(gdf, str_bucket_name, str_s3_key, str_cache_control=None,
+                                int_precision=None, b_compact=False):
+    # Esri JSON FeatureSet streamed into a multipart upload
+    dict_extra_args = {'ContentType': 'application/json'}
+    if str_cache_control:
+        dict_extra_args['CacheControl'] = str_cache_control
+
+    with S3MultipartWriter(str_bucket_name, str_s3_key, dict_extra_args=dict_extra_args) as writer:
+        for str_chunk in fn_iter_esrijson_chunks(gdf, int_precision=int_precision, b_compact=b_compact):
+            writer.write(str_chunk)
+
+    print(f"  -- Uploaded ESRI JSON to s3://{str_bucket_name}/{str_s3_key}")
+# ----------------------
+
+
+# ----------------
+def fn_assign_warn_class(row):
+    if row['is_overtop'] == 1:
+        return 'overtopped'
+    elif row['min_dist_to_low_ch'] < 0.5:
+        return 'critical'
+    elif 0.5 <= row['min_dist_to_low_ch'] < 2:
+        return 'high'
+    elif 2 <= row['min_dist_to_low_ch'] < 5:
+        return 'moderate'
+    else:
+        return 'low'
+# ----------------
+
+
+# ------------------
+def fn_get_model_run_time(db_params: dict):
+    # Current model_run_time from t_current_forecast (written by step 02)
+    connection = psycopg2.connect(
+        host=db_params.get("host"),
+        dbname=db_params.get("dbname"),
+        user=db_params.get("user"),
+        password=db_params.get("password"),
+        port=db_params.get("port", "5432")
+    )
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT model_run_time FROM t_current_forecast LIMIT 1")
+            row = cursor.fetchone()
+    finally:
+        connection.close()
+
+    return row[0] if row else None
+# ------------------
+
+
+# ------------------
+def fn_get_flood_hours(db_params: dict):
+    # Forecast hours of the per-hour layers (t_flood_hour, roadflood_hourly_flood_layers.sql)
+    connection = psycopg2.connect(
+        host=db_params.get("host"),
+        dbname=db_params.get("dbname"),
+        user=db_params.get("user"),
+        password=db_params.get("password"),
+        port=db_params.get("port", "5432")
+    )
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('t_flood_hour') IS NOT NULL")
+            if not cursor.fetchone()[0]:
+                return []
+            cursor.execute("SELECT forecast_hour FROM t_flood_hour ORDER BY forecast_hour")
+            list_hours = [row[0] for row in cursor.fetchall()]
+    finally:
+        connection.close()
+
+    return list_hours
+# ------------------
+
+
+# ------------------
+def fn_sql_hour_rows(str_table_name, int_hour):
+    # Rows of a per-hour table that hold at int_hour, as a table expression
+    return f"(SELECT * FROM {str_table_name} WHERE {int(int_hour)} BETWEEN hour_from AND hour_to)"
+# ------------------
+
+
+# ----------------
+def fn_prepare_flood_ar(gdf_flood_ar, str_model_run_time):
+    if gdf_flood_ar.empty:
+        # No rows at all (a district without flooding in a statewide split) --
+        # one row without geometry that gets the placeholder polygon
+        dict_empty = {col: [None] for col in gdf_flood_ar.columns}
+        if 'model_run_time' in dict_empty:
+            dict_empty['model_run_time'] = [str_model_run_time]
+        gdf_flood_ar = gpd.GeoDataFrame(dict_empty, geometry=gdf_flood_ar.geometry.name, crs="EPSG:4326")
+    return fn_add_flood_ar_placeholder(gdf_flood_ar)
+# ----------------
+
+
+# ----------------
+def fn_prepare_flood_road_ln(gdf_road_ln, str_model_run_time, list_columns):
+    # -- If empty, create a AGOL placeholder for road lines
+    if gdf_road_ln.empty:
+
+        geometry_fake_line = MultiLineString([[
+            (-97.793186, 30.547194),
+            (-97.7892304, 30.5487087)]])
+
+        # Define placeholder attributes
+        dict_empty_road_data = {
+            'osm_id': [-1],
+            'fclass': ['unknown'],
+            'name': ["This placeholder when there is no flooding that allows AGOL to still load the layer"],
+            'ref': [''],
+            'road_id': [-1],
+            'nextgen_id': [-1],
+            'min_flood_flow': [-1],
+            'max_flow': [-1],
+            'model_run_time': [str_model_run_time],
+            'length_ft': [0],
+            'onset_hour': [None],
+            'flood_hours': [0],
+            'recede_hour': [None],
+            'geometry': [geometry_fake_line]
+        }
+
+        gdf_road_ln = gpd.GeoDataFrame(dict_empty_road_data, crs="EPSG:4326")
+
+    # --- Prepare layers for lean TxDOT export ---
+    return gdf_road_ln[list_columns]
+# ----------------
+
+
+# ----------------
+def fn_prepare_bridge_warning_pnt(gdf_bridge_pnt, str_model_run_time):
+    # -- If empty, create a AGOL placeholder for bridge warning points
+    if gdf_bridge_pnt.empty:
+
+        geometry_fake_point = Point(-97.793186, 30.547194)
+
+        # Define placeholder attributes
+        dict_empty_bridge_data = {
+            'BRDG_ID': ['-1'],
+            'uuid_bridge': ['-1'],
+            'min_low_ch': [None],
+            'min_ground': [None],
+            'min_overtop': [None],
+            'name': ["This placeholder when there is no flooding that allows AGOL to still load the layer"],
+            'ref': [''],
+            'nhd_name': [''],
+            'model_run_time': [str_model_run_time],
+            'max_wse': [None],
+            'min_dist_to_low_ch': [100],
+            'is_overtop': ['0'],
+            'depth_array': [[ ]],
+            'url': [''],
+            'warn_class': ['low'],
+            'geometry': [geometry_fake_point]
+        }
+
+        gdf_bridge_pnt = gpd.GeoDataFrame(dict_empty_bridge_data, crs="EPSG:4326")
+
+    # Prepare prepare bridge worning points for geoJSON
+    gdf_bridge_pnt['warn_class'] = gdf_bridge_pnt.apply(fn_assign_warn_class, axis=1)
+    columns_to_keep_bridge = ['geometry', 'warn_class', 'BRDG_ID', 'name', 'ref', 'nhd_name', 'min_dist_to_low_ch', 'model_run_time', 'url']
+    return gdf_bridge_pnt[columns_to_keep_bridge]
+# ----------------
+
+
+# ----------------
+def fn_layer_content_hash(gdf, list_timestamp_fields, list_formats):
+    """
+    sha256 of a layer's geometry and attributes, leaving out the timestamp
+    fields (they change every cycle and are published in status.json instead).
+    """
+    hasher = hashlib.sha256()
+    hasher.update(','.join(list_formats).encode('utf-8'))
+
+    list_cols = sorted(col for col in gdf.columns
+                       if col != gdf.geometry.name
+                       and col not in list_timestamp_fields
+                       and gdf[col].dtype != 'datetime64[ns]')
+    hasher.update(','.join(list_cols).encode('utf-8'))
+
+    if list_cols:
+        hasher.update(pd.util.hash_pandas_object(gdf[list_cols].astype(str), index=False).values.tobytes())
+
+    for geom in gdf.geometry.values:
+        hasher.update(geom.wkb if geom is not None else b'')
+
+    return hasher.hexdigest()
+# ----------------
+
+
+# ----------------
+def fn_read_json_from_s3(str_bucket_name, str_s3_key):
+    # Small JSON object from S3, or {} if it does not exist yet
+    s3 = fn_get_s3_client()
+    try:
+        response = s3.get_object(Bucket=str_bucket_name, Key=str_s3_key)
+    except s3.exceptions.NoSuchKey:
+        return {}
+    return json.loads(response['Body'].read())
+# ----------------
+
+
+# ----------------
+def fn_write_json_to_s3(dict_data, str_bucket_name, str_s3_key, str_cache_control=None):
+    dict_extra_args = {'CacheControl': str_cache_control} if str_cache_control else {}
+    s3 = fn_get_s3_client()
+    s3.put_object(Bucket=str_bucket_name,
+                  Key=str_s3_key,
+                  Body=json.dumps(dict_data, indent=2).encode('utf-8'),
+                  ContentType='application/json',
+                  **dict_extra_args)
+# ----------------
+
+
+# --- In-database GeoJSON (sql_geojson) ---
+# Each layer query returns (properties json, geometry) with the column pruning,
+# warn_class and the AGOL placeholders of the prepare functions done in SQL
+
+STR_PLACEHOLDER_NAME = "This placeholder when there is no flooding that allows AGOL to still load the layer"
+STR_SQL_CURRENT_MODEL_RUN_TIME = "(SELECT model_run_time FROM t_current_forecast LIMIT 1)"
+
+
+# ----------------
+def fn_build_sql_placeholder_layer(str_table_name, dict_columns, str_placeholder_wkt, dict_placeholder):
+    # Selected columns of every row, or a single placeholder row if the table is empty
+    str_properties = ', '.join(f"'{str_col}', {str_expr}" for str_col, str_expr in dict_columns.items())
+    str_placeholder = ', '.join(f"'{str_col}', {dict_placeholder[str_col]}" for str_col in dict_columns)
+
+    return f"""
+        SELECT json_build_object({str_properties}) AS properties, t.geometry
+        FROM {str_table_name} t
+        UNION ALL
+        SELECT json_build_object({str_placeholder}), ST_GeomFromText('{str_placeholder_wkt}', 4326)
+        WHERE NOT EXISTS (SELECT 1 FROM {str_table_name} e)"""
+# ----------------
+
+
+# ----------------
+def fn_build_sql_flood_ar(str_table_name, flt_tolerance=None, list_columns=None, b_coverage_simplify=False):
+    # Same as fn_add_flood_ar_placeholder: when the first row has no geometry
+    # it gets the placeholder polygon and the whole layer is_real = 0
+    if list_columns:
+        str_properties = "jsonb_build_object(" + ', '.join(f"'{str_col}', t.{str_col}" for str_col in list_columns) + ")"
+    else:
+        str_properties = "(to_jsonb(t) - 'geometry' - 'b_fast_placeholder' - 'int_fast_row')"
+
+    str_geometry = "t.geometry"
+    if flt_tolerance is not None:
+        str_geometry = fn_sql_simplify("t.geometry", float(flt_tolerance), b_coverage_simplify)
+
+    # Both window functions run over the same unordered window, i.e. in the
+    # order the rows are read (the pandas path's iloc[0])
+    return f"""
+        SELECT
+            (CASE WHEN t.b_fast_placeholder
+                  THEN {str_properties} || '{{"is_real": 0}}'::jsonb
+                  ELSE {str_properties} END)::json AS properties,
+            CASE WHEN t.b_fast_placeholder AND t.int_fast_row = 1
+                 THEN ST_GeomFromText('POLYGON((-97.793186 30.547194, -97.7892304 30.5487087, -97.7892304 30.5497087, -97.793186 30.547194))', 4326)
+                 ELSE {str_geometry} END AS geometry
+        FROM (
+            SELECT
+                r.*,
+                first_value(r.geometry IS NULL) OVER () AS b_fast_placeholder,
+                row_number() OVER () AS int_fast_row
+            FROM {str_table_name} r
+        ) t"""
+# ----------------
 
 
 # ----------------
-def fn_str_to_bool(value):
-    if isinstance(value, bool):
-        return value
-    if value.lower() in {'true', 't', '1'}:
-        return True
-    elif value.lower() in {'false', 'f', '0'}:
-        return False
-    else:
-        raise argparse.ArgumentTypeError(f"Boolean value expected. Got '{value}'.")
+def fn_build_sql_flood_hour_ar(str_table_name, int_hour):
+    # One hour of the per-hour flood areas; an hour without flooding gets a
+    # row without geometry, i.e. the placeholder of fn_build_sql_flood_ar
+    str_hour_rows = fn_sql_hour_rows(str_table_name, int_hour)
+    return fn_build_sql_flood_ar(f"""(
+            SELECT h.tile_id, h.model_run_time, h.geometry FROM {str_hour_rows} h
+            UNION ALL
+            SELECT NULL::bigint, {STR_SQL_CURRENT_MODEL_RUN_TIME}, NULL::geometry
+            WHERE NOT EXISTS (SELECT 1 FROM {str_hour_rows} e))""")
 # ----------------
 
 
-# ------------------
-def fn_get_geodataframe_from_postgresql(table_name: str,
-                                        db_params: dict,
-                                        geom_col: str = 'geometry') -> gpd.GeoDataFrame:
+# ----------------
+def fn_build_sql_flood_road_ln(str_table_name, list_columns):
+    dict_placeholder = {
+        'name': f"'{STR_PLACEHOLDER_NAME}'",
+        'ref': "''",
+        'fclass': "'unknown'",
+        'model_run_time': STR_SQL_CURRENT_MODEL_RUN_TIME,
+        'length_ft': "0",
+        'onset_hour': "NULL",
+        'flood_hours': "0",
+        'recede_hour': "NULL",
+    }
+    dict_columns = {str_col: f"t.{str_col}" for str_col in list_columns if str_col != 'geometry'}
+    return fn_build_sql_placeholder_layer(str_table_name, dict_columns,
+                                          'MULTILINESTRING((-97.793186 30.547194, -97.7892304 30.5487087))',
+                                          dict_placeholder)
+# ----------------
+
+
+# ----------------
+def fn_build_sql_bridge_warning_pnt(str_table_name):
+    dict_columns = {
+        'warn_class': STR_SQL_WARN_CLASS,
+        'BRDG_ID': 't."BRDG_ID"',
+        'name': "t.name",
+        'ref': "t.ref",
+        'nhd_name': "t.nhd_name",
+        'min_dist_to_low_ch': "t.min_dist_to_low_ch",
+        'model_run_time': "t.model_run_time",
+        'url': "t.url",
+    }
+    dict_placeholder = {
+        'warn_class': "'low'",
+        'BRDG_ID': "'-1'",
+        'name': f"'{STR_PLACEHOLDER_NAME}'",
+        'ref': "''",
+        'nhd_name': "''",
+        'min_dist_to_low_ch': "100",
+        'model_run_time': STR_SQL_CURRENT_MODEL_RUN_TIME,
+        'url': "''",
+    }
+    return fn_build_sql_placeholder_layer(str_table_name, dict_columns,
+                                          'POINT(-97.793186 30.547194)', dict_placeholder)
+# ----------------
+
+
+# ----------------
+def fn_build_sql_property_allowlist(str_layer_sql, list_properties):
+    # Keep only the listed properties (in their original order) of a layer query
+    str_properties = ', '.join(f"'{str_col}'" for str_col in list_properties)
+    return f"""
+        SELECT
+            (SELECT COALESCE(json_object_agg(p.key, p.value), '{{}}'::json)
+             FROM json_each(l.properties) p
+             WHERE p.key IN ({str_properties})) AS properties,
+            l.geometry
+        FROM ({str_layer_sql}) l"""
+# ----------------
+
+
+# ======================
+class GeoJSONCopySink:
     """
-    Fetch a GeoDataFrame from a PostGIS table using psycopg2.
+    File-like target for cursor.copy_expert: passes the feature rows of one
+    COPY to every output (writer, fn_compress) at once.
+    """
+
+    def __init__(self, list_outputs):
+        self.list_outputs = list_outputs
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        for writer, fn_compress in self.list_outputs:
+            writer.write(fn_compress(data) if fn_compress else data)
+        return len(data)
+# ======================
+
+
+# ----------------------
+def fn_copy_geojson_to_s3(db_params, str_layer_sql, str_bucket_name, list_s3_outputs, str_cache_control=None,
+                          int_precision=None, b_compact=False):
+    """
+    Build the FeatureCollection in PostGIS and stream it with COPY ... TO STDOUT
+    straight into the S3 uploads.
 
     Parameters:
-        table_name (str): Name of the table in 'schema.table' or 'table' format.
-        db_params (dict): Dictionary with keys: host, dbname, user, password, port.
-        geom_col (str): Name of the geometry column.
+        str_layer_sql (str): Query returning (properties json, geometry).
+        list_s3_outputs (list): (s3 key, content encoding or None) to write.
+        str_cache_control (str): Optional Cache-Control header of the objects.
+        int_precision (int): Decimals of the coordinates (ST_AsGeoJSON default of 9 if None).
+        b_compact (bool): No whitespace in the FeatureCollection and Feature wrappers.
 
     Returns:
-        GeoDataFrame: The queried spatial data.
+        int: number of features.
     """
+    # One feature per COPY row, already separated by commas.  CSV with quote and
+    # delimiter characters that never appear in JSON passes the text unescaped.
+    # The Feature wrapper is concatenated as text, so the ST_AsGeoJSON output
+    # is not parsed back into json.
+    int_decimals = 9 if int_precision is None else int(int_precision)
+    str_sp = '' if b_compact else ' '
+    str_copy_sql = f"""
+        COPY (
+            SELECT
+                CASE WHEN f.n = 1 THEN '' ELSE ',' END ||
+                '{{"id":{str_sp}"' || (f.n - 1)::text ||
+                '",{str_sp}"type":{str_sp}"Feature",{str_sp}"properties":{str_sp}' || f.properties::text ||
+                ',{str_sp}"geometry":{str_sp}' || COALESCE(ST_AsGeoJSON(f.geometry, {int_decimals}), 'null') || '}}'
+            FROM (SELECT row_number() OVER () AS n, l.properties, l.geometry
+                  FROM ({str_layer_sql}) l) f
+        ) TO STDOUT WITH (FORMAT csv, DELIMITER E'\\x02', QUOTE E'\\x01')"""
+
+    list_writers = []
+    list_outputs = []
+    for str_s3_key, str_content_encoding in list_s3_outputs:
+        dict_extra_args = {}
+        fn_compress, fn_finish = None, None
+        if str_content_encoding:
+            dict_extra_args = {'ContentType': 'application/geo+json',
+                               'ContentEncoding': str_content_encoding}
+            fn_compress, fn_finish = fn_get_compressor(str_content_encoding)
+        if str_cache_control:
+            dict_extra_args['CacheControl'] = str_cache_control
+        list_writers.append((S3MultipartWriter(str_bucket_name, str_s3_key, dict_extra_args=dict_extra_args),
+                             fn_finish))
+        list_outputs.append((list_writers[-1][0], fn_compress))
+
+    sink = GeoJSONCopySink(list_outputs)
+
     connection = psycopg2.connect(
         host=db_params.get("host"),
         dbname=db_params.get("dbname"),
@@ -77,70 +1121,335 @@ def fn_get_geodataframe_from_postgresql(table_name: str,
     )
 
     try:
-        sql = f"SELECT * FROM {table_name}"
-        gdf = gpd.read_postgis(sql, con=connection, geom_col=geom_col)
+        sink.write('{"type":"FeatureCollection","features":[\n' if b_compact
+                   else '{"type": "FeatureCollection", "features": [\n')
+        with connection.cursor() as cursor:
+            cursor.copy_expert(str_copy_sql, sink)
+            int_features = cursor.rowcount
+        sink.write(']}')
+
+        for writer, fn_finish in list_writers:
+            if fn_finish:
+                writer.write(fn_finish())
+            writer.close()
+    except Exception:
+        for writer, fn_finish in list_writers:
+            writer.abort()
+        raise
     finally:
         connection.close()
 
-    return gdf
-# ------------------
+    for str_s3_key, str_content_encoding in list_s3_outputs:
+        print(f"  -- Uploaded to s3://{str_bucket_name}/{str_s3_key}")
+
+    return int_features
+# ----------------------
+
+
+# ----------------
+def fn_sql_layer_content_hash(db_params, str_layer_sql, list_timestamp_fields, list_formats):
+    # Database-side equivalent of fn_layer_content_hash
+    connection = psycopg2.connect(
+        host=db_params.get("host"),
+        dbname=db_params.get("dbname"),
+        user=db_params.get("user"),
+        password=db_params.get("password"),
+        port=db_params.get("port", "5432")
+    )
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT md5(COALESCE(string_agg(h.feature_hash, '' ORDER BY h.feature_hash), ''))
+                FROM (
+                    SELECT md5((l.properties::jsonb - %(timestamp_fields)s::text[])::text ||
+                               COALESCE(encode(ST_AsBinary(l.geometry), 'hex'), '')) AS feature_hash
+                    FROM ({str_layer_sql}) l
+                ) h""", {'timestamp_fields': list_timestamp_fields})
+            str_db_hash = cursor.fetchone()[0]
+    finally:
+        connection.close()
+
+    hasher = hashlib.sha256()
+    hasher.update(','.join(list_formats).encode('utf-8'))
+    hasher.update(str_db_hash.encode('utf-8'))
+    return hasher.hexdigest()
+# ----------------
+
+
+# ----------------
+def fn_list_geojson_options(dict_layer):
+    # Writer options are part of the content hash -- changing them re-uploads the layer
+    return [f"{str_key}={value}" for str_key, value in sorted(dict_layer.get('geojson_options', {}).items())]
+# ----------------
 
 
 # ----------------------
-def fn_write_gdf_to_s3(gdf, str_bucket_name, str_s3_key):
+def fn_publish_layer_sql(dict_layer, str_bucket_name, list_formats,
+                         list_timestamp_fields=None, str_previous_hash=None, str_cache_control=None):
+    # sql_geojson version of fn_publish_layer -- no geopandas round trip
+    dict_timing = {'layer': dict_layer['name'], 'read': 0.0, 'prepare': 0.0}
 
-    # Convert datetime columns to string format
-    gdf = gdf.apply(lambda x: x.dt.strftime('%Y-%m-%dT%H:%M:%S') if x.dtype == 'datetime64[ns]' else x)
+    flt_start = time.time()
+    dict_timing['hash'] = dict_layer['fn_sql_hash'](list_timestamp_fields or [],
+                                                    list_formats + fn_list_geojson_options(dict_layer))
+    dict_timing['skipped'] = dict_timing['hash'] == str_previous_hash
+    dict_timing['prepare'] = time.time() - flt_start
+    if dict_timing['skipped']:
+        dict_timing['upload'] = 0.0
+        dict_timing['features'] = '-'
+        return dict_timing
 
-    # Convert to GeoJSON in memory ---
-    geojson_buffer = BytesIO()
-    geojson_str = gdf.to_json()
-    geojson_buffer.write(geojson_str.encode('utf-8'))
-    geojson_buffer.seek(0)
+    flt_start = time.time()
+    list_s3_outputs = [(dict_layer['s3_key_base'] + DICT_OUTPUT_FORMATS[str_format][0],
+                        DICT_OUTPUT_FORMATS[str_format][1]) for str_format in list_formats]
+    dict_timing['features'] = dict_layer['fn_sql_copy'](str_bucket_name, list_s3_outputs, str_cache_control)
+    dict_timing['upload'] = time.time() - flt_start
+    dict_timing['keys'] = {str_format: str_s3_key for str_format, (str_s3_key, _) in zip(list_formats, list_s3_outputs)}
 
-    # Upload to S3 ---
-    s3 = boto3.client('s3')
-    s3.upload_fileobj(geojson_buffer, str_bucket_name, str_s3_key)
-    print(f"  -- Uploaded to s3://{str_bucket_name}/{str_s3_key}")
+    return dict_timing
 # ----------------------
 
 
+# ----------------
+def fn_get_run_prefix(str_publish_sub_folder, str_model_run_time):
+    # Immutable per-cycle prefix, e.g. 'runs/20250713T120000/'
+    if str_model_run_time is None:
+        str_model_run_time = datetime.datetime.utcnow()
+    str_run = pd.Timestamp(str_model_run_time).strftime('%Y%m%dT%H%M%S')
+    return f"{str_publish_sub_folder}runs/{str_run}/"
+# ----------------
+
+
+# ----------------
+def fn_prune_run_prefixes(str_bucket_name, str_publish_sub_folder, int_retention, set_keep_prefixes):
+    """
+    Delete all but the newest int_retention prefixes under {sub}runs/.
+    Prefixes in set_keep_prefixes (still referenced by latest.json) are never deleted.
+    """
+    s3 = fn_get_s3_client()
+    paginator = s3.get_paginator('list_objects_v2')
+
+    list_prefixes = []
+    for page in paginator.paginate(Bucket=str_bucket_name, Prefix=f"{str_publish_sub_folder}runs/", Delimiter='/'):
+        list_prefixes.extend(dict_prefix['Prefix'] for dict_prefix in page.get('CommonPrefixes', []))
+
+    # Prefix names are yyyymmddThhmmss, so they sort by time
+    list_prefixes.sort()
+    list_delete = [str_prefix for str_prefix in list_prefixes[:max(len(list_prefixes) - int_retention, 0)]
+                   if str_prefix not in set_keep_prefixes]
+
+    for str_prefix in list_delete:
+        for page in paginator.paginate(Bucket=str_bucket_name, Prefix=str_prefix):
+            list_objects = [{'Key': dict_obj['Key']} for dict_obj in page.get('Contents', [])]
+            if list_objects:
+                s3.delete_objects(Bucket=str_bucket_name, Delete={'Objects': list_objects, 'Quiet': True})
+        print(f"  -- Pruned s3://{str_bucket_name}/{str_prefix}")
+# ----------------
+
+
 # ----------------------
-def fn_write_gdf_to_s3_esrijson(gdf, str_bucket_name, str_s3_key):
-    # Convert datetime columns to string ISO format
-    gdf = gdf.apply(lambda x: x.dt.strftime('%Y-%m-%dT%H:%M:%S') if x.dtype == 'datetime64[ns]' else x)
+def fn_publish_layer(dict_layer, str_model_run_time, str_bucket_name, list_formats,
+                     list_timestamp_fields=None, str_previous_hash=None, str_cache_control=None):
+    # One independent read -> prepare -> upload chain; returns its timings.
+    # If str_previous_hash matches the layer's content hash, the upload is skipped.
+    # Esri JSON needs the GeoDataFrame, so those layers stay on the geopandas path
+    if 'fn_sql_copy' in dict_layer and not dict_layer.get('esrijson'):
+        return fn_publish_layer_sql(dict_layer, str_bucket_name, list_formats,
+                                    list_timestamp_fields, str_previous_hash, str_cache_control)
 
-    # Convert GeoDataFrame to GeoJSON string first
-    geojson_str = gdf.to_json()
+    dict_timing = {'layer': dict_layer['name']}
 
-    # Convert GeoJSON string to Python dict
-    geojson_dict = json.loads(geojson_str)
+    flt_start = time.time()
+    gdf = dict_layer['fn_read']()
+    dict_timing['read'] = time.time() - flt_start
 
-    # Convert GeoJSON dict to ESRI JSON string using esrijson.dumps()
-    esri_json_str = esrijson.dumps(geojson_dict)
+    flt_start = time.time()
+    gdf = dict_layer['fn_prepare'](gdf, str_model_run_time)
+    if dict_layer.get('properties'):
+        gdf = gdf[[col for col in gdf.columns
+                   if col == gdf.geometry.name or col in dict_layer['properties']]]
+    dict_timing['prepare'] = time.time() - flt_start
 
-    # Upload ESRI JSON string to S3
-    geojson_buffer = BytesIO(esri_json_str.encode('utf-8'))
-    s3 = boto3.client('s3')
-    s3.upload_fileobj(geojson_buffer, str_bucket_name, str_s3_key)
+    dict_timing['features'] = len(gdf)
+    dict_timing['hash'] = fn_layer_content_hash(gdf, list_timestamp_fields or [],
+                                                list_formats + fn_list_geojson_options(dict_layer) +
+                                                (['esrijson'] if dict_layer.get('esrijson') else []))
+    dict_timing['skipped'] = dict_timing['hash'] == str_previous_hash
+    if dict_timing['skipped']:
+        dict_timing['upload'] = 0.0
+        return dict_timing
 
-    print(f"  -- Uploaded ESRI JSON to s3://{str_bucket_name}/{str_s3_key}")
+    flt_start = time.time()
+    dict_timing['keys'] = {}
+    for str_format in list_formats:
+        str_suffix, str_content_encoding = DICT_OUTPUT_FORMATS[str_format]
+        str_s3_key = dict_layer['s3_key_base'] + str_suffix
+
+        if str_format in ('fgb', 'parquet'):
+            fn_write_gdf_to_s3_binary(gdf, str_bucket_name, str_s3_key, str_format, str_cache_control)
+        else:
+            fn_write_gdf_to_s3(gdf, str_bucket_name, str_s3_key, str_content_encoding, str_cache_control,
+                               **dict_layer.get('geojson_options', {}))
+        dict_timing['keys'][str_format] = str_s3_key
+
+    if dict_layer.get('esrijson'):
+        str_s3_key = dict_layer['s3_key_base'] + '_esrijson.json'
+        fn_write_gdf_to_s3_esrijson(gdf, str_bucket_name, str_s3_key, str_cache_control,
+                                    **dict_layer.get('geojson_options', {}))
+        dict_timing['keys']['esrijson'] = str_s3_key
+    dict_timing['upload'] = time.time() - flt_start
+
+    return dict_timing
 # ----------------------
 
 
-# ----------------
-def fn_assign_warn_class(row):
-    if row['is_overtop'] == 1:
-        return 'overtopped'
-    elif row['min_dist_to_low_ch'] < 0.5:
-        return 'critical'
-    elif 0.5 <= row['min_dist_to_low_ch'] < 2:
-        return 'high'
-    elif 2 <= row['min_dist_to_low_ch'] < 5:
-        return 'moderate'
-    else:
-        return 'low'
-# ----------------
+# ----------------------
+def fn_split_by_district(gdf, gdf_districts, str_district_field, b_clip=True):
+    """
+    Rows of gdf intersecting each district polygon (sjoin, STRtree index).
+    A feature crossing a boundary goes to every district it touches; with
+    b_clip only its part inside the district (so the district folders do not
+    overlap), otherwise the whole feature in each of them.  Parts of a lower
+    dimension (a line just touching the boundary) are dropped.
+
+    Returns:
+        dict: district code -> GeoDataFrame (empty for districts without rows)
+    """
+    gdf = gdf.reset_index(drop=True)
+    gdf_valid = gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty]
+    gdf_join = gpd.sjoin(gdf_valid[[gdf.geometry.name]], gdf_districts[[str_district_field, 'geometry']],
+                         how='inner', predicate='intersects')
+    dict_district_geometry = dict(zip(gdf_districts[str_district_field], gdf_districts.geometry))
+
+    dict_split = {str_code: gdf.iloc[0:0] for str_code in gdf_districts[str_district_field]}
+    for str_code, gdf_group in gdf_join.groupby(str_district_field):
+        gdf_district = gdf.loc[gdf_group.index.unique()]
+        if b_clip:
+            # Only the features crossing the boundary are clipped
+            geom_district = dict_district_geometry[str_code]
+            arr_within = gdf_district.geometry.within(geom_district).values
+            if not arr_within.all():
+                gdf_clipped = gpd.clip(gdf_district[~arr_within], geom_district, keep_geom_type=True)
+                gdf_district = pd.concat([gdf_district[arr_within], gdf_clipped]).sort_index()
+        dict_split[str_code] = gdf_district
+    return dict_split
+# ----------------------
+
+
+# ----------------------
+def fn_publish_folder(list_layers, str_publish_sub_folder, str_model_run_time, dict_publish):
+    """
+    Publish list_layers into one folder of the bucket: the layer chains run
+    concurrently, then manifest.json, status.json, the optional vector tiles
+    and (immutable_runs) latest.json with pruning of old runs.
+    """
+    str_bucket_name = dict_publish['bucket']
+
+    # --- Where this cycle is written ---
+    str_layer_prefix = str_publish_sub_folder
+    str_cache_control = None
+    dict_previous_latest = {}
+    if dict_publish['immutable_runs']:
+        str_layer_prefix = fn_get_run_prefix(str_publish_sub_folder, str_model_run_time)
+        str_cache_control = dict_publish['run_cache_control']
+        dict_previous_latest = fn_read_json_from_s3(str_bucket_name, f"{str_publish_sub_folder}latest.json")
+        print(f"  -- Publishing to s3://{str_bucket_name}/{str_layer_prefix}")
+
+    for dict_layer in list_layers:
+        dict_layer['s3_key_base'] = str_layer_prefix + dict_layer['name']
+
+    # --- Run the layer chains concurrently ---
+    str_s3_manifest_key = f"{str_publish_sub_folder}manifest.json"
+    str_s3_status_key = f"{str_publish_sub_folder}status.json"
+
+    dict_previous_hashes = {}
+    if dict_publish['skip_unchanged']:
+        if dict_publish['immutable_runs']:
+            # The hashes of the objects latest.json points at -- manifest.json is
+            # written before latest.json and may describe a cycle that never went live
+            dict_previous_hashes = {str_layer: str_hash
+                                    for str_layer, str_hash in dict_previous_latest.get('hashes', {}).items()
+                                    if str_layer in dict_previous_latest.get('layers', {})}
+        else:
+            dict_previous_hashes = fn_read_json_from_s3(str_bucket_name, str_s3_manifest_key).get('layers', {})
+
+    list_timings = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=dict_publish['max_workers']) as executor:
+        list_futures = [executor.submit(fn_metric_bind(fn_publish_layer), dict_layer, str_model_run_time,
+                                        str_bucket_name, dict_publish['formats'], dict_publish['timestamp_fields'],
+                                        dict_previous_hashes.get(dict_layer['name']), str_cache_control)
+                        for dict_layer in list_layers]
+        for future in list_futures:
+            list_timings.append(future.result())
+
+    # Layer chains run on the pool -- recorded from their own timings
+    for dict_timing in list_timings:
+        dict_counters = {'skipped': int(dict_timing['skipped'])}
+        if isinstance(dict_timing['features'], int):
+            dict_counters['features'] = dict_timing['features']
+        fn_metric_record(f"{str_publish_sub_folder}{dict_timing['layer']}",
+                         dict_timing['read'] + dict_timing['prepare'] + dict_timing['upload'],
+                         dict_counters)
+
+    for dict_timing in list_timings:
+        str_upload = 'unchanged, skipped' if dict_timing['skipped'] else f"upload {dict_timing['upload']:.1f} s"
+        print(f"  -- {dict_timing['layer']}: {dict_timing['features']} features -- "
+              f"read {dict_timing['read']:.1f} s, prepare {dict_timing['prepare']:.1f} s, "
+              f"{str_upload}")
+
+    # --- Content hashes of what is now in the bucket, and the per-cycle status ---
+    dict_hashes = {dict_timing['layer']: dict_timing['hash'] for dict_timing in list_timings}
+    fn_write_json_to_s3({'layers': dict_hashes}, str_bucket_name, str_s3_manifest_key)
+
+    dict_status = {
+        'model_run_time': str(str_model_run_time),
+        'updated_utc': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S'),
+        'layers': {dict_timing['layer']: {'changed': not dict_timing['skipped']}
+                   for dict_timing in list_timings}
+    }
+    fn_write_json_to_s3(dict_status, str_bucket_name, str_s3_status_key,
+                        dict_publish['latest_cache_control'] if dict_publish['immutable_runs'] else None)
+
+    # --- Vector tiles ---
+    if dict_publish['vector_tiles']:
+        flt_start = time.time()
+        with fn_metric_stage('vector_tiles'):
+            fn_publish_vector_tiles(dict_publish['db_params'], str_bucket_name,
+                                    f"{str_layer_prefix}fast_layers.pmtiles",
+                                    dict_publish['tile_min_zoom'], dict_publish['tile_max_zoom'],
+                                    dict_publish['max_workers'], str_cache_control,
+                                    s3_client=fn_get_s3_client())
+        print(f"  -- fast_layers.pmtiles: {time.time() - flt_start:.1f} s")
+
+    # --- latest.json last, so clients never see a partly written cycle ---
+    if dict_publish['immutable_runs']:
+        dict_latest_layers = {}
+        for dict_timing in list_timings:
+            if dict_timing['skipped']:
+                dict_latest_layers[dict_timing['layer']] = dict_previous_latest['layers'][dict_timing['layer']]
+            else:
+                dict_latest_layers[dict_timing['layer']] = dict_timing['keys']
+        if dict_publish['vector_tiles']:
+            dict_latest_layers['fast_layers'] = {'pmtiles': f"{str_layer_prefix}fast_layers.pmtiles"}
+
+        dict_latest = {
+            'model_run_time': str(str_model_run_time),
+            'prefix': str_layer_prefix,
+            'layers': dict_latest_layers,
+            'hashes': dict_hashes
+        }
+        fn_write_json_to_s3(dict_latest, str_bucket_name, f"{str_publish_sub_folder}latest.json",
+                            dict_publish['latest_cache_control'])
+
+        # Prefixes still holding objects referenced by latest.json are kept
+        str_runs_root = f"{str_publish_sub_folder}runs/"
+        set_keep_prefixes = {str_runs_root + str_key[len(str_runs_root):].split('/')[0] + '/'
+                             for dict_keys in dict_latest_layers.values()
+                             for str_key in dict_keys.values() if str_key.startswith(str_runs_root)}
+        fn_prune_run_prefixes(str_bucket_name, str_publish_sub_folder, dict_publish['run_retention'],
+                              set_keep_prefixes)
+# ----------------------
 
 
 # .........................................................
@@ -166,6 +1475,9 @@ def fn_push_to_s3(str_config_file_path, b_print_output):
     # --- Read variables from config.ini ---
     config = configparser.ConfigParser()
     config.read(str_config_file_path)
+
+    # The shared S3 client, built before any publish thread starts
+    fn_get_s3_client()
     
     if 'database' in config:
         section = config['database']
@@ -194,146 +1506,244 @@ def fn_push_to_s3(str_config_file_path, b_print_output):
         str_publish_sub_folder = section.get('publish_sub_folder', '').strip()
         if str_publish_sub_folder and not str_publish_sub_folder.endswith('/'):
             str_publish_sub_folder += '/'
+
+        # Optional simplified flood area layers -- 'name:tolerance' pairs in degrees
+        list_simplify_layers = fn_parse_simplify_layers(section.get('flood_ar_simplify', ''))
+
+        # Formats published for every layer, e.g. 'geojson, geojson.gz, fgb, parquet'
+        list_formats = fn_parse_output_formats(section.get('output_formats', 'geojson'))
+
+        # Number of layers read, prepared and uploaded at the same time
+        int_max_workers = section.getint('max_workers', 4)
+
+        # Skip uploading layers whose geometry and attributes did not change;
+        # timestamp fields are left out of the comparison and go to status.json
+        b_skip_unchanged = section.getboolean('skip_unchanged', False)
+        list_timestamp_fields = [str_item.strip() for str_item in
+                                 section.get('timestamp_fields', 'model_run_time').split(',') if str_item.strip()]
+
+        # GeoJSON size: coordinate decimals (all layers, and 'layer:decimals' overrides),
+        # compact separators and optional 'properties_<layer>' allowlists
+        str_precision = section.get('coordinate_precision', '').strip()
+        int_precision = int(str_precision) if str_precision else None
+        dict_layer_precision = {str_name: int(flt_value) for str_name, flt_value in
+                                fn_parse_simplify_layers(section.get('coordinate_precision_layers', ''))}
+        b_compact_json = section.getboolean('compact_json', False)
+        dict_layer_properties = {
+            str_key[len('properties_'):]: [str_item.strip() for str_item in str_value.split(',') if str_item.strip()]
+            for str_key, str_value in section.items() if str_key.startswith('properties_')}
+
+        # Layers also published as Esri JSON (<layer>_esrijson.json), e.g. 'bridge_warning_pnts, flood_ar'
+        list_esrijson_layers = [str_item.strip() for str_item in
+                                section.get('esrijson_layers', '').split(',') if str_item.strip()]
+
+        # Build the GeoJSON in PostGIS and stream it out with COPY (GeoJSON formats only)
+        b_sql_geojson = section.getboolean('sql_geojson', False)
+        if b_sql_geojson and any(str_format in ('fgb', 'parquet') for str_format in list_formats):
+            raise ValueError("sql_geojson supports only the geojson, geojson.gz and geojson.br output formats")
+
+        # Write every cycle under an immutable runs/<model_run_time>/ prefix with long-lived
+        # cache headers; latest.json (short TTL) is written last and points at it
+        b_immutable_runs = section.getboolean('immutable_runs', False)
+        int_run_retention = section.getint('run_retention', 24)
+        str_run_cache_control = section.get('run_cache_control', 'public, max-age=31536000, immutable')
+        str_latest_cache_control = section.get('latest_cache_control', 'public, max-age=60')
+
+        # Optional vector tiles of flood areas, flooded roads and bridges in one PMTiles archive
+        b_vector_tiles = section.getboolean('vector_tiles', False)
+        int_tile_min_zoom = section.getint('vector_tile_min_zoom', 5)
+        int_tile_max_zoom = section.getint('vector_tile_max_zoom', 14)
+
+        # Flood areas and flooded roads of every forecast hour (flood_ar_h000, flood_road_nav_ln_h000, ...),
+        # built by step 02 with [sql] hourly_layers = True
+        b_hourly_layers = section.getboolean('hourly_layers', False)
     else:
         raise KeyError("Missing [write_to_s3] section in config file")
+
+    # Statewide mode: the database holds the statewide run; every layer is read
+    # once and split into per-district folders with the district polygons
+    b_statewide = 'statewide' in config
+    if b_statewide:
+        section = config['statewide']
+        str_district_file_path = section.get('district_boundary_path', '')
+        str_district_field = section.get('district_field', 'dist_abbr')
+        str_district_sub_folder = section.get('district_sub_folder', '{district}/')
+        # Features crossing a district boundary: clipped to each district, or whole in each
+        b_clip_to_district = section.getboolean('clip_to_district', True)
+        list_districts = [str_item.strip() for str_item in section.get('districts', '').split(',') if str_item.strip()]
+
+        if b_sql_geojson:
+            raise ValueError("sql_geojson is not supported with [statewide]")
+
+    dict_publish = {
+        'bucket': str_bucket_name,
+        'formats': list_formats,
+        'max_workers': int_max_workers,
+        'skip_unchanged': b_skip_unchanged,
+        'timestamp_fields': list_timestamp_fields,
+        'immutable_runs': b_immutable_runs,
+        'run_retention': int_run_retention,
+        'run_cache_control': str_run_cache_control,
+        'latest_cache_control': str_latest_cache_control,
+        'vector_tiles': b_vector_tiles and not b_statewide,
+        'tile_min_zoom': int_tile_min_zoom,
+        'tile_max_zoom': int_tile_max_zoom,
+        'db_params': db_params,
+    }
         
     # table names in PostgreSQL
     str_bridge_table_name = 's_bridge_warning_pnt'
     str_road_nav_table_name = 's_flood_road_ln'
     str_road_table_name = 's_flood_road_trim_ln'
     str_inundation_table_name = 's_flood_merge_ar'
-    
-    gdf_s_bridge_warning_pnt = fn_get_geodataframe_from_postgresql(str_bridge_table_name, db_params,'geometry')
-    gdf_s_flood_road_nav_ln = fn_get_geodataframe_from_postgresql(str_road_nav_table_name , db_params,'geometry')
-    gdf_s_flood_road_trim_ln = fn_get_geodataframe_from_postgresql(str_road_table_name, db_params,'geometry')
-    gdf_s_flood_merge_ar = fn_get_geodataframe_from_postgresql(str_inundation_table_name, db_params,'geometry')
-    
-    # Even if there are no polygons, this shold have one row with model_run_time
-    str_model_run_time = gdf_s_flood_merge_ar.iloc[0]['model_run_time']
-    
-    geometry_fake_area = Polygon([
-            (-97.793186, 30.547194),
-            (-97.7892304, 30.5487087),
-            (-97.7892304, 30.5497087),
-            (-97.793186, 30.547194)
-        ])
-    
-    if gdf_s_flood_merge_ar.iloc[0]['geometry'] is None:
-        gdf_s_flood_merge_ar.at[gdf_s_flood_merge_ar.index[0], 'geometry'] = geometry_fake_area
-        gdf_s_flood_merge_ar['is_real'] = 0
-        gdf_s_flood_merge_ar['is_real'] = gdf_s_flood_merge_ar['is_real'].astype(int)
-        
-    # -- If empty, create a AGOL placeholder for road lines
-    if gdf_s_flood_road_trim_ln.empty:
-        
-        geometry_fake_line = MultiLineString([[
-            (-97.793186, 30.547194),
-            (-97.7892304, 30.5487087)]])
-    
-        # Define placeholder attributes
-        dict_empty_road_data = {
-            'osm_id': [-1],
-            'fclass': ['unknown'],
-            'name': ["This placeholder when there is no flooding that allows AGOL to still load the layer"],
-            'ref': [''],
-            'road_id': [-1],
-            'nextgen_id': [-1],
-            'min_flood_flow': [-1],
-            'max_flow': [-1],
-            'model_run_time': [str_model_run_time],
-            'length_ft': [0],
-            'geometry': [geometry_fake_line]
-        }
-        
-        gdf_s_flood_road_trim_ln = gpd.GeoDataFrame(dict_empty_road_data, crs="EPSG:4326")
-        
-    # -- If empty, create a AGOL placeholder for road lines
-    if gdf_s_flood_road_nav_ln.empty:
-        
-        geometry_fake_line = MultiLineString([[
-            (-97.793186, 30.547194),
-            (-97.7892304, 30.5487087)]])
-    
-        # Define placeholder attributes
-        dict_empty_road_data = {
-            'osm_id': [-1],
-            'fclass': ['unknown'],
-            'name': ["This placeholder when there is no flooding that allows AGOL to still load the layer"],
-            'ref': [''],
-            'road_id': [-1],
-            'nextgen_id': [-1],
-            'min_flood_flow': [-1],
-            'max_flow': [-1],
-            'model_run_time': [str_model_run_time],
-            'length_ft': [0],
-            'geometry': [geometry_fake_line]
-        }
-        
-        gdf_s_flood_road_nav_ln = gpd.GeoDataFrame(dict_empty_road_data, crs="EPSG:4326")
-        
-    # -- If empty, create a AGOL placeholder for bridge warning points
-    if gdf_s_bridge_warning_pnt.empty:
-        
-        geometry_fake_point = Point(-97.793186, 30.547194)
-    
-        # Define placeholder attributes
-        dict_empty_bridge_data = {
-            'BRDG_ID': ['-1'],
-            'uuid_bridge': ['-1'],
-            'min_low_ch': [None],
-            'min_ground': [None],
-            'min_overtop': [None],
-            'name': ["This placeholder when there is no flooding that allows AGOL to still load the layer"],
-            'ref': [''],
-            'nhd_name': [''],
-            'model_run_time': [str_model_run_time],
-            'max_wse': [None],
-            'min_dist_to_low_ch': [100],
-            'is_overtop': ['0'],
-            'depth_array': [[ ]],
-            'url': [''],
-            'warn_class': ['low'],
-            'geometry': [geometry_fake_point]
+    str_inundation_hour_table_name = 's_flood_hour_merge_ar'
+    str_road_hour_table_name = 's_flood_road_hour_ln'
+
+    # Used by the placeholders of empty layers
+    str_model_run_time = fn_get_model_run_time(db_params)
+
+    # onset_hour / flood_hours / recede_hour: when the road floods (step 02, ITEM #2)
+    columns_to_keep_road_nav = ['geometry', 'name', 'ref', 'fclass', 'model_run_time',
+                                'onset_hour', 'flood_hours', 'recede_hour']
+    columns_to_keep_road_trim = ['geometry', 'name', 'ref', 'fclass', 'model_run_time', 'length_ft',
+                                 'onset_hour', 'flood_hours', 'recede_hour']
+
+    # --- Independent layers: table -> prepare (the name is the s3 key) ---
+    list_layers = [
+        {'name': 'bridge_warning_pnts',
+         'fn_read': partial(fn_get_geodataframe_from_postgresql, str_bridge_table_name, db_params, 'geometry'),
+         'fn_prepare': fn_prepare_bridge_warning_pnt},
+        {'name': 'flood_road_nav_ln',
+         'fn_read': partial(fn_get_geodataframe_from_postgresql, str_road_nav_table_name, db_params, 'geometry'),
+         'fn_prepare': partial(fn_prepare_flood_road_ln, list_columns=columns_to_keep_road_nav)},
+        {'name': 'flood_road_trim_ln',
+         'fn_read': partial(fn_get_geodataframe_from_postgresql, str_road_table_name, db_params, 'geometry'),
+         'fn_prepare': partial(fn_prepare_flood_road_ln, list_columns=columns_to_keep_road_trim)},
+        {'name': 'flood_ar',
+         'fn_read': partial(fn_get_geodataframe_from_postgresql, str_inundation_table_name, db_params, 'geometry'),
+         'fn_prepare': fn_prepare_flood_ar},
+    ]
+
+    # --- Simplified flood polygons (coarse layers load first in web clients) ---
+    b_coverage_simplify = fn_has_coverage_simplify(db_params) if list_simplify_layers else False
+    if list_simplify_layers and not b_coverage_simplify:
+        print("  -- ST_CoverageSimplify not available (PostGIS < 3.4): simplified layers may show tile seams")
+    for str_layer_name, flt_tolerance in list_simplify_layers:
+        list_layers.append(
+            {'name': f'flood_ar_{str_layer_name}',
+             'fn_read': partial(fn_get_simplified_geodataframe_from_postgresql, str_inundation_table_name,
+                                db_params, flt_tolerance, ['tile_id', 'model_run_time'], 'geometry',
+                                b_coverage_simplify),
+             'fn_prepare': fn_prepare_flood_ar})
+
+    # --- Per-hour layers (for animation); not in the vector tiles ---
+    list_flood_hours = fn_get_flood_hours(db_params) if b_hourly_layers else []
+    if b_hourly_layers and not list_flood_hours:
+        print("  -- No per-hour flood tables; is [sql] hourly_layers on?")
+    for int_hour in list_flood_hours:
+        list_layers.append(
+            {'name': f'flood_ar_h{int_hour:03d}',
+             'fn_read': partial(fn_get_geodataframe_from_postgresql,
+                                fn_sql_hour_rows(str_inundation_hour_table_name, int_hour) + ' h',
+                                db_params, 'geometry'),
+             'fn_prepare': fn_prepare_flood_ar})
+        list_layers.append(
+            {'name': f'flood_road_nav_ln_h{int_hour:03d}',
+             'fn_read': partial(fn_get_geodataframe_from_postgresql,
+                                fn_sql_hour_rows(str_road_hour_table_name, int_hour) + ' h',
+                                db_params, 'geometry'),
+             'fn_prepare': partial(fn_prepare_flood_road_ln, list_columns=columns_to_keep_road_nav)})
+
+    # --- Per-layer GeoJSON writer options and property allowlists ---
+    for dict_layer in list_layers:
+        dict_layer['geojson_options'] = {
+            'int_precision': dict_layer_precision.get(dict_layer['name'], int_precision),
+            'b_compact': b_compact_json}
+        if dict_layer['name'] in dict_layer_properties:
+            dict_layer['properties'] = dict_layer_properties[dict_layer['name']]
+        dict_layer['esrijson'] = dict_layer['name'] in list_esrijson_layers
+
+    # --- Same layers as SQL queries, when the GeoJSON is built in the database ---
+    if b_sql_geojson:
+        dict_layer_sql = {
+            'bridge_warning_pnts': fn_build_sql_bridge_warning_pnt(str_bridge_table_name),
+            'flood_road_nav_ln': fn_build_sql_flood_road_ln(str_road_nav_table_name, columns_to_keep_road_nav),
+            'flood_road_trim_ln': fn_build_sql_flood_road_ln(str_road_table_name, columns_to_keep_road_trim),
+            'flood_ar': fn_build_sql_flood_ar(str_inundation_table_name),
         }
-        
-        gdf_s_bridge_warning_pnt = gpd.GeoDataFrame(dict_empty_bridge_data, crs="EPSG:4326")
-    
-    # --- Prepare layers for lean TxDOT export ---
-    columns_to_keep_road_nav = ['geometry', 'name', 'ref', 'fclass', 'model_run_time']
-    gdf_s_flood_road_nav_ln = gdf_s_flood_road_nav_ln[columns_to_keep_road_nav]
-    
-    columns_to_keep_road_trim = ['geometry', 'name', 'ref', 'fclass', 'model_run_time', 'length_ft']
-    gdf_s_flood_road_trim_ln = gdf_s_flood_road_trim_ln[columns_to_keep_road_trim]
-    
-    # Prepare prepare bridge worning points for geoJSON
-    gdf_s_bridge_warning_pnt['warn_class'] = gdf_s_bridge_warning_pnt.apply(fn_assign_warn_class, axis=1)
-    columns_to_keep_bridge = ['geometry', 'warn_class', 'BRDG_ID', 'name', 'ref', 'nhd_name', 'min_dist_to_low_ch', 'model_run_time', 'url']
-    gdf_s_bridge_warning_pnt = gdf_s_bridge_warning_pnt[columns_to_keep_bridge]
-    
-    
-    # --- Write the bridge points ---
-    str_s3_bridge_pnt_key = f"{str_publish_sub_folder}bridge_warning_pnts.geojson"
-    fn_write_gdf_to_s3(gdf_s_bridge_warning_pnt, str_bucket_name, str_s3_bridge_pnt_key)
-    #str_s3_bridge_pnt_esri_key = f"{str_publish_sub_folder}bridge_warning_pnts_esrijson.json"
-    #fn_write_gdf_to_s3_esrijson(gdf_s_bridge_warning_pnt, str_bucket_name, str_s3_bridge_pnt_esri_key)
-    
-    # --- Write the navigation road lines ---
-    str_s3_road_nav_ln_key = f"{str_publish_sub_folder}flood_road_nav_ln.geojson"
-    fn_write_gdf_to_s3(gdf_s_flood_road_nav_ln, str_bucket_name, str_s3_road_nav_ln_key)
-    #str_s3_road_nav_ln_esri_key = f"{str_publish_sub_folder}flood_road_nav_ln_esrijson.json"
-    #fn_write_gdf_to_s3_esrijson(gdf_s_flood_road_nav_ln, str_bucket_name, str_s3_road_nav_ln_esri_key)
-    
-    # --- Write the trimmed road lines ---
-    str_s3_road_trim_ln_key = f"{str_publish_sub_folder}flood_road_trim_ln.geojson"
-    fn_write_gdf_to_s3(gdf_s_flood_road_trim_ln, str_bucket_name, str_s3_road_trim_ln_key)
-    #str_s3_road_trim_ln_esri_key = f"{str_publish_sub_folder}flood_road_trim_ln_esrijson.json"
-    #fn_write_gdf_to_s3_esrijson(gdf_s_flood_road_trim_ln, str_bucket_name, str_s3_road_trim_ln_esri_key)
-    
-    # --- Write the flood polygons ---
-    str_s3_flood_ar_key = f"{str_publish_sub_folder}flood_ar.geojson"
-    fn_write_gdf_to_s3(gdf_s_flood_merge_ar, str_bucket_name, str_s3_flood_ar_key)
-    #str_s3_flood_ar_esri_key = f"{str_publish_sub_folder}flood_ar_esrijson.json"
-    #fn_write_gdf_to_s3_esrijson(gdf_s_flood_merge_ar, str_bucket_name, str_s3_flood_ar_esri_key)
+        for str_layer_name, flt_tolerance in list_simplify_layers:
+            dict_layer_sql[f'flood_ar_{str_layer_name}'] = fn_build_sql_flood_ar(
+                str_inundation_table_name, flt_tolerance, ['tile_id', 'model_run_time'], b_coverage_simplify)
+        for int_hour in list_flood_hours:
+            dict_layer_sql[f'flood_ar_h{int_hour:03d}'] = fn_build_sql_flood_hour_ar(
+                str_inundation_hour_table_name, int_hour)
+            dict_layer_sql[f'flood_road_nav_ln_h{int_hour:03d}'] = fn_build_sql_flood_road_ln(
+                fn_sql_hour_rows(str_road_hour_table_name, int_hour), columns_to_keep_road_nav)
+
+        for dict_layer in list_layers:
+            str_layer_sql = dict_layer_sql[dict_layer['name']]
+            if dict_layer.get('properties'):
+                str_layer_sql = fn_build_sql_property_allowlist(str_layer_sql, dict_layer['properties'])
+            dict_layer['fn_sql_copy'] = partial(fn_copy_geojson_to_s3, db_params, str_layer_sql,
+                                                **dict_layer['geojson_options'])
+            dict_layer['fn_sql_hash'] = partial(fn_sql_layer_content_hash, db_params, str_layer_sql)
+
+    if not b_statewide:
+        fn_publish_folder(list_layers, str_publish_sub_folder, str_model_run_time, dict_publish)
+        return
+
+    # --- Statewide: read each layer once, split it by district ---
+    gdf_districts = gpd.read_file(str_district_file_path).to_crs("EPSG:4326")
+    gdf_districts[str_district_field] = gdf_districts[str_district_field].astype(str)
+    if list_districts:
+        gdf_districts = gdf_districts[gdf_districts[str_district_field].isin(list_districts)]
+    gdf_districts = gdf_districts.dissolve(by=str_district_field).reset_index()
+    print(f"  -- Statewide split into {len(gdf_districts)} districts")
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=int_max_workers) as executor:
+        dict_futures = {dict_layer['name']: executor.submit(fn_metric_bind(dict_layer['fn_read'])) for dict_layer in list_layers}
+        dict_split = {str_name: fn_split_by_district(future.result(), gdf_districts, str_district_field,
+                                                     b_clip_to_district)
+                      for str_name, future in dict_futures.items()}
+
+    for str_code in gdf_districts[str_district_field]:
+        print(f"  -- District {str_code}")
+        list_district_layers = []
+        for dict_layer in list_layers:
+            dict_district_layer = dict(dict_layer)
+            dict_district_layer['fn_read'] = dict_split[dict_layer['name']][str_code].copy
+            list_district_layers.append(dict_district_layer)
+
+        str_district_folder = str_publish_sub_folder + str_district_sub_folder.format(district=str_code)
+        fn_publish_folder(list_district_layers, str_district_folder, str_model_run_time, dict_publish)
+
+    # --- One statewide vector tile archive ---
+    # With immutable_runs under its own runs/<model_run_time>/ prefix (long-lived
+    # cache headers) and a statewide latest.json, as in fn_publish_folder
+    if b_vector_tiles:
+        flt_start = time.time()
+        str_tile_prefix = str_publish_sub_folder
+        str_cache_control = None
+        if b_immutable_runs:
+            str_tile_prefix = fn_get_run_prefix(str_publish_sub_folder, str_model_run_time)
+            str_cache_control = str_run_cache_control
+        str_tile_key = f"{str_tile_prefix}fast_layers.pmtiles"
+
+        with fn_metric_stage('vector_tiles'):
+            fn_publish_vector_tiles(db_params, str_bucket_name, str_tile_key,
+                                    int_tile_min_zoom, int_tile_max_zoom, int_max_workers, str_cache_control,
+                                    s3_client=fn_get_s3_client())
+        print(f"  -- fast_layers.pmtiles: {time.time() - flt_start:.1f} s")
+
+        if b_immutable_runs:
+            dict_latest = {
+                'model_run_time': str(str_model_run_time),
+                'prefix': str_tile_prefix,
+                'layers': {'fast_layers': {'pmtiles': str_tile_key}}
+            }
+            fn_write_json_to_s3(dict_latest, str_bucket_name, f"{str_publish_sub_folder}latest.json",
+                                str_latest_cache_control)
+            fn_prune_run_prefixes(str_bucket_name, str_publish_sub_folder, int_run_retention, {str_tile_prefix})
 # .........................................................
 
 
@@ -0,0 +1,236 @@
+# FAST-realtime update
+# Script - run_metrics
+#
+# Per-stage metrics of one pipeline run: wall time, outcome, peak RSS and
+# counters (bytes fetched from / uploaded to S3, rows written, DB round trips).
+# Written at the end of the run as JSON lines and as a Prometheus
+# textfile-collector file, labelled with the district and model_run_time.
+#
+# The steps only call fn_metric_stage / fn_metric_add; without an active
+# run (a step run on its own) these do nothing.  Work submitted to a thread
+# pool is wrapped with fn_metric_bind so its counters reach the submitting
+# stage.
+#
+# Created by: Andy Carter, PE
+# Created - 2025.07.17
+# ************************************************************
+
+# ************************************************************
+import os
+import json
+import time
+import datetime
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Not available on Windows -- peak RSS is then not reported
+try:
+    import resource
+except ImportError:
+    resource = None
+# ************************************************************
+
+
+# ----------------
+def fn_get_peak_rss_bytes():
+    if resource is None:
+        return None
+    # ru_maxrss is kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+# ----------------
+
+
+# ======================
+class RunMetrics:
+    """
+    Collects the stages of one run.  Stages nest (a step and its sub-steps);
+    a counter added inside a sub-step also counts toward every enclosing stage
+    and toward the run total (the outermost stage of the thread that created
+    the run).  The open stages are a context variable: a worker thread sees
+    the stages of the thread that submitted it when the work is wrapped with
+    fn_metric_bind, otherwise none but the run total.
+    """
+
+    def __init__(self, dict_labels=None):
+        self.dict_labels = dict(dict_labels or {})
+        self.list_stages = []
+        self.list_open = []
+        self.list_roots = []
+        self.lock = threading.Lock()
+        self.int_main_thread = threading.get_ident()
+        self.var_stack = contextvars.ContextVar(f"run_metrics_stack_{id(self)}", default=())
+
+    def _stack(self):
+        # Open stages of the calling context, outermost first -- a context
+        # copied into a worker may hold stages closed since
+        return [dict_stage for dict_stage in self.var_stack.get()
+                if any(dict_stage is dict_open for dict_open in self.list_open)]
+
+    def set_label(self, str_key, value):
+        self.dict_labels[str_key] = str(value)
+
+    @contextmanager
+    def stage(self, str_name):
+        with self.lock:
+            list_stack = self._stack()
+            str_full_name = '/'.join([list_stack[-1]['stage'], str_name]) if list_stack else str_name
+            dict_stage = {'stage': str_full_name, 'outcome': 'success', 'counters': {}}
+            self.list_open.append(dict_stage)
+            if not list_stack and threading.get_ident() == self.int_main_thread:
+                self.list_roots.append(dict_stage)
+        token = self.var_stack.set(tuple(list_stack) + (dict_stage,))
+        flt_start = time.time()
+
+        try:
+            yield dict_stage
+        except BaseException:
+            dict_stage['outcome'] = 'error'
+            raise
+        finally:
+            dict_stage['seconds'] = round(time.time() - flt_start, 3)
+            dict_stage['peak_rss_bytes'] = fn_get_peak_rss_bytes()
+            self.var_stack.reset(token)
+            with self.lock:
+                # By identity -- two threads may hold stages that compare equal
+                self.list_open = [dict_open for dict_open in self.list_open if dict_open is not dict_stage]
+                self.list_roots = [dict_root for dict_root in self.list_roots if dict_root is not dict_stage]
+                self.list_stages.append(dict_stage)
+
+    def add(self, str_counter, value):
+        with self.lock:
+            # Only the stages of the calling context: a concurrent step's
+            # counters stay out of the other steps
+            list_stages = self._stack()
+            if self.list_roots and not any(dict_stage is self.list_roots[0] for dict_stage in list_stages):
+                list_stages.insert(0, self.list_roots[0])
+            for dict_stage in list_stages:
+                dict_stage['counters'][str_counter] = dict_stage['counters'].get(str_counter, 0) + value
+
+    def record(self, str_name, flt_seconds, dict_counters=None, str_outcome='success'):
+        # A sub-step timed elsewhere (e.g. inside a thread pool)
+        with self.lock:
+            list_stack = self._stack()
+            str_parent = list_stack[-1]['stage'] if list_stack else ''
+            self.list_stages.append({'stage': f"{str_parent}/{str_name}" if str_parent else str_name,
+                                     'outcome': str_outcome,
+                                     'counters': dict(dict_counters or {}),
+                                     'seconds': round(flt_seconds, 3),
+                                     'peak_rss_bytes': None})
+
+    def write_jsonl(self, str_path):
+        # One line per stage, appended -- a history across runs
+        str_time = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S')
+        with open(str_path, 'a') as file_out:
+            for dict_stage in self.list_stages:
+                file_out.write(json.dumps({'time_utc': str_time, **self.dict_labels, **dict_stage}) + '\n')
+
+    def write_prometheus(self, str_path):
+        # Textfile collector: written to a temporary file and renamed, so
+        # node_exporter never reads a partial file
+        def fn_escape(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        def fn_labels(dict_extra):
+            dict_all = {**self.dict_labels, **dict_extra}
+            return '{' + ','.join(f'{str_key}="{fn_escape(value)}"' for str_key, value in dict_all.items()) + '}'
+
+        list_lines = [
+            '# HELP fast_stage_seconds Wall time of a FAST pipeline stage',
+            '# TYPE fast_stage_seconds gauge']
+        for dict_stage in self.list_stages:
+            list_lines.append(f"fast_stage_seconds{fn_labels({'stage': dict_stage['stage']})} {dict_stage['seconds']}")
+
+        list_lines += [
+            '# HELP fast_stage_success 1 if the stage finished without error',
+            '# TYPE fast_stage_success gauge']
+        for dict_stage in self.list_stages:
+            list_lines.append(f"fast_stage_success{fn_labels({'stage': dict_stage['stage']})} "
+                              f"{1 if dict_stage['outcome'] == 'success' else 0}")
+
+        list_lines += [
+            '# HELP fast_stage_peak_rss_bytes Peak resident memory of the process at the end of the stage',
+            '# TYPE fast_stage_peak_rss_bytes gauge']
+        for dict_stage in self.list_stages:
+            if dict_stage['peak_rss_bytes'] is not None:
+                list_lines.append(f"fast_stage_peak_rss_bytes{fn_labels({'stage': dict_stage['stage']})} "
+                                  f"{dict_stage['peak_rss_bytes']}")
+
+        set_counters = sorted({str_counter for dict_stage in self.list_stages for str_counter in dict_stage['counters']})
+        for str_counter in set_counters:
+            list_lines += [f'# TYPE fast_stage_{str_counter} gauge']
+            for dict_stage in self.list_stages:
+                if str_counter in dict_stage['counters']:
+                    list_lines.append(f"fast_stage_{str_counter}{fn_labels({'stage': dict_stage['stage']})} "
+                                      f"{dict_stage['counters'][str_counter]}")
+
+        list_lines += [
+            '# HELP fast_run_last_timestamp_seconds Unix time the run finished',
+            '# TYPE fast_run_last_timestamp_seconds gauge',
+            f"fast_run_last_timestamp_seconds{fn_labels({})} {time.time():.0f}"]
+
+        str_temp_path = str_path + '.tmp'
+        with open(str_temp_path, 'w') as file_out:
+            file_out.write('\n'.join(list_lines) + '\n')
+        os.replace(str_temp_path, str_path)
+# ======================
+
+
+# The run of this process, set by the orchestrator
+RUN_METRICS = None
+
+
+# ----------------
+def fn_start_run_metrics(dict_labels):
+    global RUN_METRICS
+    RUN_METRICS = RunMetrics(dict_labels)
+    return RUN_METRICS
+# ----------------
+
+
+# ----------------
+@contextmanager
+def fn_metric_stage(str_name):
+    if RUN_METRICS is None:
+        yield None
+    else:
+        with RUN_METRICS.stage(str_name) as dict_stage:
+            yield dict_stage
+# ----------------
+
+
+# ----------------
+def fn_metric_add(str_counter, value):
+    if RUN_METRICS is not None:
+        RUN_METRICS.add(str_counter, value)
+# ----------------
+
+
+# ----------------
+def fn_metric_record(str_name, flt_seconds, dict_counters=None, str_outcome='success'):
+    if RUN_METRICS is not None:
+        RUN_METRICS.record(str_name, flt_seconds, dict_counters, str_outcome)
+# ----------------
+
+
+# ----------------
+def fn_metric_set_label(str_key, value):
+    if RUN_METRICS is not None:
+        RUN_METRICS.set_label(str_key, value)
+# ----------------
+
+
+# ----------------
+def fn_metric_bind(fn):
+    """
+    fn to run on another thread (executor.submit / map) in a copy of the
+    calling thread's context, so stages and counters of the worker nest under
+    the stages open here.  Each call gets its own copy -- one context cannot
+    be entered by two threads at once.
+    """
+    context = contextvars.copy_context()
+
+    def fn_bound(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+    return fn_bound
+# ----------------
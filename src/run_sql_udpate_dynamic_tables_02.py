@@ -5,20 +5,43 @@
 # Created by: Andy Carter, PE
 # Created - 2025.05.01
 # Revised - 2025.06.12 -- Allow Graceful Timeout of SQL
+# Revised - 2025.07.03 -- Parallel per-tile union across multiple connections
+# Revised - 2025.07.04 -- Build static lookup tables when missing
+# Revised - 2025.07.17 -- Per-stage metrics (run_metrics)
+# Revised - 2025.07.19 -- Static table check and prewarm callable ahead of the update
+# Revised - 2025.07.22 -- Refresh only when no reach crossed a threshold (skip_unchanged_cycles)
+# Revised - 2025.07.23 -- Advisory lock key per district and database; optional
+#                         per-host gate around the SQL (fast_district_scheduler)
+# Revised - 2025.07.25 -- Optional per-hour flood layers ([sql] hourly_layers)
 # ************************************************************
 
 
 # ************************************************************
 import psycopg2
+from psycopg2 import sql
 import os
+import hashlib
+import contextlib
+import concurrent.futures
+from tqdm import tqdm
 
 import argparse
 import configparser
 import time
 import datetime
 import warnings
+
+from run_metrics import fn_metric_add, fn_metric_bind
 # ************************************************************
 
+# Set by fast_district_scheduler: a semaphore shared by the districts on
+# this database host, held while the dynamic SQL runs
+SQL_GATE = None
+
+# Tables created by roadflood_create_static_tables.sql
+LIST_STATIC_TABLES = ['t_flood_flow_step', 's_tile_grid_ar',
+                      't_tile_flood_inundation', 's_tile_road_segment_ln', 't_reach_flow_threshold']
+
 
 # ^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
 def is_valid_file(parser, arg):
@@ -44,6 +67,54 @@ def fn_str_to_bool(value):
 # ----------------
 
 
+# ---------------
+def fn_get_lock_key(config):
+    """
+    Advisory lock key of this district's updates: [sql] lock_key, else a
+    stable hash of the database name and the district ([metrics] district,
+    default the database name).  Advisory locks are per database, so the
+    old constant 20250628 never blocked one district database on another;
+    the district part keeps configs that write different schemas of one
+    database apart.  Configs that write the same tables must share a key.
+
+    Returns:
+        int: positive bigint
+    """
+    if config.has_option('sql', 'lock_key'):
+        return config.getint('sql', 'lock_key')
+
+    str_dbname = config.get('database', 'dbname', fallback='')
+    str_district = config.get('metrics', 'district', fallback=str_dbname)
+    str_digest = hashlib.sha1(f"{str_dbname}/{str_district}".encode('utf-8')).hexdigest()
+    return int(str_digest[:16], 16) & 0x7FFFFFFFFFFFFFFF
+# ---------------
+
+
+# ---------------
+def fn_set_lock_key(cursor, db_config):
+    # fast.lock_key for this session, read by the SQL files' pg_advisory_lock;
+    # a key already given through PGOPTIONS (backfill) wins
+    if db_config.get('lock_key') is None or 'fast.lock_key' in os.environ.get('PGOPTIONS', ''):
+        return
+    cursor.execute("SELECT set_config('fast.lock_key', %s, false)", (str(db_config['lock_key']),))
+# ---------------
+
+
+# ---------------
+@contextlib.contextmanager
+def fn_sql_gate():
+    # Wait for a slot on this database host (no-op outside the scheduler)
+    if SQL_GATE is None:
+        yield
+        return
+
+    flt_start = time.time()
+    with SQL_GATE:
+        fn_metric_add('sql_gate_wait_seconds', round(time.time() - flt_start, 3))
+        yield
+# ---------------
+
+
 # ---------------
 def fn_run_sql_script(db_config, sql_file_path):
     try:
@@ -61,8 +132,164 @@ def fn_run_sql_script(db_config, sql_file_path):
         cursor = conn.cursor()
 
         try:
+            fn_set_lock_key(cursor, db_config)
             cursor.execute(sql_script)
             conn.commit()
+            fn_metric_add('db_round_trips', 1)
+            print("  -- SQL script executed successfully")
+            return "success"
+        except psycopg2.errors.QueryCanceled:
+            print("  !! SQL query exceeded statement_timeout and was canceled")
+            return "timeout"
+        except Exception as e:
+            print(f"  !! SQL execution error: {e}")
+            return "error"
+
+    finally:
+        if 'cursor' in locals():
+            cursor.close()
+        if 'conn' in locals():
+            conn.close()
+# ---------------
+
+
+# ---------------
+def fn_split_sql_on_tile_union(sql_script):
+    """
+    Split the SQL script at the '-- @@ TILE_UNION_BEGIN' / '-- @@ TILE_UNION_END'
+    markers.  Returns (head, block, tail) or None if the markers are missing.
+    """
+    str_begin = '-- @@ TILE_UNION_BEGIN'
+    str_end = '-- @@ TILE_UNION_END'
+
+    if str_begin not in sql_script or str_end not in sql_script:
+        return None
+
+    str_head, str_rest = sql_script.split(str_begin, 1)
+    str_block, str_tail = str_rest.split(str_end, 1)
+    return str_head, str_block, str_tail
+# ---------------
+
+
+# ---------------
+def fn_union_tile_batch(db_config, str_tile_union_sql, list_tile_ids, str_statement_timeout,
+                        str_queue_schema='public'):
+    # Run the tile union block for a batch of tiles on its own connection.
+    # A temp copy of t_tile_union_queue holding only this batch shadows the
+    # queue of the head (in str_queue_schema), so the block from the SQL file
+    # runs unchanged.
+    flt_start = time.time()
+
+    conn = psycopg2.connect(
+        host=db_config['host'],
+        dbname=db_config['dbname'],
+        user=db_config['user'],
+        password=db_config['password']
+    )
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SET statement_timeout TO %s", (str_statement_timeout,))
+            cursor.execute(
+                sql.SQL("CREATE TEMP TABLE t_tile_union_queue ON COMMIT DROP AS "
+                        "SELECT * FROM {}.t_tile_union_queue WHERE tile_id = ANY(%s)").format(
+                    sql.Identifier(str_queue_schema)),
+                (list_tile_ids,))
+            cursor.execute(str_tile_union_sql)
+        conn.commit()
+        fn_metric_add('db_round_trips', 3)
+    finally:
+        conn.close()
+
+    return list_tile_ids, time.time() - flt_start
+# ---------------
+
+
+# ---------------
+def fn_run_sql_script_parallel(db_config, sql_file_path, int_connections, int_tile_batch_size):
+    # Same as fn_run_sql_script, but the tile union block of the script is
+    # dispatched per batch of tiles across a pool of connections.  Not atomic:
+    # the head is committed before the batches run, so a failed or timed-out
+    # batch leaves the tables half-updated until the next cycle (the
+    # incremental script clears t_incremental_state in its head, so that
+    # next cycle is a full rebuild)
+    with open(sql_file_path, 'r') as sql_file:
+        sql_script = sql_file.read()
+
+    tup_parts = fn_split_sql_on_tile_union(sql_script)
+    if tup_parts is None:
+        print("  -- No tile union markers in SQL file; running serially")
+        return fn_run_sql_script(db_config, sql_file_path)
+
+    str_head, str_block, str_tail = tup_parts
+
+    try:
+        conn = psycopg2.connect(
+            host=db_config['host'],
+            dbname=db_config['dbname'],
+            user=db_config['user'],
+            password=db_config['password']
+        )
+        print("  -- Connected to the database")
+
+        cursor = conn.cursor()
+
+        try:
+            # --- Everything up to the tile union (advisory lock is held by this session) ---
+            fn_set_lock_key(cursor, db_config)
+            cursor.execute(str_head)
+            conn.commit()
+            fn_metric_add('db_round_trips', 1)
+
+            cursor.execute("SHOW statement_timeout")
+            str_statement_timeout = cursor.fetchone()[0]
+
+            # Schema the head created the queue in (first on its search_path --
+            # a backfill cycle schema or a district schema, not always public)
+            cursor.execute("SELECT n.nspname FROM pg_class c "
+                           "JOIN pg_namespace n ON n.oid = c.relnamespace "
+                           "WHERE c.oid = 't_tile_union_queue'::regclass")
+            str_queue_schema = cursor.fetchone()[0]
+
+            # A tile may be queued more than once (one row per range of hours in
+            # roadflood_hourly_flood_layers.sql) -- all its rows go in one batch
+            cursor.execute("SELECT DISTINCT tile_id FROM t_tile_union_queue ORDER BY tile_id")
+            list_tile_ids = [row[0] for row in cursor.fetchall()]
+            conn.commit()
+
+            list_batches = [list_tile_ids[i:i + int_tile_batch_size]
+                            for i in range(0, len(list_tile_ids), int_tile_batch_size)]
+
+            print(f"  -- Merging {len(list_tile_ids)} tiles on {int_connections} connections")
+
+            # --- Per-tile union across the connection pool ---
+            list_tile_timing = []
+            with concurrent.futures.ThreadPoolExecutor(max_workers=int_connections) as executor:
+                list_futures = [executor.submit(fn_metric_bind(fn_union_tile_batch), db_config, str_block,
+                                                list_batch, str_statement_timeout, str_queue_schema)
+                                for list_batch in list_batches]
+
+                with tqdm(total=len(list_tile_ids), desc="  -- Tiles", ncols=60) as bar:
+                    for future in concurrent.futures.as_completed(list_futures):
+                        list_batch, flt_seconds = future.result()
+                        list_tile_timing.extend(
+                            [(tile_id, len(list_batch), round(flt_seconds, 2)) for tile_id in list_batch])
+                        bar.update(len(list_batch))
+
+            # --- Record per-tile timing ---
+            cursor.execute("DROP TABLE IF EXISTS t_tile_union_log")
+            cursor.execute("CREATE TABLE t_tile_union_log "
+                           "(tile_id BIGINT, batch_size INTEGER, seconds DOUBLE PRECISION)")
+            if list_tile_timing:
+                cursor.executemany("INSERT INTO t_tile_union_log VALUES (%s, %s, %s)", list_tile_timing)
+
+            list_slowest = sorted(list_tile_timing, key=lambda x: x[2], reverse=True)[:3]
+            for tile_id, int_batch, flt_seconds in list_slowest:
+                print(f"  -- Slow tile {tile_id}: {flt_seconds} sec (batch of {int_batch})")
+
+            # --- Everything after the tile union ---
+            cursor.execute(str_tail)
+            conn.commit()
+            fn_metric_add('db_round_trips', 1)
             print("  -- SQL script executed successfully")
             return "success"
         except psycopg2.errors.QueryCanceled:
@@ -80,6 +307,102 @@ def fn_run_sql_script(db_config, sql_file_path):
 # ---------------
 
 
+# ---------------
+def fn_list_missing_tables(db_config, list_table_names):
+    # Return the tables in list_table_names that do not exist in the database
+    conn = psycopg2.connect(
+        host=db_config['host'],
+        dbname=db_config['dbname'],
+        user=db_config['user'],
+        password=db_config['password']
+    )
+    try:
+        with conn.cursor() as cursor:
+            list_missing = []
+            for str_table_name in list_table_names:
+                cursor.execute("SELECT to_regclass(%s)", (str_table_name,))
+                if cursor.fetchone()[0] is None:
+                    list_missing.append(str_table_name)
+    finally:
+        conn.close()
+
+    return list_missing
+# ---------------
+
+
+# ---------------
+def fn_ensure_static_tables(db_config, static_sql_file_path):
+    # Build the static lookup tables when any is missing
+    list_missing = fn_list_missing_tables(db_config, LIST_STATIC_TABLES)
+    if not list_missing:
+        return "success"
+
+    print(f"  -- Missing static tables {list_missing}; building from {static_sql_file_path}")
+    return fn_run_sql_script(db_config, static_sql_file_path)
+# ---------------
+
+
+# ---------------
+def fn_prewarm_tables(db_config, list_table_names):
+    # Load the tables (and their indexes) into shared buffers with pg_prewarm,
+    # when the extension is installed.  Returns the number of blocks read.
+    conn = psycopg2.connect(
+        host=db_config['host'],
+        dbname=db_config['dbname'],
+        user=db_config['user'],
+        password=db_config['password']
+    )
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_prewarm'")
+            if cursor.fetchone() is None:
+                return 0
+
+            cursor.execute("""
+                SELECT COALESCE(SUM(pg_prewarm(c.oid)), 0)
+                FROM pg_class c
+                WHERE c.oid IN (SELECT to_regclass(t) FROM unnest(%s::text[]) AS t)
+                   OR c.oid IN (SELECT indexrelid FROM pg_index
+                                WHERE indrelid IN (SELECT to_regclass(t) FROM unnest(%s::text[]) AS t))
+            """, (list_table_names, list_table_names))
+            int_blocks = cursor.fetchone()[0]
+            fn_metric_add('db_round_trips', 2)
+    finally:
+        conn.close()
+
+    return int_blocks
+# ---------------
+
+
+# ---------------
+def fn_get_reaches_changed(db_config):
+    # Reaches that crossed a threshold in the cycle now in t_flow_forecast
+    # (written by step 01), or None when step 01 did not check this cycle
+    conn = psycopg2.connect(
+        host=db_config['host'],
+        dbname=db_config['dbname'],
+        user=db_config['user'],
+        password=db_config['password']
+    )
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('t_flow_change')")
+            if cursor.fetchone()[0] is None:
+                return None
+            cursor.execute("""
+                SELECT c.reaches_changed
+                FROM t_flow_change c
+                WHERE c.model_run_time = (SELECT model_run_time FROM t_flow_forecast LIMIT 1)
+            """)
+            row = cursor.fetchone()
+            fn_metric_add('db_round_trips', 2)
+    finally:
+        conn.close()
+
+    return row[0] if row else None
+# ---------------
+
+
 # .........................................................
 def fn_run_sql_udpate_dynamic_tables(str_config_file_path, b_print_output):
     # suppress all warnings
@@ -119,6 +442,8 @@ def fn_run_sql_udpate_dynamic_tables(str_config_file_path, b_print_output):
         if db_config['password'] == 'xxx':
             db_config['password'] = os.environ.get('DB_PASSWORD', '')
 
+        db_config['lock_key'] = fn_get_lock_key(config)
+
         sql_file_path = config['sql'].get('sql_file_path', '')
         if not sql_file_path:
             print("  !! SQL file path not provided in config")
@@ -126,6 +451,28 @@ def fn_run_sql_udpate_dynamic_tables(str_config_file_path, b_print_output):
 
         print(f"  -- SQL file: {sql_file_path}")
 
+        # Static lookup tables (built once per static-data release)
+        static_sql_file_path = config['sql'].get(
+            'static_sql_file_path',
+            os.path.join(os.path.dirname(sql_file_path), 'roadflood_create_static_tables.sql'))
+
+        # Optional: number of connections for the per-tile union (1 = single statement)
+        int_parallel_connections = config['sql'].getint('parallel_connections', 1)
+        int_tile_batch_size = config['sql'].getint('tile_batch_size', 1)
+
+        # Optional: when step 01 found no reach crossing a threshold, run only
+        # the refresh script (flows, peaks, model_run_time)
+        b_skip_unchanged_cycles = config['sql'].getboolean('skip_unchanged_cycles', False)
+        refresh_sql_file_path = config['sql'].get(
+            'refresh_sql_file_path',
+            os.path.join(os.path.dirname(sql_file_path), 'roadflood_refresh_unchanged_cycle.sql'))
+
+        # Optional: flood areas and flooded roads for every forecast hour, after the update
+        b_hourly_layers = config['sql'].getboolean('hourly_layers', False)
+        hourly_sql_file_path = config['sql'].get(
+            'hourly_sql_file_path',
+            os.path.join(os.path.dirname(sql_file_path), 'roadflood_hourly_flood_layers.sql'))
+
     except Exception as e:
         print(f"  !! Error reading config file: {e}")
         return "error"
@@ -133,7 +480,37 @@ def fn_run_sql_udpate_dynamic_tables(str_config_file_path, b_print_output):
     # --- Run SQL ---
     try:
         print("  -- Connecting to the database")
-        result = fn_run_sql_script(db_config, sql_file_path)
+
+        with fn_sql_gate():
+            result = fn_ensure_static_tables(db_config, static_sql_file_path)
+            if result != "success":
+                return result
+
+            result = None
+            if b_skip_unchanged_cycles and fn_get_reaches_changed(db_config) == 0:
+                print("  -- No reach crossed a flood threshold; refreshing flows and model_run_time only")
+                result = fn_run_sql_script(db_config, refresh_sql_file_path)
+                if result == "success":
+                    fn_metric_add('refresh_only', 1)
+                else:
+                    print("  -- Refresh failed; running the full update")
+                    result = None
+
+            if result is None:
+                if int_parallel_connections > 1:
+                    result = fn_run_sql_script_parallel(db_config, sql_file_path,
+                                                        int_parallel_connections, int_tile_batch_size)
+                else:
+                    result = fn_run_sql_script(db_config, sql_file_path)
+
+            # The hours move with the hydrograph even in a refresh-only cycle
+            if result == "success" and b_hourly_layers:
+                print(f"  -- Per-hour flood layers: {hourly_sql_file_path}")
+                if int_parallel_connections > 1:
+                    result = fn_run_sql_script_parallel(db_config, hourly_sql_file_path,
+                                                        int_parallel_connections, int_tile_batch_size)
+                else:
+                    result = fn_run_sql_script(db_config, hourly_sql_file_path)
         return result  # Expected: 'success', 'timeout', or 'error'
     except Exception as e:
         print(f"  !! SQL execution failed: {e}")
@@ -0,0 +1,290 @@
+# FAST-realtime update
+# Script 04 - vector_tiles_04
+#
+# Mapbox vector tiles of the flood areas, flooded roads and bridge warnings,
+# built in PostGIS with ST_AsMVT and packaged as a single PMTiles archive.
+# Web clients fetch only the visible tiles with HTTP range requests.
+# (called from push_to_s3_04 when [write_to_s3] vector_tiles = True)
+#
+# Created by: Andy Carter, PE
+# Created - 2025.07.11
+# Revised - 2025.07.24 -- onset_hour, flood_hours and recede_hour on flood_road_trim_ln
+# Revised - 2025.07.25 -- Tiles built a batch at a time in one set-based query, not one query per tile
+# ************************************************************
+
+# ************************************************************
+import boto3
+import psycopg2
+import os
+import math
+import gzip
+import tempfile
+import concurrent.futures
+
+# Optional: PMTiles archive writer
+try:
+    from pmtiles.tile import zxy_to_tileid, TileType, Compression
+    from pmtiles.writer import Writer as PMTilesWriter
+except ImportError:
+    PMTilesWriter = None
+# ************************************************************
+
+
+# Same classes as fn_assign_warn_class in push_to_s3_04
+STR_SQL_WARN_CLASS = """
+    CASE
+        WHEN t.is_overtop::text = '1' THEN 'overtopped'
+        WHEN t.min_dist_to_low_ch::double precision < 0.5 THEN 'critical'
+        WHEN t.min_dist_to_low_ch::double precision < 2 THEN 'high'
+        WHEN t.min_dist_to_low_ch::double precision < 5 THEN 'moderate'
+        ELSE 'low'
+    END"""
+
+# Tile layers -- name, source table, attribute expressions and their MVT field types
+LIST_TILE_LAYERS = [
+    {'name': 'flood_ar',
+     'table': 's_flood_merge_ar',
+     'columns': {'model_run_time': "t.model_run_time::text"},
+     'fields': {'model_run_time': 'String'}},
+    {'name': 'flood_road_trim_ln',
+     'table': 's_flood_road_trim_ln',
+     'columns': {'name': "t.name",
+                 'ref': "t.ref",
+                 'fclass': "t.fclass",
+                 'length_ft': "t.length_ft::double precision",
+                 'model_run_time': "t.model_run_time::text",
+                 'onset_hour': "t.onset_hour",
+                 'flood_hours': "t.flood_hours",
+                 'recede_hour': "t.recede_hour"},
+     'fields': {'name': 'String', 'ref': 'String', 'fclass': 'String',
+                'length_ft': 'Number', 'model_run_time': 'String',
+                'onset_hour': 'Number', 'flood_hours': 'Number', 'recede_hour': 'Number'}},
+    {'name': 'bridge_warning_pnts',
+     'table': 's_bridge_warning_pnt',
+     'columns': {'warn_class': STR_SQL_WARN_CLASS,
+                 'BRDG_ID': 't."BRDG_ID"::text',
+                 'name': "t.name",
+                 'ref': "t.ref",
+                 'nhd_name': "t.nhd_name",
+                 'min_dist_to_low_ch': "t.min_dist_to_low_ch::double precision",
+                 'model_run_time': "t.model_run_time::text",
+                 'url': "t.url"},
+     'fields': {'warn_class': 'String', 'BRDG_ID': 'String', 'name': 'String', 'ref': 'String',
+                'nhd_name': 'String', 'min_dist_to_low_ch': 'Number',
+                'model_run_time': 'String', 'url': 'String'}},
+]
+
+INT_TILE_EXTENT = 4096
+INT_TILE_BUFFER = 64
+
+
+# ----------------
+def fn_get_connection(db_params):
+    return psycopg2.connect(
+        host=db_params.get("host"),
+        dbname=db_params.get("dbname"),
+        user=db_params.get("user"),
+        password=db_params.get("password"),
+        port=db_params.get("port", "5432")
+    )
+# ----------------
+
+
+# ----------------
+def fn_build_tile_sql():
+    # One query per batch of tiles (arrays of z, x, y): each layer is joined
+    # to the tile envelopes (GIST index on geometry), clipped with
+    # ST_AsMVTGeom and aggregated per tile with ST_AsMVT; the layers of a
+    # tile are concatenated into a single tile
+    list_ctes = ["""
+    tiles AS (
+        SELECT
+            u.z, u.x, u.y,
+            ST_TileEnvelope(u.z, u.x, u.y) AS geom_3857,
+            ST_Transform(ST_TileEnvelope(u.z, u.x, u.y, margin => %(margin)s), 4326) AS geom_4326
+        FROM unnest(%(z)s::integer[], %(x)s::integer[], %(y)s::integer[]) AS u(z, x, y)
+    )"""]
+    list_layers = []
+    list_joins = []
+
+    for dict_layer in LIST_TILE_LAYERS:
+        str_columns = ',\n                '.join(f'{str_expr} AS "{str_col}"'
+                                                 for str_col, str_expr in dict_layer['columns'].items())
+        list_ctes.append(f"""
+    {dict_layer['name']} AS (
+        SELECT b.z, b.x, b.y, ST_AsMVT(l, '{dict_layer['name']}', {INT_TILE_EXTENT}, 'geom') AS mvt
+        FROM tiles b
+        JOIN {dict_layer['table']} t ON t.geometry && b.geom_4326
+        CROSS JOIN LATERAL (
+            SELECT
+                ST_AsMVTGeom(ST_Transform(t.geometry, 3857), b.geom_3857,
+                             {INT_TILE_EXTENT}, {INT_TILE_BUFFER}, true) AS geom,
+                {str_columns}
+        ) l
+        WHERE l.geom IS NOT NULL
+        GROUP BY b.z, b.x, b.y
+    )""")
+        list_layers.append(f"""
+    COALESCE({dict_layer['name']}.mvt, ''::bytea)""")
+        list_joins.append(f"""
+LEFT JOIN {dict_layer['name']}
+  ON {dict_layer['name']}.z = b.z AND {dict_layer['name']}.x = b.x AND {dict_layer['name']}.y = b.y""")
+
+    return ("WITH" + ",".join(list_ctes) + "\nSELECT b.z, b.x, b.y," + " ||".join(list_layers) +
+            "\nFROM tiles b" + "".join(list_joins))
+# ----------------
+
+
+# ----------------
+def fn_lonlat_to_tile(flt_lon, flt_lat, int_zoom):
+    # Web mercator tile (x, y) containing a lon/lat point
+    int_n = 2 ** int_zoom
+    flt_lat = max(min(flt_lat, 85.0511), -85.0511)
+    int_x = int((flt_lon + 180.0) / 360.0 * int_n)
+    int_y = int((1.0 - math.asinh(math.tan(math.radians(flt_lat))) / math.pi) / 2.0 * int_n)
+    return min(max(int_x, 0), int_n - 1), min(max(int_y, 0), int_n - 1)
+# ----------------
+
+
+# ----------------
+def fn_get_candidate_tiles(db_params, int_min_zoom, int_max_zoom):
+    """
+    Tiles touched by the bounding box of any feature, at every zoom level.
+
+    Returns:
+        (set of (z, x, y), [min_lon, min_lat, max_lon, max_lat] or None)
+    """
+    str_sql = " UNION ALL ".join(
+        f"SELECT ST_XMin(geometry), ST_YMin(geometry), ST_XMax(geometry), ST_YMax(geometry) "
+        f"FROM {dict_layer['table']} WHERE geometry IS NOT NULL AND NOT ST_IsEmpty(geometry)"
+        for dict_layer in LIST_TILE_LAYERS)
+
+    connection = fn_get_connection(db_params)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(str_sql)
+            list_boxes = cursor.fetchall()
+    finally:
+        connection.close()
+
+    set_tiles = set()
+    list_bounds = None
+    for flt_xmin, flt_ymin, flt_xmax, flt_ymax in list_boxes:
+        if list_bounds is None:
+            list_bounds = [flt_xmin, flt_ymin, flt_xmax, flt_ymax]
+        else:
+            list_bounds = [min(list_bounds[0], flt_xmin), min(list_bounds[1], flt_ymin),
+                           max(list_bounds[2], flt_xmax), max(list_bounds[3], flt_ymax)]
+
+        for int_zoom in range(int_min_zoom, int_max_zoom + 1):
+            int_x_min, int_y_max = fn_lonlat_to_tile(flt_xmin, flt_ymin, int_zoom)
+            int_x_max, int_y_min = fn_lonlat_to_tile(flt_xmax, flt_ymax, int_zoom)
+            for int_x in range(int_x_min, int_x_max + 1):
+                for int_y in range(int_y_min, int_y_max + 1):
+                    set_tiles.add((int_zoom, int_x, int_y))
+
+    return set_tiles, list_bounds
+# ----------------
+
+
+# ----------------
+def fn_build_tile_batch(db_params, str_tile_sql, list_tiles):
+    # All tiles of the batch in one query on its own connection; returns
+    # [(tile_id, gzipped tile)] of non-empty tiles
+    list_results = []
+    connection = fn_get_connection(db_params)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(str_tile_sql, {'z': [tup_tile[0] for tup_tile in list_tiles],
+                                          'x': [tup_tile[1] for tup_tile in list_tiles],
+                                          'y': [tup_tile[2] for tup_tile in list_tiles],
+                                          'margin': INT_TILE_BUFFER / INT_TILE_EXTENT})
+            for int_zoom, int_x, int_y, bytes_tile in cursor.fetchall():
+                bytes_tile = bytes(bytes_tile)
+                if bytes_tile:
+                    list_results.append((zxy_to_tileid(int_zoom, int_x, int_y), gzip.compress(bytes_tile)))
+    finally:
+        connection.close()
+    return list_results
+# ----------------
+
+
+# ----------------------
+def fn_publish_vector_tiles(db_params, str_bucket_name, str_s3_key,
+                            int_min_zoom=5, int_max_zoom=14, int_max_workers=4,
+                            str_cache_control=None, int_tile_batch_size=2048, s3_client=None):
+    """
+    Build the vector tiles for int_min_zoom..int_max_zoom and upload them
+    as one PMTiles archive to s3://str_bucket_name/str_s3_key (with s3_client,
+    the caller's shared client, if given).
+
+    Returns:
+        int: number of non-empty tiles written.
+    """
+    if PMTilesWriter is None:
+        raise ImportError("vector_tiles requires the 'pmtiles' package")
+
+    set_tiles, list_bounds = fn_get_candidate_tiles(db_params, int_min_zoom, int_max_zoom)
+    # Sorted by zoom, so a batch holds tiles of one or two zooms
+    list_tiles = sorted(set_tiles)
+    print(f"  -- Vector tiles: {len(list_tiles)} candidate tiles, zoom {int_min_zoom}-{int_max_zoom}")
+
+    str_tile_sql = fn_build_tile_sql()
+    list_batches = [list_tiles[i:i + int_tile_batch_size]
+                    for i in range(0, len(list_tiles), int_tile_batch_size)]
+
+    list_tile_data = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=int_max_workers) as executor:
+        list_futures = [executor.submit(fn_build_tile_batch, db_params, str_tile_sql, list_batch)
+                        for list_batch in list_batches]
+        for future in list_futures:
+            list_tile_data.extend(future.result())
+
+    # PMTiles directories are ordered by tile id
+    list_tile_data.sort(key=lambda tup: tup[0])
+
+    if list_bounds is None:
+        list_bounds = [0.0, 0.0, 0.0, 0.0]
+
+    dict_header = {
+        'tile_type': TileType.MVT,
+        'tile_compression': Compression.GZIP,
+        'min_zoom': int_min_zoom,
+        'max_zoom': int_max_zoom,
+        'min_lon_e7': int(list_bounds[0] * 1e7),
+        'min_lat_e7': int(list_bounds[1] * 1e7),
+        'max_lon_e7': int(list_bounds[2] * 1e7),
+        'max_lat_e7': int(list_bounds[3] * 1e7),
+        'center_zoom': int_min_zoom,
+        'center_lon_e7': int((list_bounds[0] + list_bounds[2]) / 2 * 1e7),
+        'center_lat_e7': int((list_bounds[1] + list_bounds[3]) / 2 * 1e7),
+    }
+    dict_metadata = {
+        'name': 'fast_layers',
+        'format': 'pbf',
+        'vector_layers': [{'id': dict_layer['name'],
+                           'fields': dict_layer['fields'],
+                           'minzoom': int_min_zoom,
+                           'maxzoom': int_max_zoom}
+                          for dict_layer in LIST_TILE_LAYERS],
+    }
+
+    with tempfile.TemporaryDirectory() as str_temp_dir:
+        str_local_path = os.path.join(str_temp_dir, os.path.basename(str_s3_key))
+
+        with open(str_local_path, 'wb') as file_out:
+            writer = PMTilesWriter(file_out)
+            for int_tile_id, bytes_tile in list_tile_data:
+                writer.write_tile(int_tile_id, bytes_tile)
+            writer.finalize(dict_header, dict_metadata)
+
+        dict_extra_args = {'ContentType': 'application/vnd.pmtiles'}
+        if str_cache_control:
+            dict_extra_args['CacheControl'] = str_cache_control
+
+        s3 = s3_client or boto3.session.Session().client('s3')
+        s3.upload_file(str_local_path, str_bucket_name, str_s3_key, ExtraArgs=dict_extra_args)
+
+    print(f"  -- Uploaded {len(list_tile_data)} tiles to s3://{str_bucket_name}/{str_s3_key}")
+    return len(list_tile_data)
+# ----------------------
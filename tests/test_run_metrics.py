@@ -0,0 +1,66 @@
+# Tests of run_metrics: counters of work run on thread pools reach the
+# stages of the thread that submitted it, not the other open stages
+# ************************************************************
+import os
+import sys
+import unittest
+import concurrent.futures
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import run_metrics
+from run_metrics import fn_start_run_metrics, fn_metric_stage, fn_metric_add, fn_metric_bind
+# ************************************************************
+
+
+# ======================
+class TestRunMetricsThreads(unittest.TestCase):
+
+    def setUp(self):
+        self.run_metrics = fn_start_run_metrics({'district': 'test'})
+
+    def tearDown(self):
+        run_metrics.RUN_METRICS = None
+
+    def fn_counters(self):
+        return {dict_stage['stage']: dict_stage['counters'] for dict_stage in self.run_metrics.list_stages}
+
+    def test_nested_pools(self):
+        # run > step (DAG pool) > upload (writer pool), next to a concurrent step
+        def fn_upload(int_bytes):
+            fn_metric_add('bytes', int_bytes)
+
+        def fn_step(str_name, int_bytes):
+            with fn_metric_stage(str_name):
+                fn_metric_add('bytes', 1)
+                with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+                    list_futures = [executor.submit(fn_metric_bind(fn_upload), int_bytes) for _ in range(5)]
+                    for future in list_futures:
+                        future.result()
+
+        with fn_metric_stage('run'):
+            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+                list_futures = [executor.submit(fn_metric_bind(fn_step), 'step_a', 2),
+                                executor.submit(fn_metric_bind(fn_step), 'step_b', 10)]
+                for future in list_futures:
+                    future.result()
+
+        dict_counters = self.fn_counters()
+        self.assertEqual(dict_counters['run/step_a'], {'bytes': 11})
+        self.assertEqual(dict_counters['run/step_b'], {'bytes': 51})
+        self.assertEqual(dict_counters['run'], {'bytes': 62})
+
+    def test_unbound_thread_counts_toward_run_only(self):
+        with fn_metric_stage('run'):
+            with fn_metric_stage('step'):
+                with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+                    executor.submit(fn_metric_add, 'bytes', 3).result()
+
+        dict_counters = self.fn_counters()
+        self.assertEqual(dict_counters['run/step'], {})
+        self.assertEqual(dict_counters['run'], {'bytes': 3})
+# ======================
+
+
+if __name__ == '__main__':
+    unittest.main()